@@ -2,9 +2,26 @@ import base64
 import os
 import cv2
 import tempfile
-from openai import AzureOpenAI
 import time
 from app.utils.product_extractor import extract_product_name
+from app.utils.answer_parsing import NOT_VISIBLE_PHRASES, stream_fields_complete
+from app.utils.llm_router import get_pool
+from app.utils.retry_policy import call_with_retry, mark_dispatched
+from app.utils.image_tiling import Tile, build_pyramid_tiles, describe_tile_region, needs_tiling, tile_heading
+from app.utils.panorama import PANORAMA_FRAME_MAX_SIDE, downscale, stitch_panoramas
+from app.utils.frame_selection import COVERAGE_CANDIDATE_STRIDE, CoverageSelector, SharpestFramePicker
+from app.tools.packshot_matcher import answer_from_packshots, get_packshot_matcher
+from app.utils.price_tag_regions import crop_region, describe_region, propose_label_regions
+from app.utils.shelf_share import (compute_shelf_share, dedupe_regions, describe_shelf_share, frame_offsets,
+                                   match_product, parse_regions, regions_from_data, to_shelf_coordinates)
+from app.utils.shelf_diff import (DIFF_MAX_CHANGED_SHARE, align_previous, changed_regions, crop_regions_to_image,
+                                  merge_inventory, regions_to_json, transform_regions)
+from app.utils.artifacts import file_content_hash, load_json_artifact, save_json_artifact
+from app.utils.video_decode import decode_sampled_frames, frame_shape
+from app.utils.frame_prep import FramePrepStage
+from app.utils.frame_store import FrameStoreWriter, frame_store_key, load_frame_store
+from app.utils.viewer_cache import SpriteSheetBuilder, cache_detection_frames
+from app.utils.stream_monitor import STREAM_SAMPLE_FPS, ChangeTrigger, Observation, RollingWindow, StreamReader
 from dotenv import load_dotenv
 load_dotenv()
 import asyncio
@@ -19,15 +36,70 @@ import time
 from collections import deque
 import json
 
-# Token and request rate limits
-TOKENS_PER_MIN = 120_000
-REQUESTS_PER_MIN = 1_200
+# Token estimates charged against each deployment's rate-limit bucket
+# (per-deployment limits live in app/utils/llm_router.py)
 ESTIMATED_TOKENS_PER_REQUEST = 1400  # Estimate: prompt + image + response
-
-# Time window
-WINDOW_SECONDS = 60
-token_usage_log = deque()
-request_log = deque()
+ESTIMATED_TOKENS_PER_PRESCREEN = 250  # Low-detail image is a fixed ~85 tokens + short prompt
+ESTIMATED_TOKENS_PER_CLASSIFY = 150
+ESTIMATED_TOKENS_PER_SUMMARY = 3000
+ESTIMATED_TOKENS_PER_CRITIC = 3000
+ESTIMATED_TOKENS_PER_PRICE_CROPS = 2600  # Up to 8 crops of one 512 px high-detail tile each
+ESTIMATED_TOKENS_PER_REGIONS = 2200  # Full frame plus a JSON list of boxes
+
+# Streaming frame responses: close the stream as soon as the fields the pipeline
+# needs (direct answer, visibility, product_name) have been parsed
+STREAM_FRAME_RESPONSES = os.getenv("STREAM_FRAME_RESPONSES", "false").lower() == "true"
+
+# Resolution cascade: every frame gets a cheap low-detail presence check first and
+# only "yes"/"maybe" frames are re-sent at high detail with the full query prompt
+RESOLUTION_CASCADE = os.getenv("RESOLUTION_CASCADE", "false").lower() == "true"
+
+# Tile large single images (see app/utils/image_tiling.py for size thresholds)
+IMAGE_TILING = os.getenv("IMAGE_TILING", "false").lower() == "true"
+
+# Timeline heuristics: a response counts as a detection when it uses a presence
+# keyword and none of the uncertainty phrases
+PRESENCE_KEYWORDS = ["located", "visible", "is on", "can be seen", "placed", "sitting", "present", "seen"]
+UNCERTAIN_PHRASES = ["not visible", "not found", "unclear", "could be", "might be", "probably"]
+
+# Stitch lateral pan videos into panoramas and analyze those instead of every sampled frame
+VIDEO_PANORAMA = os.getenv("VIDEO_PANORAMA", "false").lower() == "true"
+
+# Replace fixed-interval sampling with the smallest frame set covering the pan
+# (see app/utils/frame_selection.py)
+FRAME_COVERAGE_SELECTION = os.getenv("FRAME_COVERAGE_SELECTION", "false").lower() == "true"
+
+# Send the sharpest frame of each sampling window instead of the fixed-index one
+SHARPNESS_PICKING = os.getenv("SHARPNESS_PICKING", "false").lower() == "true"
+
+# Answer identification, brand and location queries from the local packshot catalog
+# when a frame matches confidently (see app/tools/packshot_matcher.py)
+PACKSHOT_MATCHING = os.getenv("PACKSHOT_MATCHING", "false").lower() == "true"
+
+# Price queries send high-resolution crops of proposed shelf labels in one request
+# instead of the full frame
+PRICE_TAG_CROPS = os.getenv("PRICE_TAG_CROPS", "false").lower() == "true"
+# When no crop shows a readable price, the full frame is only sent as well if the
+# prescreen saw the product in the frame, or always with this flag
+PRICE_CROP_FALLBACK = os.getenv("PRICE_CROP_FALLBACK", "false").lower() == "true"
+
+# Count queries ask each frame for product bounding regions once and compute
+# share-of-shelf locally (see app/utils/shelf_share.py) instead of narrative estimates
+SHELF_SHARE_LOCAL = os.getenv("SHELF_SHARE_LOCAL", "false").lower() == "true"
+
+# Decode long videos in parallel time ranges across processes (see app/utils/video_decode.py)
+PARALLEL_DECODE = os.getenv("PARALLEL_DECODE", "false").lower() == "true"
+
+# Resize/JPEG/base64 frames in a process pool fed through shared memory (see
+# app/utils/frame_prep.py); otherwise frames are prepared on the executor threads
+FRAME_PREP_PROCESSES = os.getenv("FRAME_PREP_PROCESSES", "false").lower() == "true"
+
+# Keep sampled frames of each video in a memory-mapped store keyed by content hash,
+# so follow-up questions on the same video skip decoding (see app/utils/frame_store.py)
+FRAME_STORE = os.getenv("FRAME_STORE", "false").lower() == "true"
+# Save a thumbnail sprite sheet and the detection frames as JPEGs for the timeline
+# viewer (see app/utils/viewer_cache.py)
+VIEWER_CACHE = os.getenv("VIEWER_CACHE", "false").lower() == "true"
 
 def critic_validate_answer(user_question, direct_answer, reasoning, frame_analysis_text):
     critic_prompt = f"""
@@ -63,77 +135,82 @@ Critic Verdict: <Valid | Invalid>
 Explanation: <what is accurate/inaccurate and why>
 """
 
-    response = client.chat.completions.create(
+    response = get_pool("critic").chat_completion(
+        estimated_tokens=ESTIMATED_TOKENS_PER_CRITIC,
         messages=[
             {"role": "system", "content": "You are an expert QA critic evaluating factual correctness in AI responses."},
             {"role": "user", "content": critic_prompt}
         ],
         max_tokens=400,
-        temperature=0.2,
-        model=AZURE_OPENAI_DEPLOYMENT_NAME
+        temperature=0.2
     )
 
     return response.choices[0].message.content.strip()
 
-async def rate_limited_call(func, *args, **kwargs):
-    now = time.time()
-
-    # Clear old entries
-    while token_usage_log and now - token_usage_log[0][0] > WINDOW_SECONDS:
-        token_usage_log.popleft()
-    while request_log and now - request_log[0] > WINDOW_SECONDS:
-        request_log.popleft()
-
-    current_tokens = sum(tokens for _, tokens in token_usage_log)
-    current_requests = len(request_log)
+async def rate_limited_call(func, *args, estimated_tokens=ESTIMATED_TOKENS_PER_REQUEST, site="frame_vision", **kwargs):
+    # Pick a healthy endpoint for the call site and reserve capacity on its bucket,
+    # then run the blocking request against that endpoint in the executor
+    route = await get_pool(site).acquire(estimated_tokens)
+    current_requests, current_tokens = route.bucket.load()
 
     # Print current load
-    print(f"[📊] Current load: {current_requests} req/min, {current_tokens} tokens/min")
-
-    if (current_tokens + ESTIMATED_TOKENS_PER_REQUEST > TOKENS_PER_MIN) or (current_requests >= REQUESTS_PER_MIN):
-        wait_time = WINDOW_SECONDS - (now - request_log[0])
-        wait_time = max(wait_time, 0.1)
-        print(f"[⏳ Throttling] Waiting {wait_time:.2f}s to avoid exceeding limits...")
-        await asyncio.sleep(wait_time)
-
-    token_usage_log.append((time.time(), ESTIMATED_TOKENS_PER_REQUEST))
-    request_log.append(time.time())
+    print(f"[📊] Current load on {route.bucket.name}: {current_requests} req/min, {current_tokens} tokens/min")
     print(f"[🚀] Making API request at {time.strftime('%H:%M:%S')}")
-    return await func(*args, **kwargs)
+    mark_dispatched()
+
+    loop = asyncio.get_event_loop()
+    try:
+        return await loop.run_in_executor(executor, partial(func, *args, route=route, **kwargs))
+    finally:
+        # Cancelled before the executor started the call: hand back a claimed breaker trial
+        route.release()
 
 def estimate_tokens(prompt: str, model="gpt-4"):
     enc = tiktoken.encoding_for_model(model)
     return len(enc.encode(prompt))
 
-# Azure OpenAI configuration
-AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
-AZURE_OPENAI_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME")
-AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION")
-AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
-
-# Initialize client
-client = AzureOpenAI(
-    api_version=AZURE_OPENAI_API_VERSION,
-    azure_endpoint=AZURE_OPENAI_ENDPOINT,
-    api_key=AZURE_OPENAI_API_KEY,
-)
-
 def encode_image(image_path):
     with open(image_path, "rb") as img_file:
         return base64.b64encode(img_file.read()).decode('utf-8')
 
+def encode_frame(frame, quality=90):
+    # In-memory JPEG + base64 for frames and tiles that never touch disk
+    ok, buffer = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    if not ok:
+        raise ValueError("Could not JPEG-encode frame")
+    return base64.b64encode(buffer.tobytes()).decode('utf-8')
+
+def read_stream_until_complete(stream, frame_number=None) -> str:
+    text = ""
+    closed_early = False
+    try:
+        for chunk in stream:
+            # Azure sends a first chunk with only content filter results
+            if not chunk.choices:
+                continue
+            text += chunk.choices[0].delta.content or ""
+            if stream_fields_complete(text):
+                closed_early = True
+                break
+    finally:
+        stream.close()
+
+    if closed_early:
+        print(f"[✂️ Closed stream early for frame {frame_number} after {len(text)} chars]")
+    return text.strip()
+
 def classify_query_llm(user_query: str) -> str:
     system_prompt = "You are a query classification assistant. Classify the following retail video/image question into one of the following categories:\n" \
                     "- location_query\n- count_query\n- price_query\n- brand_query\n- product_identification\n- generic_query\n\nReturn ONLY the category name."
 
     user_prompt = f"Query: {user_query}\n\nCategory:"
 
-    response = client.chat.completions.create(
+    response = get_pool("classify").chat_completion(
+        estimated_tokens=ESTIMATED_TOKENS_PER_CLASSIFY,
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
         ],
-        model=AZURE_OPENAI_DEPLOYMENT_NAME,
         max_tokens=10,
         temperature=0,
         top_p=1,
@@ -142,20 +219,78 @@ def classify_query_llm(user_query: str) -> str:
 
     return response.choices[0].message.content.strip().lower()
 
-def extract_products_from_image(image_path, user_question, frame_number=None, fps=None, query_type="generic_query"):
+def prescreen_frame(image_path, user_question, frame_number=None, route=None, image_b64=None) -> str:
+    prompt_text = f"""
+Look at this retail shelf image. Is the product, brand, price tag or shelf region the user is asking about present in it?
+
+User Query: {user_question}
+
+Answer with exactly one word: yes, no or maybe.
+"""
+    try:
+        base64_image = image_b64 or encode_image(image_path)
+        # Direct (sync) callers reserve quota here; rate_limited_call passes a reserved route
+        route = route or get_pool("prescreen").acquire_blocking(ESTIMATED_TOKENS_PER_PRESCREEN)
+        response = route.client.chat.completions.create(
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt_text},
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:image/jpeg;base64,{base64_image}",
+                                "detail": "low"
+                            }
+                        }
+                    ]
+                }
+            ],
+            max_tokens=3,
+            temperature=0,
+            model=route.deployment,
+            timeout=10
+        )
+        answer = response.choices[0].message.content.strip().lower()
+        route.record_success()
+    except Exception as e:
+        if route is not None:
+            route.record_error(e)
+        # Never drop a frame because the cheap pass failed, let the full pass decide
+        print(f"[⚠️ Prescreen failed for frame {frame_number}: {type(e).__name__}, sending at high detail]")
+        return "maybe"
+    finally:
+        if route is not None:
+            route.release()
+
+    for verdict in ("yes", "no", "maybe"):
+        if answer.startswith(verdict):
+            return verdict
+    return "maybe"
+
+def extract_products_from_image(image_path, user_question, frame_number=None, fps=None, query_type="generic_query",
+                                stream=None, detail="auto", route=None, raise_errors=False,
+                                image_b64=None, region_context=None):
+    if stream is None:
+        stream = STREAM_FRAME_RESPONSES
     try:
-        base64_image = encode_image(image_path)
+        base64_image = image_b64 or encode_image(image_path)
 
         timestamp_ms = None
-        if frame_number is not None and fps:
+        if region_context:
+            location_context = region_context
+        elif frame_number is not None and fps:
             timestamp_ms = int((frame_number / fps) * 1000)
             location_context = f"\n🖼 Frame Number: {frame_number}\n⏱ Timestamp (ms): {timestamp_ms}"
         else:
             location_context = ""
             
         # Check if API credentials are properly loaded
-        if not all([AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_DEPLOYMENT_NAME, 
-                   AZURE_OPENAI_API_VERSION, AZURE_OPENAI_API_KEY]):
+        route = route or get_pool("frame_vision").acquire_blocking(ESTIMATED_TOKENS_PER_REQUEST)
+        if not route.is_configured():
+            if raise_errors:
+                raise RuntimeError("Azure OpenAI API credentials are missing. Please check your .env file.")
             return "Error: Azure OpenAI API credentials are missing. Please check your .env file."
 
         prompt_text = f"""
@@ -259,7 +394,7 @@ User Query: {user_question}
         Direct Answer: <your best complete answer>
         Reasoning: <brief explanation based on the image content>"""
 
-        response = client.chat.completions.create(
+        response = route.client.chat.completions.create(
             messages=[
                 {
                     "role": "system",
@@ -275,7 +410,8 @@ User Query: {user_question}
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
+                                "url": f"data:image/jpeg;base64,{base64_image}",
+                                "detail": detail
                             }
                         }
                     ]
@@ -284,13 +420,24 @@ User Query: {user_question}
             max_tokens=2048,
             temperature=0.1,
             top_p=1.0,
-            model=AZURE_OPENAI_DEPLOYMENT_NAME,
-            timeout=30  # Add 30 second timeout to prevent hanging
+            model=route.deployment,
+            timeout=30,  # Add 30 second timeout to prevent hanging
+            stream=stream
         )
 
-        return response.choices[0].message.content.strip()
+        if stream:
+            content = read_stream_until_complete(response, frame_number)
+        else:
+            content = response.choices[0].message.content.strip()
+        route.record_success()
+        return content
 
     except Exception as e:
+        if route is not None:
+            route.record_error(e)
+        if raise_errors:
+            # The async pipeline retries and records the outcome instead of a skipped-frame string
+            raise
         error_type = str(type(e).__name__)
         error_message = str(e)
         
@@ -304,55 +451,861 @@ User Query: {user_question}
         else:
             print(f"[⚠️ Skipping frame {frame_number} due to error: {error_type}: {error_message}]")
             return f"[Skipped frame {frame_number} due to error: {error_type}]"
+    finally:
+        if route is not None:
+            route.release()
+
+def read_price_tags(crops_b64, crop_descriptions, user_question, frame_number=None, route=None,
+                    raise_errors=False):
+    """Read prices from several label crops of one frame in a single request"""
+    try:
+        route = route or get_pool("frame_vision").acquire_blocking(ESTIMATED_TOKENS_PER_PRICE_CROPS)
+        crop_list = "\n".join(f"- Crop {i + 1}: {desc}" for i, desc in enumerate(crop_descriptions))
+        prompt_text = f"""
+The following images are high-resolution crops of candidate price labels cut from one retail shelf frame.
+Some crops may not be price labels at all; ignore those.
+
+{crop_list}
+
+User Query: {user_question}
+
+Read the price tags relevant to the query. Mention which product each price belongs to when the label names it.
+
+If none of the crops shows a readable price for the product asked about, answer exactly "The price is not visible in this frame."
+
+Return your answer in the following format exactly:
+
+Direct Answer: <price or a full sentence like "The price is not visible.">
+Reasoning: <which crop the price was read from and what the label says>"""
+
+        content = [{"type": "text", "text": prompt_text}]
+        for crop_b64 in crops_b64:
+            content.append({
+                "type": "image_url",
+                "image_url": {"url": f"data:image/jpeg;base64,{crop_b64}", "detail": "high"}
+            })
+
+        response = route.client.chat.completions.create(
+            messages=[
+                {
+                    "role": "system",
+                    "content": "You are an expert retail shelf analyst that reads shelf-edge price labels accurately."
+                },
+                {"role": "user", "content": content}
+            ],
+            max_tokens=512,
+            temperature=0.1,
+            model=route.deployment,
+            timeout=30
+        )
+        answer = response.choices[0].message.content.strip()
+        route.record_success()
+        return answer
+    except Exception as e:
+        if route is not None:
+            route.record_error(e)
+        if raise_errors:
+            raise
+        print(f"[⚠️ Price crops failed for frame {frame_number}: {type(e).__name__}: {e}]")
+        return None
+    finally:
+        if route is not None:
+            route.release()
+
+def price_tag_crops(frame):
+    """Base64 crops and prompt descriptions for the proposed label regions of a frame"""
+    height, width = frame.shape[:2]
+    regions = propose_label_regions(frame)
+    crops_b64 = [encode_frame(crop_region(frame, region), quality=95) for region in regions]
+    return crops_b64, [describe_region(region, width, height) for region in regions]
+
+def price_read_from_crops(answer) -> bool:
+    return bool(answer) and not any(p in answer.lower() for p in NOT_VISIBLE_PHRASES)
+
+def extract_shelf_regions(image_path, user_question, frame_number=None, route=None, raise_errors=False,
+                          image_b64=None):
+    """Structured per-product bounding regions for one frame, as the model's JSON text"""
+    prompt_text = f"""
+You are analyzing one retail shelf image to measure share of shelf.
+
+Find every block of facings of the same product on the shelf. A block is a group of adjacent
+identical products; put separate blocks of the same product in separate entries.
+
+For each block return the product name (brand and variant as printed on the pack) and its
+bounding box as [x0, y0, x1, y1] in a 0-1000 scale of image width and height, where 0,0 is the
+top-left corner.
+
+User Query (for context only, list all products regardless): {user_question}
+
+Return only JSON in this format:
+{{"regions": [{{"product": "<product name>", "box": [x0, y0, x1, y1]}}]}}
+
+If no products are visible, return {{"regions": []}}."""
+    try:
+        base64_image = image_b64 or encode_image(image_path)
+        route = route or get_pool("frame_vision").acquire_blocking(ESTIMATED_TOKENS_PER_REGIONS)
+        response = route.client.chat.completions.create(
+            messages=[
+                {
+                    "role": "system",
+                    "content": "You are an expert retail shelf analyst that returns precise product locations as JSON."
+                },
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt_text},
+                        {
+                            "type": "image_url",
+                            "image_url": {"url": f"data:image/jpeg;base64,{base64_image}", "detail": "high"}
+                        }
+                    ]
+                }
+            ],
+            max_tokens=1500,
+            temperature=0,
+            response_format={"type": "json_object"},
+            model=route.deployment,
+            timeout=30
+        )
+        content = response.choices[0].message.content.strip()
+        route.record_success()
+        return content
+    except Exception as e:
+        if route is not None:
+            route.record_error(e)
+        if raise_errors:
+            raise
+        print(f"[⚠️ Region extraction failed for frame {frame_number}: {type(e).__name__}: {e}]")
+        return ""
+    finally:
+        if route is not None:
+            route.release()
+
+def describe_frame_regions(regions) -> str:
+    """Readable per-frame line for logs and the frame analysis text"""
+    if not regions:
+        return "Direct Answer: No product regions were detected in this frame.\nReasoning: Structured region extraction."
+    products = sorted({region.product for region in regions})
+    return (
+        f"Direct Answer: {len(regions)} product regions detected: {', '.join(products)}.\n"
+        f"Reasoning: Structured region extraction for share-of-shelf."
+    )
 
 
 MAX_CONCURRENT_TASKS = 30
 executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_TASKS)
 
-async def async_extract_products(image_path, user_question, frame_number, fps, query_type):
-    loop = asyncio.get_event_loop()
+async def async_prescreen_frame(image_path, user_question, frame_number, image_b64=None):
     return await rate_limited_call(
-        loop.run_in_executor,
-        executor,
-        partial(
-            extract_products_from_image,
-            image_path=image_path,
-            user_question=user_question,
-            frame_number=frame_number,
-            fps=fps,
-            query_type=query_type
-        )
+        prescreen_frame,
+        image_path=image_path,
+        user_question=user_question,
+        frame_number=frame_number,
+        image_b64=image_b64,
+        estimated_tokens=ESTIMATED_TOKENS_PER_PRESCREEN,
+        site="prescreen"
+    )
+
+async def async_extract_products(image_path, user_question, frame_number, fps, query_type, stream=None,
+                                 detail="auto", image_b64=None, region_context=None):
+    return await rate_limited_call(
+        extract_products_from_image,
+        image_path=image_path,
+        user_question=user_question,
+        frame_number=frame_number,
+        fps=fps,
+        query_type=query_type,
+        stream=stream,
+        detail=detail,
+        raise_errors=True,
+        image_b64=image_b64,
+        region_context=region_context
+    )
+
+async def async_read_price_tags(crops_b64, crop_descriptions, user_question, frame_number):
+    return await rate_limited_call(
+        read_price_tags,
+        crops_b64=crops_b64,
+        crop_descriptions=crop_descriptions,
+        user_question=user_question,
+        frame_number=frame_number,
+        raise_errors=True,
+        estimated_tokens=ESTIMATED_TOKENS_PER_PRICE_CROPS
+    )
+
+async def async_extract_shelf_regions(image_path, user_question, frame_number, image_b64=None):
+    return await rate_limited_call(
+        extract_shelf_regions,
+        image_path=image_path,
+        user_question=user_question,
+        frame_number=frame_number,
+        raise_errors=True,
+        image_b64=image_b64,
+        estimated_tokens=ESTIMATED_TOKENS_PER_REGIONS
     )
 
 def get_total_tokens(prompt: str, response: str = "", model="gpt-4o"):
     enc = tiktoken.encoding_for_model(model)
     return len(enc.encode(prompt)) + len(enc.encode(response))
 
-async def process_frame(frame, frame_index, fps, user_question, semaphore, query_type):
-    async with semaphore:
-        # Save frame to temp file asynchronously
-        temp_file = tempfile.NamedTemporaryFile(suffix=".jpg", delete=False)
-        filename = temp_file.name
-        temp_file.close()
+async def packshot_answer(frame, user_question, query_type):
+    """Local packshot answer for this frame, or None to ask the vision model"""
+    matcher = get_packshot_matcher()
+    if matcher is None:
+        return None
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(executor, answer_from_packshots, matcher, frame, user_question, query_type)
+
+async def process_frame(frame, frame_index, fps, user_question, semaphore, query_type, stream=None,
+                        cascade=None, packshot=None, price_crops=None, shelf_share=None, prep=None):
+    if cascade is None:
+        cascade = RESOLUTION_CASCADE
+    if packshot is None:
+        packshot = PACKSHOT_MATCHING
+    if price_crops is None:
+        price_crops = PRICE_TAG_CROPS
+    if shelf_share is None:
+        shelf_share = SHELF_SHARE_LOCAL
+    timestamp_ms = int((frame_index / fps) * 1000)
+    loop = asyncio.get_event_loop()
 
-        cv2.imwrite(filename, frame)  # Still uses OpenCV (blocking)
+    if packshot:
+        local = await packshot_answer(frame, user_question, query_type)
+        if local is not None:
+            print(f"[📦 Packshot match frame {frame_index}] Answered locally")
+            return {
+                "frame_index": frame_index,
+                "timestamp_ms": timestamp_ms,
+                "response": local,
+                "prescreen": None,
+                "status": "ok",
+                "attempts": 0,
+                "regions": None
+            }
+
+    # CPU stage runs before taking a network slot, so encoding never holds one up
+    if prep is not None:
+        image_b64 = await prep.prepare(frame)
+        prep.metrics.enter("ready")
+    else:
+        # Full frame at cv2.imwrite's default quality, the bytes the model always got
+        image_b64 = await loop.run_in_executor(executor, encode_frame, frame, 95)
 
-        timestamp_ms = int((frame_index / fps) * 1000)
+    async with semaphore:
+        if prep is not None:
+            prep.metrics.leave("ready")
+            prep.metrics.enter("in_flight")
+        prescreen = None
+        regions = None
+        status, attempts = "ok", 0
 
         try:
-            response = await async_extract_products(
-                filename, user_question, frame_index, fps, query_type
-            )
+            if cascade:
+                prescreen = await async_prescreen_frame(None, user_question, frame_index, image_b64=image_b64)
+                print(f"[🔬 Prescreen frame {frame_index}]: {prescreen}")
+
+            crops_answer = None
+            if prescreen != "no" and price_crops and query_type == "price_query":
+                crops_b64, descriptions = await loop.run_in_executor(executor, price_tag_crops, frame)
+                if crops_b64:
+                    status, crops_answer, attempts = await call_with_retry(
+                        lambda: async_read_price_tags(crops_b64, descriptions, user_question, frame_index),
+                        kind="price_crops", label=f"frame {frame_index} price crops"
+                    )
+                    if status == "failed":
+                        print(f"[🏷️ Frame {frame_index}] Label crops request failed, sending full frame")
+                        crops_answer = None
+                    elif not price_read_from_crops(crops_answer) and (PRICE_CROP_FALLBACK or prescreen == "yes"):
+                        print(f"[🏷️ Frame {frame_index}] No price in {len(crops_b64)} label crops, sending full frame")
+                        crops_answer = None
+
+            if prescreen == "no":
+                # Skipped, not evidence: the summary only sees frames that were actually analyzed
+                status, response = "prescreened_out", None
+            elif crops_answer is not None:
+                response = crops_answer
+            elif shelf_share and query_type == "count_query":
+                status, regions_text, attempts = await call_with_retry(
+                    lambda: async_extract_shelf_regions(None, user_question, frame_index, image_b64=image_b64),
+                    kind="regions", label=f"frame {frame_index} regions"
+                )
+                if status == "failed":
+                    response = f"{type(regions_text).__name__}: {regions_text}"
+                else:
+                    regions = parse_regions(regions_text, frame_index)
+                    response = describe_frame_regions(regions)
+            else:
+                status, response, attempts = await call_with_retry(
+                    lambda: async_extract_products(
+                        None, user_question, frame_index, fps, query_type, stream,
+                        detail="high" if cascade else "auto", image_b64=image_b64
+                    ),
+                    label=f"frame {frame_index}"
+                )
+                if status == "failed":
+                    # Keep the error for logs only, failed frames never reach the summary
+                    response = f"{type(response).__name__}: {response}"
         finally:
-            os.remove(filename)
+            if prep is not None:
+                prep.metrics.leave("in_flight")
 
         return {
             "frame_index": frame_index,
             "timestamp_ms": timestamp_ms,
-            "response": response
+            "response": response,
+            "prescreen": prescreen,
+            "status": status,
+            "attempts": attempts,
+            "regions": regions
         }
 
-async def analyze_video_for_query_async(video_path, user_question, frame_interval=23):
+async def process_tile(tile, width, height, user_question, semaphore, query_type, stream=None):
+    # Encode in the executor before taking a network slot, as process_frame does
+    image_b64 = await asyncio.get_event_loop().run_in_executor(executor, encode_frame, tile.image)
+    async with semaphore:
+        region_context = describe_tile_region(tile, width, height)
+        status, response, attempts = await call_with_retry(
+            lambda: async_extract_products(
+                None, user_question, None, None, query_type, stream,
+                detail="high", image_b64=image_b64, region_context=region_context
+            ),
+            kind="tile", label=tile.label
+        )
+        if status == "failed":
+            response = f"{type(response).__name__}: {response}"
+
+        return {
+            "heading": tile_heading(tile, width, height),
+            "response": response,
+            "status": status,
+            "attempts": attempts
+        }
+
+async def analyze_image_tiles_async(image_path, user_question, query_type, stream=None):
+    # Large shelf shots are split into an overview + overlapping detail tiles that run
+    # concurrently through the rate-limited path and are merged with one summary call.
+    # Returns None when the image is small enough for a single request.
+    loop = asyncio.get_event_loop()
+    image = await loop.run_in_executor(executor, cv2.imread, image_path)
+    if image is None or not needs_tiling(image):
+        return None
+
+    height, width = image.shape[:2]
+    tiles = await loop.run_in_executor(executor, build_pyramid_tiles, image)
+    print(f"[🧩 Tiling {width}x{height} image into {len(tiles) - 1} tiles + overview]")
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_TASKS)
+    results = await asyncio.gather(*[
+        process_tile(tile, width, height, user_question, semaphore, query_type, stream)
+        for tile in tiles
+    ])
+
+    tile_outcomes = {"ok": 0, "retried": 0, "failed": 0}
+    tile_responses = []
+    for result in results:
+        tile_outcomes[result["status"]] += 1
+        if result["status"] != "failed":
+            tile_responses.append(f"🧩 {result['heading']}:\n{result['response']}")
+
+    if not tile_responses:
+        return {
+            "direct_answer": "The image could not be analyzed because every tile request failed. Please try again later.",
+            "reasoning": f"{tile_outcomes['failed']} tiles failed after retries.",
+            "timestamps": [],
+            "product_name": extract_product_name(user_question),
+            "frame_outcomes": tile_outcomes
+        }
+
+    summary = summarize_frame_responses(
+        user_question,
+        "\n\n".join(tile_responses),
+        source="tile-wise analysis of one large shelf image",
+        extra_instructions=(
+            "Each response is labelled with the region of the full image it covers, in full-image pixels. "
+            "Tiles overlap, so the same product can appear in neighbouring tiles: count it once. "
+            "Describe locations relative to the whole shelf image (e.g. top-left, middle shelf, right third).\n"
+        )
+    )
+    return {
+        "direct_answer": summary["direct_answer"],
+        "reasoning": summary["reasoning"],
+        "timestamps": [],
+        "product_name": summary["product_name"],
+        "frame_outcomes": tile_outcomes,
+        "tiles": len(tiles)
+    }
+
+async def process_view(image_path, view_name, view_count, user_question, semaphore, query_type, stream=None):
+    image_b64 = await asyncio.get_event_loop().run_in_executor(executor, encode_image, image_path)
+    async with semaphore:
+        region_context = (
+            f"\n📷 View: {view_name}"
+            f"\n- This is one of {view_count} photos of the same shelf bay taken from different angles."
+        )
+        status, response, attempts = await call_with_retry(
+            lambda: async_extract_products(
+                image_path, user_question, None, None, query_type, stream,
+                image_b64=image_b64, region_context=region_context
+            ),
+            kind="view", label=f"view {view_name}"
+        )
+        if status == "failed":
+            response = f"{type(response).__name__}: {response}"
+
+        return {
+            "view": view_name,
+            "response": response,
+            "status": status,
+            "attempts": attempts
+        }
+
+async def analyze_images_for_query_async(image_paths, user_question, stream=None):
+    # Several photos of one bay (e.g. FrontView*/SideView*): classify once, analyze every
+    # view concurrently under the shared limiter and fuse them with a single summary call
+    query_type = classify_query_llm(user_question)
+    print(f"[🔎 Query classified as]: {query_type}")
+
+    view_names = [os.path.basename(path) for path in image_paths]
+    print(f"[🗂 Multi-view analysis of {len(image_paths)} images]: {', '.join(view_names)}")
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_TASKS)
+    results = await asyncio.gather(*[
+        process_view(path, name, len(image_paths), user_question, semaphore, query_type, stream)
+        for path, name in zip(image_paths, view_names)
+    ])
+
+    view_outcomes = {"ok": 0, "retried": 0, "failed": 0}
+    view_responses = []
+    for result in results:
+        view_outcomes[result["status"]] += 1
+        if result["status"] != "failed":
+            view_responses.append(f"📷 View {result['view']}:\n{result['response']}")
+
+    if not view_responses:
+        result = {
+            "direct_answer": "The images could not be analyzed because every view request failed. Please try again later.",
+            "reasoning": f"{view_outcomes['failed']} views failed after retries.",
+            "timestamps": [],
+            "product_name": extract_product_name(user_question),
+            "supporting_views": [],
+            "frame_outcomes": view_outcomes
+        }
+        print("[🗂 JSON Output from Multi-View]:")
+        print(json.dumps(result, indent=4))
+        return result
+
+    summary = summarize_frame_responses(
+        user_question,
+        "\n\n".join(view_responses),
+        source="view-wise analysis of several photos of the same shelf bay",
+        extra_instructions=(
+            "Each response is labelled with the photo (view) it comes from. The views overlap, "
+            "so a product seen in several views is still one product.\n"
+            "Before the product_name line, add a line in this format exactly:\n"
+            "Supporting Views: <comma-separated view names that support your answer, or none>\n"
+        )
+    )
+
+    supporting_views = []
+    for line in summary["summary_text"].splitlines():
+        if line.lower().startswith("supporting views:"):
+            named = [v.strip() for v in line.partition(":")[2].split(",")]
+            supporting_views = [v for v in view_names if v in named or os.path.splitext(v)[0] in named]
+
+    result = {
+        "direct_answer": summary["direct_answer"],
+        "reasoning": summary["reasoning"],
+        "timestamps": [],
+        "product_name": summary["product_name"],
+        "supporting_views": supporting_views,
+        "frame_outcomes": view_outcomes
+    }
+    print("[🗂 JSON Output from Multi-View]:")
+    print(json.dumps(result, indent=4))
+    return result
+
+def analyze_images_for_query(image_paths, user_question):
+    return asyncio.run(analyze_images_for_query_async(image_paths, user_question))
+
+INVENTORY_ARTIFACT = "inventory.json"
+
+async def extract_region_inventory(image, user_question, label, semaphore):
+    """Structured regions for an image or crop, or None when extraction failed"""
+    async with semaphore:
+        image_b64 = encode_frame(image)
+        status, text, _ = await call_with_retry(
+            lambda: async_extract_shelf_regions(None, user_question, label, image_b64=image_b64),
+            kind="regions", label=label
+        )
+    if status == "failed":
+        return None
+    return parse_regions(text)
+
+async def analyze_bay_changes_async(image_path, previous_image_path, user_question):
+    # Re-audit of a bay photographed before: align to the previous capture, re-analyze only
+    # the regions that changed and reuse the previous inventory for the rest
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_TASKS)
+    loop = asyncio.get_event_loop()
+
+    current, previous, current_hash, previous_hash = await asyncio.gather(
+        loop.run_in_executor(executor, cv2.imread, image_path),
+        loop.run_in_executor(executor, cv2.imread, previous_image_path),
+        loop.run_in_executor(executor, file_content_hash, image_path),
+        loop.run_in_executor(executor, file_content_hash, previous_image_path),
+    )
+    if current is None or previous is None:
+        raise ValueError(f"Could not read {image_path if current is None else previous_image_path}")
+    height, width = current.shape[:2]
+
+    changed, changed_share, mode = [], 1.0, "full"
+    stored = load_json_artifact(current_hash, INVENTORY_ARTIFACT)
+    if stored is not None:
+        # Same capture audited before: nothing to re-analyze
+        inventory, changed_share, mode = regions_from_data(stored), 0.0, "cached"
+    else:
+        prior_data = load_json_artifact(previous_hash, INVENTORY_ARTIFACT)
+        if prior_data is None:
+            print(f"[🗃 No inventory for {os.path.basename(previous_image_path)} yet, building it once]")
+            prior = await extract_region_inventory(previous, user_question, "previous capture", semaphore)
+            if prior is not None:
+                save_json_artifact(previous_hash, INVENTORY_ARTIFACT, {"regions": regions_to_json(prior)})
+        else:
+            prior = regions_from_data(prior_data)
+
+        homography = None
+        if prior is not None:
+            homography = await loop.run_in_executor(executor, align_previous, previous, current)
+        if homography is not None:
+            changed, changed_share = await loop.run_in_executor(executor, changed_regions, previous, current,
+                                                                homography)
+        print(f"[🔀 Bay diff] {len(changed)} changed regions covering {changed_share:.0%} of the capture")
+
+        if homography is None or changed_share > DIFF_MAX_CHANGED_SHARE:
+            inventory = await extract_region_inventory(current, user_question, "current capture", semaphore)
+            changed = []
+        else:
+            mode = "differential"
+            prior_here = transform_regions(prior, homography, previous.shape[1::-1], (width, height))
+            crops = await asyncio.gather(*[
+                extract_region_inventory(current[box.y0:box.y1, box.x0:box.x1], user_question,
+                                         f"changed region {i + 1}", semaphore)
+                for i, box in enumerate(changed)
+            ])
+            # A crop that failed keeps its prior regions instead of dropping them
+            analyzed = [box for box, found in zip(changed, crops) if found is not None]
+            fresh = []
+            for box, found in zip(changed, crops):
+                if found is not None:
+                    fresh.extend(crop_regions_to_image(found, box, width, height))
+            inventory = merge_inventory(prior_here, analyzed, fresh, width, height)
+
+        if inventory is None:
+            result = {
+                "direct_answer": "The capture could not be analyzed because the region extraction failed. Please try again later.",
+                "reasoning": "No inventory could be built for the new capture.",
+                "timestamps": [],
+                "product_name": extract_product_name(user_question),
+                "changed_regions": [],
+                "audit_mode": mode
+            }
+            print("[🔀 JSON Output from Re-Audit]:")
+            print(json.dumps(result, indent=4))
+            return result
+        save_json_artifact(current_hash, INVENTORY_ARTIFACT, {
+            "regions": regions_to_json(inventory),
+            "previous": previous_hash,
+            "changed_share": changed_share
+        })
+
+    inventory_lines = []
+    for region in inventory:
+        inventory_lines.append(
+            f"- {region.product}: x {int(region.x0 * width)}-{int(region.x1 * width)} px, "
+            f"y {int(region.y0 * height)}-{int(region.y1 * height)} px"
+        )
+    change_lines = [f"- x {b.x0}-{b.x1} px, y {b.y0}-{b.y1} px" for b in changed] or ["- none"]
+    combined_text = (
+        f"Shelf inventory of a {width}x{height} px capture:\n" + "\n".join(inventory_lines) +
+        "\n\nRegions that changed since the previous capture:\n" + "\n".join(change_lines)
+    )
+
+    summary = summarize_frame_responses(
+        user_question,
+        combined_text,
+        source="product inventory of a shelf bay, re-audited against its previous capture"
+    )
+    result = {
+        "direct_answer": summary["direct_answer"],
+        "reasoning": summary["reasoning"],
+        "timestamps": [],
+        "product_name": summary["product_name"],
+        "shelf_share": compute_shelf_share(dedupe_regions(inventory)),
+        "changed_regions": [[b.x0, b.y0, b.x1, b.y1] for b in changed],
+        "audit_mode": mode
+    }
+    print("[🔀 JSON Output from Re-Audit]:")
+    print(json.dumps(result, indent=4))
+    return result
+
+def analyze_bay_changes(image_path, previous_image_path, user_question):
+    return asyncio.run(analyze_bay_changes_async(image_path, previous_image_path, user_question))
+
+async def analyze_video_panorama_async(video_path, user_question, query_type, frame_interval=23, stream=None,
+                                        viewer_cache=False):
+    # Lateral pans show the same shelf in many overlapping frames. Stitch the sampled frames
+    # into panoramas, analyze those through the tiling path and map detections back to
+    # frame timestamps. Frames left out of every panorama are analyzed on their own.
+    # Returns None when nothing could be stitched.
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frames, frame_indices, timestamps = [], [], []
+    frame_index = 0
+    sprite = SpriteSheetBuilder() if viewer_cache else None
+
+    while cap.isOpened():
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if frame_index % frame_interval == 0:
+            frames.append(downscale(frame, PANORAMA_FRAME_MAX_SIDE))
+            frame_indices.append(frame_index)
+            timestamps.append(int((frame_index / fps) * 1000))
+            if sprite is not None:
+                sprite.add(frames[-1], frame_index, timestamps[-1])
+        frame_index += 1
+    cap.release()
+
+    loop = asyncio.get_event_loop()
+    panoramas, leftovers = await loop.run_in_executor(None, stitch_panoramas, frames, frame_indices, timestamps)
+    del frames
+    if not panoramas:
+        print("[⚠️ Panorama] Nothing stitched, falling back to per-frame analysis")
+        return None
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_TASKS)
+    jobs = []
+    for pano_number, pano in enumerate(panoramas, start=1):
+        height, width = pano.image.shape[:2]
+        tiles = build_pyramid_tiles(pano.image) if needs_tiling(pano.image) else [
+            Tile(1, 0, 0, 0, 0, width, height, pano.image)
+        ]
+        for tile in tiles:
+            jobs.append((pano_number, pano, tile))
+
+    if leftovers:
+        print(f"[🧵 Panorama] {len(leftovers)} frames are in no panorama, analyzing them per frame")
+    results = await asyncio.gather(
+        *[process_tile(tile, pano.image.shape[1], pano.image.shape[0], user_question, semaphore, query_type, stream)
+          for _, pano, tile in jobs],
+        *[process_frame(frame, frame_index, fps, user_question, semaphore, query_type, stream)
+          for frame, frame_index, _ in leftovers]
+    )
+    results, frame_results = results[:len(jobs)], results[len(jobs):]
+
+    tile_outcomes = {"ok": 0, "retried": 0, "failed": 0, "prescreened_out": 0}
+    tile_responses = []
+    product_timestamps = set()
+    for (pano_number, pano, tile), result in zip(jobs, results):
+        tile_outcomes[result["status"]] += 1
+        if result["status"] == "failed":
+            continue
+        tile_responses.append(f"🧵 Panorama {pano_number}, {result['heading']}:\n{result['response']}")
+
+        response_clean = result["response"].lower()
+        # The overview covers every frame, only detail tiles can place a detection in time
+        if tile.level == 0:
+            continue
+        if any(k in response_clean for k in PRESENCE_KEYWORDS) and not any(p in response_clean for p in UNCERTAIN_PHRASES):
+            start, end = (tile.x0, tile.x1) if pano.axis == "x" else (tile.y0, tile.y1)
+            product_timestamps.update(pano.timestamps_for_range(start, end))
+
+    for result in frame_results:
+        tile_outcomes[result["status"]] += 1
+        if result["status"] in ("failed", "prescreened_out"):
+            continue
+        tile_responses.append(f"🖼 Frame {result['frame_index']} ({result['timestamp_ms']} ms), "
+                              f"not in any panorama:\n{result['response']}")
+        response_clean = result["response"].lower()
+        if any(k in response_clean for k in PRESENCE_KEYWORDS) and not any(p in response_clean for p in UNCERTAIN_PHRASES):
+            product_timestamps.add(result["timestamp_ms"])
+
+    print(f"[🧾 Panorama tile outcomes]: {tile_outcomes}")
+    if not tile_responses:
+        return None
+
+    combined_text = "\n\n".join(tile_responses)
+    summary = summarize_frame_responses(
+        user_question,
+        combined_text,
+        source="tile-wise analysis of panoramas stitched from a shelf video",
+        extra_instructions=(
+            "Each response is labelled with its panorama and the region of that panorama it covers, "
+            "or with a single frame showing part of the shelf that no panorama covers. "
+            "Tiles overlap, so the same product can appear in neighbouring tiles: count it once. "
+            "Describe locations relative to the whole shelf (e.g. top-left, middle shelf, right third).\n"
+        )
+    )
+
+    result = {
+        "direct_answer": summary["direct_answer"],
+        "reasoning": summary["reasoning"],
+        "timestamps": sorted(product_timestamps),
+        "product_name": summary["product_name"],
+        "frame_outcomes": tile_outcomes,
+        "panoramas": len(panoramas),
+        "unstitched_frames": len(leftovers)
+    }
+    result["critic_feedback"] = critic_validate_answer(
+        user_question=user_question,
+        direct_answer=summary["direct_answer"],
+        reasoning=summary["reasoning"],
+        frame_analysis_text=combined_text
+    )
+
+    if sprite is not None:
+        # Every sampled frame is on the sheet; detections map back to sampled frames
+        video_hash = await loop.run_in_executor(None, file_content_hash, video_path)
+        sampled = [{"frame_index": i, "timestamp_ms": ts} for i, ts in zip(frame_indices, timestamps)]
+        await save_viewer_cache(video_path, video_hash, sprite, sampled, result["timestamps"])
+
+    print("[🧵 JSON Output from Panorama]:")
+    print(json.dumps(result, indent=4))
+    return result
+
+def shelf_share_result(results, frames, user_question):
+    """Share-of-shelf answer computed locally from the frames' structured regions"""
+    frame_outcomes = {"ok": 0, "retried": 0, "failed": 0, "prescreened_out": 0}
+    regions, analyzed = [], []
+    for result in results:
+        frame_outcomes[result["status"]] += 1
+        if result["status"] in ("ok", "retried"):
+            analyzed.append(result)
+            regions.extend(result.get("regions") or [])
+
+    if not analyzed and frame_outcomes["failed"]:
+        result = {
+            "direct_answer": "The video could not be analyzed because every region extraction failed. Please try again later.",
+            "reasoning": f"{frame_outcomes['failed']} sampled frames failed after retries, so no regions were measured.",
+            "timestamps": [],
+            "product_name": extract_product_name(user_question),
+            "shelf_share": {},
+            "frame_outcomes": frame_outcomes
+        }
+        print("[📊 JSON Output from Shelf Share]:")
+        print(json.dumps(result, indent=4))
+        return result
+
+    # Place every frame on one shelf axis so blocks seen twice collapse to one
+    offsets = frame_offsets({r["frame_index"]: frames[r["frame_index"]] for r in analyzed
+                             if r["frame_index"] in frames})
+    unique_regions = dedupe_regions(to_shelf_coordinates(regions, offsets))
+    shares = compute_shelf_share(unique_regions)
+    direct_answer, reasoning, product_name = describe_shelf_share(shares, user_question, len(unique_regions),
+                                                                  len(analyzed))
+
+    product = match_product(shares, user_question)
+    product_frames = {region.frame_index for region in regions if product and region.product == product}
+    timestamps = sorted(r["timestamp_ms"] for r in analyzed if r["frame_index"] in product_frames)
+
+    result = {
+        "direct_answer": direct_answer,
+        "reasoning": reasoning,
+        "timestamps": timestamps,
+        "product_name": product_name if product_name != "Unknown" else extract_product_name(user_question),
+        "shelf_share": shares,
+        "frame_outcomes": frame_outcomes
+    }
+    print("[📊 Shelf share computed locally]:")
+    print(json.dumps(result, indent=4))
+    return result
+
+def summarize_frame_responses(user_question, combined_text, source="frame-wise analysis of a shelf video",
+                              extra_instructions=""):
+    # Final summarizer shared by the video, tiled-image and multi-view pipelines (keep synchronous)
+    summary_prompt = f"""
+You are a summarization assistant. Based on the following {source}, identify and answer the user's question directly and explain your reasoning clearly.
+{extra_instructions}
+User Query: {user_question}
+
+🔍 Frame Responses:
+{combined_text}
+✏️ Return in the following format:
+Direct Answer: <your direct answer here>
+Reasoning: <brief but clear reasoning for your answer>
+✏️ Return a helpful, natural language summary. End with:
+product_name = <Product Name> (if mentioned)
+"""
+    summary_response = get_pool("summary").chat_completion(
+        estimated_tokens=ESTIMATED_TOKENS_PER_SUMMARY,
+        messages=[
+            {"role": "system", "content": "You are a summarization expert for retail shelf video analytics."},
+            {"role": "user", "content": summary_prompt}
+        ],
+        max_tokens=512,
+        temperature=0.3,
+        top_p=1.0,
+        timeout=30
+    )
+    response_text = summary_response.choices[0].message.content.strip()
+
+    # Simple parsing assuming format:
+    # Direct Answer: ...
+    # Reasoning: ...
+    direct_answer = ""
+    reasoning = ""
+
+    for line in response_text.splitlines():
+        if line.lower().startswith("direct answer:"):
+            direct_answer = line.partition(":")[2].strip()
+        elif line.lower().startswith("reasoning:"):
+            reasoning = line.partition(":")[2].strip()
+
+    # Fallback if direct answer is still not parsed
+    if not direct_answer:
+        direct_answer = extract_product_name(response_text)
+    if not reasoning:
+        reasoning = response_text  # fallback to whole text
+
+    product_name = extract_product_name(direct_answer or user_question)
+
+    # base_summary = summary_response.choices[0].message.content.strip()
+    # product_name = extract_product_name(base_summary)
+    # if not product_name or product_name.lower() == "unknown":
+    #     product_name = extract_product_name(user_question)
+    #
+    # return {
+    #     "final_summary": base_summary,
+    #     "timestamps": product_timestamps,
+    #     "product_name": product_name
+    # }
+    base_summary = summary_response.choices[0].message.content.strip()
+    product_name = extract_product_name(base_summary)
+    if not product_name or product_name.lower() == "unknown":
+        product_name = extract_product_name(user_question)
+
+    return {
+        "direct_answer": direct_answer,
+        "reasoning": reasoning,
+        "product_name": product_name,
+        "summary_text": response_text
+    }
+
+async def save_viewer_cache(video_path, video_hash, sprite, results, timestamps):
+    # Runs after the answer is known, so only frames in `timestamps` are decoded again
+    index_for = {r["timestamp_ms"]: r["frame_index"] for r in results}
+    detections = [(index_for[ts], ts) for ts in timestamps if ts in index_for]
+    loop = asyncio.get_event_loop()
+    try:
+        await loop.run_in_executor(None, sprite.save, video_hash)
+        await loop.run_in_executor(None, cache_detection_frames, video_path, video_hash, detections)
+    except Exception as e:
+        print(f"[⚠️ Viewer cache] Could not save viewer cache: {e}")
+
+
+async def analyze_video_for_query_async(video_path, user_question, frame_interval=23, stream=None, cascade=None,
+                                        tiling=None, panorama=None, coverage=None, sharpness=None,
+                                        packshot=None, price_crops=None, shelf_share=None, parallel_decode=None,
+                                        prep_processes=None, frame_store=None, viewer_cache=None):
     # 🔍 Step 1: Classify the query using LLM
     query_type = classify_query_llm(user_question)
     print(f"[🔎 Query classified as]: {query_type}")
@@ -372,12 +1325,77 @@ async def analyze_video_for_query_async(video_path, user_question, frame_interva
     #         "timestamps": [],
     #         "product_name": product_name
     #     }
+    if packshot is None:
+        packshot = PACKSHOT_MATCHING
+    if price_crops is None:
+        price_crops = PRICE_TAG_CROPS
+    if shelf_share is None:
+        shelf_share = SHELF_SHARE_LOCAL
+    shelf_share = shelf_share and query_type == "count_query"
     if video_path.lower().endswith((".jpg", ".jpeg", ".png")):
         print("[🖼 Detected image file — using image processing pipeline]")
-        response = extract_products_from_image(
+        local = None
+        if packshot:
+            image = cv2.imread(video_path)
+            if image is not None:
+                local = await packshot_answer(image, user_question, query_type)
+        if local is not None:
+            print("[📦 Packshot match] Answered from the reference catalog")
+        elif shelf_share:
+            status, regions_text, _ = await call_with_retry(
+                lambda: async_extract_shelf_regions(video_path, user_question, "image"),
+                kind="regions", label="image regions"
+            )
+            if status == "failed":
+                result = {
+                    "direct_answer": "The image could not be analyzed because the region extraction failed. Please try again later.",
+                    "reasoning": f"Region extraction failed after retries: {type(regions_text).__name__}.",
+                    "timestamps": [],
+                    "product_name": extract_product_name(user_question),
+                    "shelf_share": {}
+                }
+                print("[📊 JSON Output from Shelf Share]:")
+                print(json.dumps(result, indent=4))
+                return result
+            regions = parse_regions(regions_text)
+            shares = compute_shelf_share(dedupe_regions(regions))
+            direct_answer, reasoning, product_name = describe_shelf_share(shares, user_question, len(regions), 1)
+            result = {
+                "direct_answer": direct_answer,
+                "reasoning": reasoning,
+                "timestamps": [],
+                "product_name": product_name if product_name != "Unknown" else extract_product_name(user_question),
+                "shelf_share": shares
+            }
+            print("[📊 Shelf share computed locally]:")
+            print(json.dumps(result, indent=4))
+            return result
+        elif price_crops and query_type == "price_query":
+            image = cv2.imread(video_path)
+            if image is not None:
+                crops_b64, descriptions = price_tag_crops(image)
+                if crops_b64:
+                    answer = read_price_tags(crops_b64, descriptions, user_question)
+                    if price_read_from_crops(answer):
+                        print(f"[🏷️ Price read from {len(crops_b64)} label crops]")
+                        local = answer
+                    elif answer is not None and not PRICE_CROP_FALLBACK:
+                        print(f"[🏷️ No price in {len(crops_b64)} label crops]")
+                        local = answer
+        if tiling is None:
+            tiling = IMAGE_TILING
+        if tiling and local is None:
+            result = await analyze_image_tiles_async(video_path, user_question, query_type, stream)
+            if result is not None:
+                print("[📸 JSON Output from Tiled Image]:")
+                print(json.dumps(result, indent=4))
+                return result
+
+        response = local or extract_products_from_image(
             image_path=video_path,
             user_question=user_question,
-            query_type=query_type
+            query_type=query_type,
+            stream=stream
         )
 
         direct_answer = ""
@@ -409,37 +1427,148 @@ async def analyze_video_for_query_async(video_path, user_question, frame_interva
 
         return result
 
+    if panorama is None:
+        panorama = VIDEO_PANORAMA
+    if viewer_cache is None:
+        viewer_cache = VIEWER_CACHE
+    if panorama and not shelf_share:
+        result = await analyze_video_panorama_async(video_path, user_question, query_type, frame_interval, stream,
+                                                    viewer_cache)
+        if result is not None:
+            return result
+
     cap = cv2.VideoCapture(video_path)
     fps = cap.get(cv2.CAP_PROP_FPS)
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     semaphore = asyncio.Semaphore(MAX_CONCURRENT_TASKS)
 
+    if coverage is None:
+        coverage = FRAME_COVERAGE_SELECTION
+    if sharpness is None:
+        sharpness = SHARPNESS_PICKING
+    if parallel_decode is None:
+        parallel_decode = PARALLEL_DECODE
+    if prep_processes is None:
+        prep_processes = FRAME_PREP_PROCESSES
+    if frame_store is None:
+        frame_store = FRAME_STORE
+    # Slot size must match decoded frames, which OpenCV rotates for portrait phone videos
+    prep_shape = frame_shape(video_path) if prep_processes else None
+    prep = FramePrepStage(prep_shape) if prep_shape and prep_shape[0] and prep_shape[1] else None
+    # Coverage mode looks at denser candidates, one per stride window
+    window = COVERAGE_CANDIDATE_STRIDE if coverage else frame_interval
+    selector = CoverageSelector() if coverage else None
+
+    video_hash = file_content_hash(video_path) if frame_store or viewer_cache else None
+    sprite = SpriteSheetBuilder() if viewer_cache else None
+    stored, writer = None, None
+    if frame_store:
+        store_key = frame_store_key(window, sharpness)
+        stored = load_frame_store(video_hash, store_key)
+        if stored is None:
+            writer = FrameStoreWriter(video_hash, store_key)
+    # Parallel decode workers pick the sharpest frame of each window themselves,
+    # and stored frames were picked when they were saved
+    picker = SharpestFramePicker(window) if sharpness and not parallel_decode and stored is None else None
+
     tasks = []
     frame_index = 0
+    share_frames = {}  # Small copies of analyzed frames, to place their regions on one shelf axis
+
+    def submit(frame, index):
+        if sprite is not None:
+            sprite.add(frame, index, int((index / fps) * 1000))
+        if shelf_share:
+            share_frames[index] = downscale(frame, 640)
+        tasks.append(asyncio.create_task(
+            process_frame(frame, index, fps, user_question, semaphore, query_type, stream, cascade, packshot,
+                          price_crops, shelf_share, prep)
+        ))
+
+    def schedule(candidate):
+        if candidate is None:
+            return
+        frame, index = candidate
+        if writer is not None:
+            # Analyze the stored copy so this run sees exactly what follow-up runs will
+            frame = writer.add(frame, index, int((index / fps) * 1000))
+        if selector is None:
+            submit(frame, index)
+            return
+        # Call count follows shelf length instead of duration or camera speed
+        for chosen in selector.consider(frame, index):
+            submit(*chosen)
 
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        if frame_index % frame_interval == 0:
-            task = asyncio.create_task(
-                process_frame(frame, frame_index, fps, user_question, semaphore, query_type)
-            )
-            tasks.append(task)
-
-        frame_index += 1
-
-    cap.release()
-    results = await asyncio.gather(*tasks)
+    try:
+        if stored is not None:
+            cap.release()
+            print(f"[💾 Frame store] Reusing {len(stored)} sampled frames, skipping decode")
+            for candidate in stored:
+                schedule(candidate)
+        elif parallel_decode:
+            cap.release()
+            # Frame requests start as soon as the first segments are decoded
+            async for candidate in decode_sampled_frames(video_path, total_frames, window, sharpest=sharpness):
+                schedule(candidate)
+        else:
+            while cap.isOpened():
+                ret, frame = cap.read()
+                if not ret:
+                    break
+
+                if picker is not None:
+                    schedule(picker.offer(frame, frame_index))
+                elif frame_index % window == 0:
+                    schedule((frame, frame_index))
+
+                frame_index += 1
+
+            cap.release()
+        if picker is not None:
+            schedule(picker.finish())
+    except BaseException:
+        # A failed or cancelled decode must not leave a half-written store or running requests
+        cap.release()
+        if writer is not None:
+            writer.abort()
+        for task in tasks:
+            task.cancel()
+        if prep is not None:
+            prep.close()
+        raise
+    if writer is not None:
+        try:
+            writer.finish(fps, total_frames)
+        except OSError as e:
+            # The frames are already analyzed; only the reuse by later questions is lost
+            print(f"[⚠️ Frame store] Could not save frame store: {e}")
+            writer.abort()
+    if selector is not None:
+        for chosen in selector.finish():
+            submit(*chosen)
+    try:
+        results = await asyncio.gather(*tasks)
+    finally:
+        if prep is not None:
+            prep.close()
+    if shelf_share:
+        result = shelf_share_result(results, share_frames, user_question)
+        if sprite is not None:
+            await save_viewer_cache(video_path, video_hash, sprite, results, result["timestamps"])
+        return result
 
     frame_responses = []
     product_timestamps = []
+    frame_outcomes = {"ok": 0, "retried": 0, "failed": 0, "prescreened_out": 0}
 
     video_duration_ms = (total_frames / fps) * 1000
     end_threshold_ms = video_duration_ms * 0.9
 
     for result in results:
+        frame_outcomes[result["status"]] += 1
+        if result["status"] in ("failed", "prescreened_out"):
+            continue
+
         frame_index = result["frame_index"]
         timestamp_ms = result["timestamp_ms"]
         response = result["response"]
@@ -447,12 +1576,8 @@ async def analyze_video_for_query_async(video_path, user_question, frame_interva
         frame_responses.append(f"🖼 Frame {frame_index} ({timestamp_ms} ms):\n{response}")
 
         response_clean = response.lower()
-        keywords_present = any(k in response_clean for k in [
-            "located", "visible", "is on", "can be seen", "placed", "sitting", "present", "seen"
-        ])
-        uncertain = any(p in response_clean for p in [
-            "not visible", "not found", "unclear", "could be", "might be", "probably"
-        ])
+        keywords_present = any(k in response_clean for k in PRESENCE_KEYWORDS)
+        uncertain = any(p in response_clean for p in UNCERTAIN_PHRASES)
 
         if keywords_present and not uncertain:
             if timestamp_ms < end_threshold_ms or "end" not in response_clean:
@@ -467,75 +1592,49 @@ async def analyze_video_for_query_async(video_path, user_question, frame_interva
         else:
             cleaned_frame_responses.append(line.strip())
     combined_text = "\n\n".join(cleaned_frame_responses)
+    print(f"[🧾 Frame outcomes]: {frame_outcomes}")
 
-    # Call final summarizer (keep synchronous)
-    summary_prompt = f"""
-You are a summarization assistant. Based on the following frame-wise analysis of a shelf video, identify and answer the user's question directly and explain your reasoning clearly.
-
-User Query: {user_question}
-
-🔍 Frame Responses:
-{combined_text}
-✏️ Return in the following format:
-Direct Answer: <your direct answer here>
-Reasoning: <brief but clear reasoning for your answer>
-✏️ Return a helpful, natural language summary. End with:
-product_name = <Product Name> (if mentioned)
-"""
-    summary_response = client.chat.completions.create(
-        messages=[
-            {"role": "system", "content": "You are a summarization expert for retail shelf video analytics."},
-            {"role": "user", "content": summary_prompt}
-        ],
-        max_tokens=512,
-        temperature=0.3,
-        top_p=1.0,
-        model=AZURE_OPENAI_DEPLOYMENT_NAME,
-        timeout=30
-    )
-    response_text = summary_response.choices[0].message.content.strip()
-
-    # Simple parsing assuming format:
-    # Direct Answer: ...
-    # Reasoning: ...
-    direct_answer = ""
-    reasoning = ""
-
-    for line in response_text.splitlines():
-        if line.lower().startswith("direct answer:"):
-            direct_answer = line.partition(":")[2].strip()
-        elif line.lower().startswith("reasoning:"):
-            reasoning = line.partition(":")[2].strip()
-
-    # Fallback if direct answer is still not parsed
-    if not direct_answer:
-        direct_answer = extract_product_name(response_text)
-    if not reasoning:
-        reasoning = response_text  # fallback to whole text
+    if not cleaned_frame_responses and not frame_outcomes["failed"]:
+        # Every sampled frame was screened out: no frame-level evidence to summarize
+        result = {
+            "direct_answer": "The requested product was not found in any sampled frame of the video.",
+            "reasoning": f"All {frame_outcomes['prescreened_out']} sampled frames were screened out by the "
+                         f"low-detail presence check, so no frame was analyzed in full.",
+            "timestamps": [],
+            "product_name": extract_product_name(user_question),
+            "frame_outcomes": frame_outcomes
+        }
+        print("[📦 JSON Output]:")
+        print(json.dumps(result, indent=4))
+        return result
 
-    product_name = extract_product_name(direct_answer or user_question)
+    if not cleaned_frame_responses:
+        result = {
+            "direct_answer": "The video could not be analyzed because every frame request failed. Please try again later.",
+            "reasoning": f"{frame_outcomes['failed']} sampled frames failed after retries, so there is no visual evidence to summarize.",
+            "timestamps": [],
+            "product_name": extract_product_name(user_question),
+            "frame_outcomes": frame_outcomes
+        }
+        print("[📦 JSON Output]:")
+        print(json.dumps(result, indent=4))
+        return result
 
-    # base_summary = summary_response.choices[0].message.content.strip()
-    # product_name = extract_product_name(base_summary)
-    # if not product_name or product_name.lower() == "unknown":
-    #     product_name = extract_product_name(user_question)
-    #
-    # return {
-    #     "final_summary": base_summary,
-    #     "timestamps": product_timestamps,
-    #     "product_name": product_name
-    # }
-    base_summary = summary_response.choices[0].message.content.strip()
-    product_name = extract_product_name(base_summary)
-    if not product_name or product_name.lower() == "unknown":
-        product_name = extract_product_name(user_question)
+    # Call final summarizer (keep synchronous)
+    summary = summarize_frame_responses(user_question, combined_text)
+    direct_answer = summary["direct_answer"]
+    reasoning = summary["reasoning"]
+    product_name = summary["product_name"]
 
     result = {
         "direct_answer": direct_answer,
         "reasoning": reasoning,
         "timestamps": product_timestamps,
-        "product_name": product_name
+        "product_name": product_name,
+        "frame_outcomes": frame_outcomes
     }
+    if sprite is not None:
+        await save_viewer_cache(video_path, video_hash, sprite, results, product_timestamps)
     # --- Critic Evaluation ---
     critic_feedback = critic_validate_answer(
         user_question=user_question,
@@ -552,6 +1651,103 @@ product_name = <Product Name> (if mentioned)
     return result
 
 
+def is_presence_answer(response: str) -> bool:
+    response_clean = response.lower()
+    return any(k in response_clean for k in PRESENCE_KEYWORDS) and not any(p in response_clean for p in UNCERTAIN_PHRASES)
+
+
+async def monitor_stream_async(stream_url, queries, on_event=None, event_log=None, realtime=False,
+                               max_seconds=None):
+    """Watch a camera and re-run standing queries whenever the shelf changes.
+
+    stream_url is anything cv2.VideoCapture opens (RTSP/HTTP URL, device or file;
+    realtime=True replays a file at its own speed). Every event is printed,
+    passed to on_event and appended to the event_log JSONL file. Memory stays
+    bounded: only the newest frame is kept, one analysis runs at a time and
+    each query keeps a capped rolling window. Returns the windows' final state.
+    """
+    query_types = {q: classify_query_llm(q) for q in queries}
+    windows = {q: RollingWindow(q) for q in queries}
+    trigger = ChangeTrigger()
+    reader = StreamReader(stream_url, realtime)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_TASKS)
+    loop = asyncio.get_event_loop()
+    sample_every_ms = 1000.0 / STREAM_SAMPLE_FPS
+    # A file read at full speed waits for each analysis; live sources keep reading
+    blocking = reader.is_file and not realtime
+    print(f"[📡 Monitor] Watching {stream_url} with {len(queries)} standing queries")
+
+    def emit(event):
+        print(f"[📣 Monitor event] {json.dumps(event)}")
+        if event_log:
+            with open(event_log, "a", encoding="utf-8") as f:
+                f.write(json.dumps(event) + "\n")
+        if on_event is not None:
+            on_event(event)
+
+    async def run_queries(frame, frame_index, timestamp_ms):
+        results = await asyncio.gather(*[
+            process_frame(frame, frame_index, reader.fps or 25.0, q, semaphore, query_types[q]) for q in queries
+        ])
+        for query, result in zip(queries, results):
+            if result["status"] == "failed":
+                emit({"type": "analysis_failed", "query": query, "timestamp_ms": timestamp_ms})
+                continue
+            # A frame screened out at low detail counts as "not there" for the window
+            response = result["response"] or "Direct Answer: Not visible in the low-detail screening pass."
+            direct_answer = next((line.partition(":")[2].strip() for line in response.splitlines()
+                                  if line.lower().startswith("direct answer:")), response.strip())
+            present = is_presence_answer(response)
+            window = windows[query]
+            flipped = window.add(Observation(timestamp_ms, present, direct_answer))
+            emit({"type": "answer", "query": query, "timestamp_ms": timestamp_ms, "frame_index": frame_index,
+                  "present": present, "direct_answer": direct_answer,
+                  "window_presence": round(window.presence_share(), 3)})
+            if flipped:
+                emit({"type": "answer_changed", "query": query, "timestamp_ms": timestamp_ms,
+                      "present": window.state, "direct_answer": direct_answer})
+
+    started = time.monotonic()
+    next_sample_ms = 0
+    in_flight = None
+    try:
+        while max_seconds is None or time.monotonic() - started < max_seconds:
+            item = await loop.run_in_executor(executor, reader.latest, 1.0)
+            if item is None:
+                if reader.ended:
+                    break
+                continue
+            frame, frame_index, timestamp_ms = item
+            if timestamp_ms < next_sample_ms:
+                continue
+            next_sample_ms = timestamp_ms + sample_every_ms
+            # While an analysis runs, frames are dropped rather than queued
+            if in_flight is not None and not in_flight.done():
+                continue
+
+            changed = await loop.run_in_executor(executor, trigger.check, frame, timestamp_ms / 1000)
+            if changed is None:
+                continue
+            emit({"type": "shelf_changed", "timestamp_ms": timestamp_ms, "frame_index": frame_index,
+                  "regions": [[r.x0, r.y0, r.x1, r.y1] for r in changed]})
+            in_flight = asyncio.create_task(run_queries(frame, frame_index, timestamp_ms))
+            if blocking:
+                await in_flight
+        if in_flight is not None:
+            await in_flight
+    finally:
+        reader.stop()
+        emit({"type": "monitor_stopped", "stream": stream_url})
+
+    return {q: {"present": w.state, "presence_share": w.presence_share(), "observations": len(w.items)}
+            for q, w in windows.items()}
+
+
+def monitor_stream(stream_url, queries, event_log=None, realtime=False, max_seconds=None):
+    return asyncio.run(monitor_stream_async(stream_url, queries, event_log=event_log, realtime=realtime,
+                                            max_seconds=max_seconds))
+
+
 def analyze_video_for_query(video_path, user_question, frame_interval=23):
     cap = cv2.VideoCapture(video_path)
     fps = cap.get(cv2.CAP_PROP_FPS)
@@ -626,7 +1822,8 @@ Return ONLY the summary and the product name line if applicable.
 ✏️ Return a helpful, natural language summary for the user. Do not include any extra information (about frames and frame numbers) other than the answer to the asked query.
 """
 
-    summary_response = client.chat.completions.create(
+    summary_response = get_pool("summary").chat_completion(
+        estimated_tokens=ESTIMATED_TOKENS_PER_SUMMARY,
         messages=[
             {"role": "system", "content": "You are a summarization expert for retail shelf video analytics."},
             {"role": "user", "content": summary_prompt}
@@ -634,7 +1831,6 @@ Return ONLY the summary and the product name line if applicable.
         max_tokens=512,
         temperature=0.3,
         top_p=1.0,
-        model=AZURE_OPENAI_DEPLOYMENT_NAME,
         timeout=30  # Add 30 second timeout to prevent hanging
     )
 
@@ -701,14 +1897,14 @@ Accuracy Score (0–100)%: <score>
 Evaluation Summary: <brief explanation of factual correctness and completeness>
 """
 
-    eval_response = client.chat.completions.create(
+    eval_response = get_pool("critic").chat_completion(
+        estimated_tokens=ESTIMATED_TOKENS_PER_CRITIC,
         messages=[
             {"role": "system", "content": "You are an unbiased evaluator that assesses summary quality based on provided evidence."},
             {"role": "user", "content": evaluation_prompt}
         ],
         max_tokens=300,
-        temperature=0.2,
-        model=AZURE_OPENAI_DEPLOYMENT_NAME  # Or use "gpt-4o" if preferred
+        temperature=0.2
     )
 
     return eval_response.choices[0].message.content.strip()
@@ -0,0 +1,259 @@
+"""
+Batch CLI
+Runs a question set over a directory or manifest of media files without the UI,
+journaling every (file, question) result to JSONL so interrupted runs resume
+
+Usage:
+    python -m app.batch_cli uploaded_files --questions questions.txt --output results.jsonl
+    python -m app.batch_cli manifest.jsonl --question "Where is Tide?" --parquet results.parquet
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Deque, Dict, List, Optional, Set, Tuple
+from app.analyze import analyze_video_for_query_async
+from app.utils.media_store import MEDIA_EXTENSIONS
+
+# (file, question) jobs analyzed at once; API calls inside them share the
+# process-wide endpoint rate limits, so the Azure quota is the real bound
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+
+def find_media(root: str, recursive: bool = True) -> List[str]:
+    paths = []
+    for directory, subdirs, files in os.walk(root):
+        # Content-hash blobs and analysis artifacts are storage, not inputs
+        subdirs[:] = [d for d in subdirs if d not in ("blobs", "artifacts")] if recursive else []
+        paths.extend(os.path.join(directory, name) for name in files if name.lower().endswith(MEDIA_EXTENSIONS))
+    return sorted(paths)
+
+
+def read_manifest(path: str) -> List[Tuple[str, Optional[List[str]]]]:
+    """(file, questions or None) per entry. JSONL lines are {"path": ..., "questions": [...]},
+    any other file lists one path per line; relative paths are relative to the manifest."""
+    base = os.path.dirname(os.path.abspath(path))
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if path.endswith(".jsonl"):
+                item = json.loads(line)
+                entries.append((os.path.join(base, item["path"]), item.get("questions")))
+            else:
+                entries.append((os.path.join(base, line), None))
+    return entries
+
+
+def read_questions(path: Optional[str], inline: List[str]) -> List[str]:
+    questions = list(inline)
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            questions.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+    return questions
+
+
+class Journal:
+    """Append-only JSONL of finished jobs, flushed per line so a crash loses at most
+    the jobs still running"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def completed(self) -> Set[Tuple[str, str]]:
+        done = set()
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Last line of a killed run
+                    if record.get("status") == "ok":
+                        done.add((record["file"], record["question"]))
+        return done
+
+    def append(self, record: dict):
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def records(self) -> List[dict]:
+        """Latest record per (file, question)"""
+        latest: Dict[Tuple[str, str], dict] = {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                latest[(record["file"], record["question"])] = record
+        return list(latest.values())
+
+
+# Running jobs by task, so an interrupt can cancel each one on its own event loop
+_running: Dict[asyncio.Task, asyncio.AbstractEventLoop] = {}
+_running_lock = threading.Lock()
+_stop = threading.Event()
+
+
+async def _analyze(path: str, question: str) -> dict:
+    task = asyncio.current_task()
+    with _running_lock:
+        _running[task] = asyncio.get_running_loop()
+    try:
+        if _stop.is_set():
+            raise asyncio.CancelledError()
+        return await analyze_video_for_query_async(path, question)
+    finally:
+        with _running_lock:
+            _running.pop(task, None)
+
+
+def stop_running_jobs():
+    """Cancel every running job at its next await (between frames, between API calls);
+    jobs that have not started yet stop before doing any work"""
+    _stop.set()
+    with _running_lock:
+        for task, loop in _running.items():
+            loop.call_soon_threadsafe(task.cancel)
+
+
+def run_job(path: str, question: str) -> dict:
+    """One analysis on its own event loop. Runs in a worker thread, so the pipeline's
+    blocking calls (classification, summary, critic) only hold up this job. Raises
+    CancelledError when stopped by stop_running_jobs()."""
+    started = time.time()
+    record = {"file": path, "question": question, "started_at": started}
+    try:
+        result = asyncio.run(_analyze(path, question))
+        record.update({
+            "status": "ok",
+            "direct_answer": result.get("direct_answer", ""),
+            "reasoning": result.get("reasoning", ""),
+            "product_name": result.get("product_name", ""),
+            "timestamps": result.get("timestamps", []),
+            "result": result,
+        })
+    except Exception as e:
+        record.update({"status": "failed", "error": f"{type(e).__name__}: {e}"})
+    record["duration_s"] = round(time.time() - started, 2)
+    return record
+
+
+def export_parquet(journal: Journal, parquet_path: str) -> bool:
+    try:
+        import pandas as pd
+        frame = pd.DataFrame(journal.records())
+        # Nested values are kept as JSON text so any Parquet engine can store them
+        for column in ("timestamps", "result"):
+            if column in frame:
+                frame[column] = frame[column].apply(lambda v: json.dumps(v) if isinstance(v, (list, dict)) else v)
+        frame.to_parquet(parquet_path, index=False)
+    except ImportError as e:
+        print(f"[⚠️ Batch] Parquet export needs pandas with pyarrow or fastparquet installed: {e}")
+        return False
+    print(f"[💾 Batch] Wrote {len(frame)} rows to {parquet_path}")
+    return True
+
+
+def run_batch(jobs: List[Tuple[str, str]], journal: Journal, concurrency: int = BATCH_CONCURRENCY) -> Dict[str, int]:
+    done = journal.completed()
+    pending = [job for job in jobs if job not in done]
+    counts = {"skipped": len(jobs) - len(pending), "ok": 0, "failed": 0}
+    print(f"[📦 Batch] {len(jobs)} jobs, {counts['skipped']} already done, {len(pending)} to run "
+          f"with {concurrency} at a time")
+
+    # One job per file at a time: the next question on a video starts once the previous
+    # one has saved its frame store and artifacts, and reuses them
+    questions_by_file: Dict[str, Deque[str]] = {}
+    for path, question in pending:
+        questions_by_file.setdefault(path, deque()).append(question)
+
+    started = time.time()
+    finished = 0
+    _stop.clear()
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    running = {}
+
+    def submit_next(path: str):
+        if questions_by_file[path]:
+            question = questions_by_file[path].popleft()
+            running[pool.submit(run_job, path, question)] = path
+
+    try:
+        for path in questions_by_file:
+            submit_next(path)
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = running.pop(future)
+                record = future.result()
+                journal.append(record)
+                counts[record["status"]] += 1
+                finished += 1
+                rate = finished / max(time.time() - started, 1e-6) * 3600
+                print(f"[📦 Batch] {finished}/{len(pending)} {record['status']}: {os.path.basename(record['file'])} | "
+                      f"{record['question'][:60]} ({record['duration_s']}s, {rate:.0f} jobs/h)")
+                submit_next(path)
+    except KeyboardInterrupt:
+        print(f"[🛑 Batch] Interrupted, stopping {len(_running)} running jobs; finished jobs are journaled, "
+              f"rerun the same command to resume")
+        stop_running_jobs()
+        pool.shutdown(wait=True, cancel_futures=True)
+        raise
+    pool.shutdown(wait=True)
+    print(f"[📦 Batch] Done: {counts}")
+    return counts
+
+
+def build_jobs(source: str, questions: List[str], recursive: bool = True) -> List[Tuple[str, str]]:
+    if os.path.isdir(source):
+        entries = [(path, None) for path in find_media(source, recursive)]
+    else:
+        entries = read_manifest(source)
+    jobs = []
+    # File-major order; run_batch runs the questions of one file one after another so
+    # later ones reuse its frame store and other artifacts
+    for path, own_questions in entries:
+        for question in own_questions or questions:
+            jobs.append((os.path.abspath(path), question))
+    return jobs
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Analyze a directory or manifest of shelf media offline.")
+    parser.add_argument("source", help="Directory of media files, or a manifest (.txt paths or .jsonl entries)")
+    parser.add_argument("--questions", help="Text file with one question per line")
+    parser.add_argument("--question", action="append", default=[], help="Question to ask (repeatable)")
+    parser.add_argument("--output", default="batch_results.jsonl", help="JSONL journal, also used to resume")
+    parser.add_argument("--parquet", help="Also export the journal to this Parquet file when done")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="Jobs analyzed at once")
+    parser.add_argument("--no-recursive", action="store_true", help="Only scan the top level of the directory")
+    args = parser.parse_args(argv)
+
+    questions = read_questions(args.questions, args.question)
+    jobs = build_jobs(args.source, questions, recursive=not args.no_recursive)
+    if not jobs:
+        print("[⚠️ Batch] Nothing to do: no media files or no questions given")
+        return 1
+
+    journal = Journal(args.output)
+    counts = run_batch(jobs, journal, max(args.concurrency, 1))
+    if args.parquet:
+        export_parquet(journal, args.parquet)
+    return 0 if counts["failed"] == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
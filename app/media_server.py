@@ -0,0 +1,186 @@
+"""
+Media Server
+Small HTTP endpoint with Range support that serves stored media to the browser by
+content hash, so players stream the file instead of receiving it base64-embedded
+in the page
+"""
+
+import os
+import re
+import shutil
+import mimetypes
+import threading
+import subprocess
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from app.utils.artifacts import ARTIFACT_DIR, artifact_path, file_content_hash
+
+# Loopback only by default; set 0.0.0.0 (and MEDIA_SERVER_URL) to serve browsers on other machines
+MEDIA_SERVER_HOST = os.getenv("MEDIA_SERVER_HOST", "127.0.0.1")
+MEDIA_SERVER_PORT = int(os.getenv("MEDIA_SERVER_PORT", "8502"))
+# Address the browser uses to reach the server
+MEDIA_SERVER_URL = os.getenv("MEDIA_SERVER_URL", f"http://localhost:{MEDIA_SERVER_PORT}")
+# Files at least this large also get a low-bitrate preview proxy when ffmpeg is available
+PREVIEW_PROXY_MIN_BYTES = int(os.getenv("PREVIEW_PROXY_MIN_BYTES", str(200 * 1024 * 1024)))
+PREVIEW_PROXY_HEIGHT = int(os.getenv("PREVIEW_PROXY_HEIGHT", "480"))
+
+PROXY_ARTIFACT = "preview_proxy.mp4"
+
+_STREAM_CHUNK_SIZE = 256 * 1024
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_MEDIA_PATH = re.compile(r"^/media/([0-9a-f]{64})(/proxy)?$")
+
+# Only registered files are served: content hash -> path on disk
+_registered: Dict[str, str] = {}
+# path -> (mtime, size, hash), so files outside the blob store are hashed once
+_hash_cache: Dict[str, Tuple[float, int, str]] = {}
+_proxy_jobs: Dict[str, threading.Thread] = {}
+_lock = threading.Lock()
+
+
+def _cached_hash(path: str) -> str:
+    stat = os.stat(path)
+    cached = _hash_cache.get(path)
+    if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+        return cached[2]
+    content_hash = file_content_hash(path)
+    _hash_cache[path] = (stat.st_mtime, stat.st_size, content_hash)
+    return content_hash
+
+
+def _proxy_path(content_hash: str) -> str:
+    return os.path.join(ARTIFACT_DIR, content_hash, PROXY_ARTIFACT)
+
+
+def _build_proxy(source: str, content_hash: str):
+    target = artifact_path(content_hash, PROXY_ARTIFACT)
+    temp_path = target + ".tmp.mp4"
+    command = [
+        "ffmpeg", "-y", "-loglevel", "error", "-i", source,
+        "-vf", f"scale=-2:{PREVIEW_PROXY_HEIGHT}", "-c:v", "libx264", "-preset", "veryfast",
+        "-crf", "30", "-an", "-movflags", "+faststart", temp_path,
+    ]
+    try:
+        subprocess.run(command, check=True, capture_output=True)
+        os.replace(temp_path, target)
+        print(f"[🎞️ Media server] Preview proxy ready for {content_hash[:12]}")
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"[⚠️ Media server] Preview proxy failed for {content_hash[:12]}: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _ensure_proxy(path: str, content_hash: str):
+    """Build the preview proxy in the background for large videos"""
+    if os.path.getsize(path) < PREVIEW_PROXY_MIN_BYTES or not shutil.which("ffmpeg"):
+        return
+    if os.path.exists(_proxy_path(content_hash)):
+        return
+    with _lock:
+        if content_hash in _proxy_jobs:
+            return  # Still encoding, or failed once already: keep serving the original
+        job = threading.Thread(target=_build_proxy, args=(path, content_hash), daemon=True)
+        _proxy_jobs[content_hash] = job
+    job.start()
+
+
+def media_url(path: str, prefer_proxy: bool = True) -> str:
+    """URL of the file on the media server; the preview proxy's once it exists"""
+    content_hash = _cached_hash(path)
+    _registered[content_hash] = path
+    if prefer_proxy and path.lower().endswith((".mp4", ".mov", ".avi", ".mkv")):
+        _ensure_proxy(path, content_hash)
+        if os.path.exists(_proxy_path(content_hash)):
+            return f"{MEDIA_SERVER_URL}/media/{content_hash}/proxy"
+    return f"{MEDIA_SERVER_URL}/media/{content_hash}"
+
+
+def _parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """(start, end) inclusive, (-1, -1) for an unsatisfiable range, None for no range"""
+    if not header:
+        return None
+    match = _RANGE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None  # Multi-range or malformed: answer with the whole file
+    first, last = match.groups()
+    if first == "":
+        length = int(last)
+        if length == 0 or size == 0:
+            return -1, -1
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return -1, -1
+    return start, end
+
+
+class MediaRequestHandler(BaseHTTPRequestHandler):
+    def _resolve(self) -> Optional[str]:
+        match = _MEDIA_PATH.match(self.path.split("?", 1)[0])
+        if not match:
+            return None
+        content_hash, proxy = match.groups()
+        if proxy:
+            path = _proxy_path(content_hash)
+            return path if os.path.exists(path) else None
+        return _registered.get(content_hash)
+
+    def _send(self, head_only: bool):
+        path = self._resolve()
+        if path is None or not os.path.exists(path):
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+
+        size = os.path.getsize(path)
+        byte_range = _parse_range(self.headers.get("Range"), size)
+        if byte_range == (-1, -1):
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.end_headers()
+            return
+
+        start, end = byte_range or (0, size - 1)
+        length = end - start + 1 if size else 0
+        self.send_response(HTTPStatus.PARTIAL_CONTENT if byte_range else HTTPStatus.OK)
+        self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(length))
+        self.send_header("Cache-Control", "public, max-age=31536000, immutable")  # URLs are content hashes
+        if byte_range:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if head_only:
+            return
+
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = length
+            try:
+                while remaining > 0:
+                    chunk = f.read(min(_STREAM_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # Browsers drop range requests as soon as they seek elsewhere
+
+    def do_GET(self):
+        self._send(head_only=False)
+
+    def do_HEAD(self):
+        self._send(head_only=True)
+
+    def log_message(self, format, *args):
+        pass  # Players issue a range request for every seek
+
+
+def start_media_server(host: str = MEDIA_SERVER_HOST, port: int = MEDIA_SERVER_PORT) -> ThreadingHTTPServer:
+    """Serve in a daemon thread; call once per process"""
+    server = ThreadingHTTPServer((host, port), MediaRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"[📡 Media server] Serving media on {host}:{port} ({MEDIA_SERVER_URL})")
+    return server
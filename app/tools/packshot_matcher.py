@@ -0,0 +1,269 @@
+"""
+Reference Packshot Matcher
+Matches shelf frames against a local catalog of SKU packshots with ORB features
+and a FLANN (LSH) index, so known products can be identified and located without
+calling the vision model
+"""
+
+import os
+import re
+import json
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import cv2
+import numpy as np
+
+# Catalog layout: <dir>/<SKU name>.jpg or <dir>/<SKU name>/*.jpg, plus an optional
+# catalog.json mapping SKU names to {"brand": ...}
+PACKSHOT_CATALOG_DIR = os.getenv("PACKSHOT_CATALOG_DIR", "reference_packshots")
+PACKSHOT_MIN_INLIERS = int(os.getenv("PACKSHOT_MIN_INLIERS", "25"))
+# Best SKU must beat the runner-up by this factor to be answered locally
+PACKSHOT_MARGIN = float(os.getenv("PACKSHOT_MARGIN", "1.5"))
+PACKSHOT_QUERY_TYPES = ["product_identification", "brand_query", "location_query"]
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+_FRAME_MAX_SIDE = 1280
+_REFERENCE_MAX_SIDE = 800
+_CANDIDATES_TO_VERIFY = 3
+
+
+@dataclass
+class PackshotReference:
+    sku: str
+    brand: str
+    path: str
+    points: np.ndarray  # Keypoint coordinates, N x 2
+    descriptors: np.ndarray
+    size: Tuple[int, int]  # (width, height) of the stored reference
+
+
+@dataclass
+class PackshotMatch:
+    sku: str
+    brand: str
+    inliers: int
+    bbox: Tuple[int, int, int, int]  # x0, y0, x1, y1 in frame pixels
+    confident: bool
+
+
+def _resize_max_side(image: np.ndarray, max_side: int) -> Tuple[np.ndarray, float]:
+    height, width = image.shape[:2]
+    scale = min(max_side / max(height, width), 1.0)
+    if scale == 1.0:
+        return image, 1.0
+    return cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA), scale
+
+
+class PackshotMatcher:
+    """ORB descriptors for every packshot, cached next to the catalog and indexed with FLANN LSH"""
+
+    def __init__(self, catalog_dir: str = PACKSHOT_CATALOG_DIR):
+        self.catalog_dir = catalog_dir
+        self.cache_dir = os.path.join(catalog_dir, ".descriptors")
+        self._local = threading.local()
+        self.references: List[PackshotReference] = []
+        self._lock = threading.Lock()
+        self._load_catalog()
+
+        self.matcher = cv2.FlannBasedMatcher(
+            dict(algorithm=6, table_number=6, key_size=12, multi_probe_level=1),  # FLANN_INDEX_LSH
+            dict(checks=50)
+        )
+        if self.references:
+            self.matcher.add([ref.descriptors for ref in self.references])
+            self.matcher.train()
+        print(f"[📦 Packshots] Indexed {len(self.references)} reference images "
+              f"for {len(self.skus())} SKUs from {catalog_dir}")
+
+    @property
+    def orb(self):
+        # Frames are matched from several executor threads and an ORB detector is not
+        # safe to share, so each thread gets its own
+        orb = getattr(self._local, "orb", None)
+        if orb is None:
+            orb = self._local.orb = cv2.ORB_create(nfeatures=1500)
+        return orb
+
+    def skus(self) -> List[str]:
+        return sorted({ref.sku for ref in self.references})
+
+    def _catalog_entries(self) -> List[Tuple[str, str]]:
+        entries = []
+        for name in sorted(os.listdir(self.catalog_dir)):
+            path = os.path.join(self.catalog_dir, name)
+            if os.path.isdir(path) and not name.startswith("."):
+                for image_name in sorted(os.listdir(path)):
+                    if image_name.lower().endswith(IMAGE_EXTENSIONS):
+                        entries.append((name, os.path.join(path, image_name)))
+            elif name.lower().endswith(IMAGE_EXTENSIONS):
+                entries.append((os.path.splitext(name)[0], path))
+        return entries
+
+    def _load_catalog(self):
+        metadata = {}
+        metadata_path = os.path.join(self.catalog_dir, "catalog.json")
+        if os.path.exists(metadata_path):
+            with open(metadata_path, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for sku_key, path in self._catalog_entries():
+            sku = sku_key.replace("_", " ").strip()
+            brand = metadata.get(sku_key, {}).get("brand") or sku.split(" ")[0]
+            reference = self._load_reference(sku, brand, path)
+            if reference is not None:
+                self.references.append(reference)
+
+    def _load_reference(self, sku: str, brand: str, path: str) -> Optional[PackshotReference]:
+        cache_name = re.sub(r"[^A-Za-z0-9_.-]", "_", os.path.relpath(path, self.catalog_dir)) + ".npz"
+        cache_path = os.path.join(self.cache_dir, cache_name)
+
+        # Descriptors are precomputed once and reused until the packshot changes
+        if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+            cached = np.load(cache_path)
+            return PackshotReference(sku, brand, path, cached["points"], cached["descriptors"],
+                                     tuple(int(v) for v in cached["size"]))
+
+        image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            print(f"[⚠️ Packshots] Could not read {path}")
+            return None
+        image, _ = _resize_max_side(image, _REFERENCE_MAX_SIDE)
+        keypoints, descriptors = self.orb.detectAndCompute(image, None)
+        if descriptors is None or len(keypoints) < PACKSHOT_MIN_INLIERS:
+            print(f"[⚠️ Packshots] Too few features in {path}, skipping")
+            return None
+
+        points = np.float32([kp.pt for kp in keypoints])
+        size = (image.shape[1], image.shape[0])
+        np.savez(cache_path, points=points, descriptors=descriptors, size=np.array(size))
+        return PackshotReference(sku, brand, path, points, descriptors, size)
+
+    def match(self, frame: np.ndarray) -> List[PackshotMatch]:
+        """Best geometric match per SKU in this frame, strongest first"""
+        if not self.references:
+            return []
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        gray, scale = _resize_max_side(gray, _FRAME_MAX_SIDE)
+        keypoints, descriptors = self.orb.detectAndCompute(gray, None)
+        if descriptors is None or len(keypoints) < PACKSHOT_MIN_INLIERS:
+            return []
+
+        with self._lock:
+            knn = self.matcher.knnMatch(descriptors, k=2)
+
+        # Ratio-test votes per reference image
+        votes: Dict[int, List[Tuple[int, int]]] = {}
+        for pair in knn:
+            if len(pair) == 2 and pair[0].distance < 0.75 * pair[1].distance:
+                m = pair[0]
+                votes.setdefault(m.imgIdx, []).append((m.queryIdx, m.trainIdx))
+
+        candidates = sorted(votes.items(), key=lambda item: len(item[1]), reverse=True)[:_CANDIDATES_TO_VERIFY]
+        best_per_sku: Dict[str, Tuple[int, Tuple[int, int, int, int], PackshotReference]] = {}
+        for ref_index, pairs in candidates:
+            if len(pairs) < PACKSHOT_MIN_INLIERS:
+                continue
+            reference = self.references[ref_index]
+            src = np.float32([reference.points[t] for _, t in pairs]).reshape(-1, 1, 2)
+            dst = np.float32([keypoints[q].pt for q, _ in pairs]).reshape(-1, 1, 2)
+            homography, mask = cv2.findHomography(src, dst, cv2.RANSAC, 5.0)
+            if homography is None:
+                continue
+            inliers = int(mask.sum())
+
+            width, height = reference.size
+            corners = np.float32([[0, 0], [width, 0], [width, height], [0, height]]).reshape(-1, 1, 2)
+            projected = cv2.perspectiveTransform(corners, homography).reshape(-1, 2) / scale
+            x0, y0 = projected.min(axis=0)
+            x1, y1 = projected.max(axis=0)
+            frame_h, frame_w = frame.shape[:2]
+            bbox = (max(int(x0), 0), max(int(y0), 0), min(int(x1), frame_w), min(int(y1), frame_h))
+            if bbox[2] <= bbox[0] or bbox[3] <= bbox[1]:
+                continue  # Degenerate warp, not a real placement
+
+            if reference.sku not in best_per_sku or inliers > best_per_sku[reference.sku][0]:
+                best_per_sku[reference.sku] = (inliers, bbox, reference)
+
+        ranked = sorted(best_per_sku.values(), key=lambda item: item[0], reverse=True)
+        matches = []
+        for position, (inliers, bbox, reference) in enumerate(ranked):
+            runner_up = ranked[position + 1][0] if position + 1 < len(ranked) else 0
+            confident = inliers >= PACKSHOT_MIN_INLIERS and inliers >= PACKSHOT_MARGIN * runner_up
+            matches.append(PackshotMatch(reference.sku, reference.brand, inliers, bbox, confident))
+        return matches
+
+    def sku_in_question(self, user_question: str) -> Optional[str]:
+        """Catalog SKU the question refers to, by word overlap with the SKU name"""
+        question_words = set(re.findall(r"[a-z0-9]+", user_question.lower()))
+        best, best_overlap = None, 0
+        for sku in self.skus():
+            sku_words = set(re.findall(r"[a-z0-9]+", sku.lower()))
+            overlap = len(sku_words & question_words)
+            if overlap > best_overlap and overlap >= min(2, len(sku_words)):
+                best, best_overlap = sku, overlap
+        return best
+
+
+def describe_position(bbox: Tuple[int, int, int, int], width: int, height: int) -> str:
+    x_center = (bbox[0] + bbox[2]) / 2 / width
+    y_center = (bbox[1] + bbox[3]) / 2 / height
+    horizontal = "left" if x_center < 1 / 3 else "center" if x_center < 2 / 3 else "right"
+    vertical = "top" if y_center < 1 / 3 else "middle" if y_center < 2 / 3 else "bottom"
+    return f"{vertical} shelf area, {horizontal} side"
+
+
+def answer_from_packshots(matcher: PackshotMatcher, frame: np.ndarray, user_question: str,
+                          query_type: str) -> Optional[str]:
+    """Frame answer in the usual Direct Answer / Reasoning / product_name format, or None
+    when the local match is missing or ambiguous and the vision model should decide"""
+    if query_type not in PACKSHOT_QUERY_TYPES:
+        return None
+
+    matches = matcher.match(frame)
+    height, width = frame.shape[:2]
+    queried_sku = matcher.sku_in_question(user_question)
+
+    if queried_sku:
+        match = next((m for m in matches if m.sku == queried_sku), None)
+        if match is None or not match.confident:
+            return None
+    else:
+        # Only a single unambiguous SKU can answer an open identification question
+        confident = [m for m in matches if m.confident]
+        if len(confident) != 1 or query_type == "location_query":
+            return None
+        match = confident[0]
+
+    x0, y0, x1, y1 = match.bbox
+    position = describe_position(match.bbox, width, height)
+    if query_type == "location_query":
+        direct_answer = f"{match.sku} is visible in the {position} of this frame (x {x0}-{x1} px, y {y0}-{y1} px)."
+    elif query_type == "brand_query":
+        direct_answer = f"The brand visible in this frame is {match.brand} ({match.sku})."
+    else:
+        direct_answer = f"The product visible in this frame is {match.sku}, in the {position}."
+
+    return (
+        f"Direct Answer: {direct_answer}\n"
+        f"Reasoning: Matched the reference packshot for {match.sku} with {match.inliers} geometrically "
+        f"consistent feature matches; bounding box x {x0}-{x1} px, y {y0}-{y1} px.\n"
+        f"product_name = {match.sku}"
+    )
+
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+
+def get_packshot_matcher() -> Optional[PackshotMatcher]:
+    """Shared matcher, or None when no packshot catalog is set up"""
+    global _matcher
+    if not os.path.isdir(PACKSHOT_CATALOG_DIR):
+        return None
+    with _matcher_lock:
+        if _matcher is None:
+            _matcher = PackshotMatcher(PACKSHOT_CATALOG_DIR)
+    return _matcher if _matcher.references else None
@@ -0,0 +1,46 @@
+"""
+Answer Parsing
+Reads the structured fields of a frame response while it is still streaming in
+"""
+
+import re
+
+NOT_VISIBLE_PHRASES = [
+    "not visible", "not found", "not present", "not recognizable",
+    "not identifiable", "cannot be seen", "can't be seen", "no visible"
+]
+
+# A clause joined by one of these can carry a positive finding after a negative one
+_CONTRAST = re.compile(r"\b(but|however|although|though|while|whereas|except|yet|instead)\b")
+_SENTENCE_END = re.compile(r"(?<=[.!?;])\s+")
+
+
+def is_negative_verdict(direct_answer: str) -> bool:
+    """True only when the whole direct answer says the product is not there:
+    every sentence states it and no clause turns positive"""
+    answer = direct_answer.strip().lower()
+    if not answer or _CONTRAST.search(answer):
+        return False
+    sentences = [s for s in _SENTENCE_END.split(answer) if s.strip()]
+    return all(any(phrase in sentence for phrase in NOT_VISIBLE_PHRASES) for sentence in sentences)
+
+
+def stream_fields_complete(text: str) -> bool:
+    """Whether a partial streamed response already holds everything the pipeline needs"""
+    # Only look at finished lines, the last one may still be streaming in
+    finished_lines = [line.strip().strip("`").lower() for line in text.split("\n")[:-1]]
+
+    direct_answer = None
+    has_product_name = False
+    for line in finished_lines:
+        if line.startswith("direct answer:"):
+            direct_answer = line.partition(":")[2]
+        elif line.startswith("product_name ="):
+            has_product_name = True
+
+    if direct_answer is None:
+        return False
+    # A complete, clearly negative direct answer settles the frame; the reasoning is not needed
+    if is_negative_verdict(direct_answer):
+        return True
+    return has_product_name
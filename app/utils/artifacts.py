@@ -0,0 +1,54 @@
+"""
+Artifacts
+Per-file analysis artifacts (inventories, caches) stored under the content hash
+of the media they were derived from
+"""
+
+import os
+import json
+import hashlib
+from typing import Optional
+
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", os.path.join("uploaded_files", "artifacts"))
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def file_content_hash(path: str) -> str:
+    """SHA-256 of the file's bytes, read in chunks. Media-store blobs are named by
+    their hash, so those are never re-read."""
+    from app.utils.media_store import blob_hash_from_path
+    known = blob_hash_from_path(path)
+    if known:
+        return known
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def artifact_path(content_hash: str, name: str) -> str:
+    """Path for artifact `name` of the media with this hash; the directory is created"""
+    directory = os.path.join(ARTIFACT_DIR, content_hash)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+def load_json_artifact(content_hash: str, name: str) -> Optional[dict]:
+    path = os.path.join(ARTIFACT_DIR, content_hash, name)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_json_artifact(content_hash: str, name: str, data: dict) -> str:
+    """Write atomically so a crashed run never leaves half an artifact behind"""
+    path = artifact_path(content_hash, name)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_path, path)
+    return path
@@ -0,0 +1,149 @@
+"""
+Frame Preparation
+CPU stage that resizes, JPEG-encodes and base64-encodes frames in a process pool,
+reading them from a shared-memory FrameRing, and tracks queue depth per stage
+"""
+
+import os
+import time
+import base64
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+import cv2
+import numpy as np
+from app.utils.frame_ring import FRAME_RING_SLOTS, FrameRing
+
+FRAME_PREP_WORKERS = int(os.getenv("FRAME_PREP_WORKERS", str(os.cpu_count() or 4)))
+# The vision model scales images to fit 2048 px and then to 768 px on the short side;
+# doing that here sends the same pixels in far fewer bytes
+FRAME_PAYLOAD_MAX_SIDE = int(os.getenv("FRAME_PAYLOAD_MAX_SIDE", "2048"))
+FRAME_PAYLOAD_SHORT_SIDE = int(os.getenv("FRAME_PAYLOAD_SHORT_SIDE", "768"))
+FRAME_JPEG_QUALITY = int(os.getenv("FRAME_JPEG_QUALITY", "90"))
+
+# A request waiting this long for a free ring slot encodes its frame on a thread instead
+_SLOT_WAIT_TIMEOUT = 30.0
+_SLOT_POLL_MAX = 0.05
+
+
+def payload_size(height: int, width: int) -> Tuple[int, int]:
+    """(height, width) of the payload for a frame of this size"""
+    scale = min(FRAME_PAYLOAD_MAX_SIDE / max(height, width), FRAME_PAYLOAD_SHORT_SIDE / min(height, width), 1.0)
+    return int(height * scale), int(width * scale)
+
+
+def prepare_payload(frame: np.ndarray, quality: int = FRAME_JPEG_QUALITY) -> str:
+    """Resized JPEG of the frame as base64"""
+    height, width = frame.shape[:2]
+    target_height, target_width = payload_size(height, width)
+    if (target_height, target_width) != (height, width):
+        frame = cv2.resize(frame, (target_width, target_height), interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("JPEG encoding failed")
+    return base64.b64encode(buffer).decode("utf-8")
+
+
+_ring: Optional[FrameRing] = None
+
+
+def _attach_ring(ring: FrameRing):
+    # Pool initializer: the ring arrives pickled by name and maps the shared block here
+    global _ring
+    _ring = ring
+
+
+def _prepare_slot(slot: int, height: int, width: int) -> str:
+    return prepare_payload(_ring.view(slot, height, width))
+
+
+class StageMetrics:
+    """Current and peak number of frames in each pipeline stage"""
+
+    def __init__(self, *stages: str):
+        self.current = {stage: 0 for stage in stages}
+        self.peak = {stage: 0 for stage in stages}
+
+    def enter(self, stage: str):
+        self.current[stage] += 1
+        self.peak[stage] = max(self.peak[stage], self.current[stage])
+
+    def leave(self, stage: str):
+        self.current[stage] -= 1
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        return {"current": dict(self.current), "peak": dict(self.peak)}
+
+
+class FramePrepStage:
+    """Process-pool encoder fed through a shared-memory ring, so frames are copied
+    once into shared memory instead of being pickled to the workers. Payloads are
+    sized to what the model uses (see payload_size).
+
+    Slots are claimed and filled on the event loop, so a cancelled request never
+    leaves a thread writing into the ring, and each slot goes back to the ring when
+    its encode job ends, even if the request that queued it was cancelled.
+
+    Stages tracked: waiting_slot (blocked on a free ring slot), encoding (in the
+    pool), ready (payload waiting for a network slot) and in_flight (request sent).
+    """
+
+    def __init__(self, frame_shape: Tuple[int, int, int], workers: int = FRAME_PREP_WORKERS,
+                 slots: int = FRAME_RING_SLOTS):
+        self.ring = FrameRing(frame_shape, slots)
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=_attach_ring, initargs=(self.ring,))
+        self.metrics = StageMetrics("waiting_slot", "encoding", "ready", "in_flight")
+        self.closed = False
+        print(f"[🧮 Frame prep] {workers} encoder processes, {slots} shared frame slots")
+
+    async def _claim_slot(self) -> Optional[int]:
+        # Polled on the loop instead of blocking an executor thread, so cancelling the
+        # request cancels the wait. Waiting is the back-pressure on decoding.
+        deadline = time.monotonic() + _SLOT_WAIT_TIMEOUT
+        delay = 0.001
+        while not self.closed:
+            slot = self.ring.try_claim()
+            if slot is not None:
+                return slot
+            if time.monotonic() >= deadline:
+                print(f"[⚠️ Frame prep] No free frame slot after {_SLOT_WAIT_TIMEOUT:.0f}s, encoding on a thread")
+                return None
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, _SLOT_POLL_MAX)
+        return None
+
+    async def prepare(self, frame: np.ndarray) -> str:
+        loop = asyncio.get_event_loop()
+        if self.closed or not self.ring.fits(frame):
+            return await loop.run_in_executor(None, prepare_payload, frame)
+
+        self.metrics.enter("waiting_slot")
+        try:
+            slot = await self._claim_slot()
+        finally:
+            self.metrics.leave("waiting_slot")
+        if slot is None:
+            return await loop.run_in_executor(None, prepare_payload, frame)
+
+        self.metrics.enter("encoding")
+        try:
+            try:
+                height, width = self.ring.fill(slot, frame)
+                job = self.pool.submit(_prepare_slot, slot, height, width)
+            except BaseException:
+                self.ring.release(slot)
+                raise
+            # The worker may still be reading the slot after this request is cancelled
+            job.add_done_callback(lambda _: self.ring.release(slot))
+            return await asyncio.wrap_future(job)
+        finally:
+            self.metrics.leave("encoding")
+
+    def close(self):
+        """Stop taking slots, wait for running encode jobs, then unmap the ring"""
+        self.closed = True
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self.ring.close()
+        print(f"[📈 Frame prep] Peak queue depths: {self.metrics.peak}")
@@ -0,0 +1,113 @@
+"""
+Frame Ring
+A multiprocessing.shared_memory ring buffer of fixed-size frame slots: producers
+copy frames into free slots, consumers read them as NumPy views, and only slot
+indices and small metadata tuples cross process boundaries
+"""
+
+import os
+import queue
+import multiprocessing
+from multiprocessing import shared_memory
+from typing import Optional, Tuple
+import numpy as np
+
+# Slots bound memory use: slots x max frame size (a 1080p BGR frame is ~6 MB)
+FRAME_RING_SLOTS = int(os.getenv("FRAME_RING_SLOTS", "32"))
+
+_ctx = multiprocessing.get_context("spawn")
+
+
+class FrameRing:
+    """Create once in the parent and pass to worker processes as a Process argument;
+    workers re-attach to the same shared block by name.
+
+    Producer:  slot = ring.write(frame, frame_index)
+    Consumer:  item = ring.read(); view is valid until ring.release(slot)
+    """
+
+    def __init__(self, max_shape: Tuple[int, int, int], slots: int = FRAME_RING_SLOTS):
+        self.max_shape = tuple(max_shape)
+        self.slots = slots
+        self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(self.max_shape)) * slots)
+        self.free = _ctx.Queue()
+        self.ready = _ctx.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+        self._attach()
+        self._owner = True
+
+    def _attach(self):
+        self.frames = np.ndarray((self.slots,) + self.max_shape, dtype=np.uint8, buffer=self.shm.buf)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["frames"]  # Views don't pickle; the child maps the block itself
+        state["shm"] = self.shm.name
+        state["_owner"] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.shm = shared_memory.SharedMemory(name=state["shm"])
+        self._attach()
+
+    def fits(self, frame: np.ndarray) -> bool:
+        return frame.shape[0] <= self.max_shape[0] and frame.shape[1] <= self.max_shape[1] \
+            and frame.shape[2:] == self.max_shape[2:]
+
+    def store(self, frame: np.ndarray, timeout: Optional[float] = None) -> Tuple[int, int, int]:
+        """Copy a frame into the next free slot, blocking while every slot is in use.
+        Returns (slot, height, width) for a consumer to view() it."""
+        if not self.fits(frame):
+            raise ValueError(f"Frame of shape {frame.shape} does not fit ring slots of {self.max_shape}")
+        slot = self.free.get(timeout=timeout)
+        return (slot,) + self.fill(slot, frame)
+
+    def try_claim(self) -> Optional[int]:
+        """A free slot without blocking, or None while every slot is in use"""
+        try:
+            return self.free.get_nowait()
+        except queue.Empty:
+            return None
+
+    def fill(self, slot: int, frame: np.ndarray) -> Tuple[int, int]:
+        """Copy a frame into a slot claimed with try_claim(); returns (height, width)"""
+        if not self.fits(frame):
+            raise ValueError(f"Frame of shape {frame.shape} does not fit ring slots of {self.max_shape}")
+        height, width = frame.shape[:2]
+        self.frames[slot, :height, :width] = frame
+        return height, width
+
+    def view(self, slot: int, height: int, width: int) -> np.ndarray:
+        return self.frames[slot, :height, :width]
+
+    def write(self, frame: np.ndarray, frame_index: int, timeout: Optional[float] = None) -> int:
+        """store() and queue the slot for read()"""
+        slot, height, width = self.store(frame, timeout)
+        self.ready.put((slot, frame_index, height, width))
+        return slot
+
+    def close_stream(self, consumers: int = 1):
+        """Tell each consumer there are no more frames"""
+        for _ in range(consumers):
+            self.ready.put(None)
+
+    def read(self, timeout: Optional[float] = None) -> Optional[Tuple[int, int, np.ndarray]]:
+        """(slot, frame_index, zero-copy view) of the next frame, or None at end of stream"""
+        item = self.ready.get(timeout=timeout)
+        if item is None:
+            return None
+        slot, frame_index, height, width = item
+        return slot, frame_index, self.view(slot, height, width)
+
+    def release(self, slot: int):
+        """Hand a slot back to producers once its view is no longer used"""
+        self.free.put(slot)
+
+    def close(self):
+        """Detach this process; the creating process also frees the shared block"""
+        self.frames = None
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
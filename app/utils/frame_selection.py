@@ -0,0 +1,164 @@
+"""
+Frame Selection
+Picks the sharpest frame of each sampling window and the smallest set of frames
+that covers a shelf pan, by tracking how far the camera moved between candidates
+"""
+
+import os
+from typing import List, Optional, Tuple
+import cv2
+import numpy as np
+from app.utils.panorama import downscale, estimate_translation
+
+# Consecutive selected frames overlap by at least this share of the frame
+COVERAGE_OVERLAP_MARGIN = float(os.getenv("COVERAGE_OVERLAP_MARGIN", "0.3"))
+# Candidates are checked every N decoded frames, dense enough for optical flow to track
+COVERAGE_CANDIDATE_STRIDE = int(os.getenv("COVERAGE_CANDIDATE_STRIDE", "5"))
+
+_FLOW_MAX_SIDE = 320
+_SHARPNESS_MAX_SIDE = 480
+
+
+def _gray_small(frame: np.ndarray) -> np.ndarray:
+    return cv2.cvtColor(downscale(frame, _FLOW_MAX_SIDE), cv2.COLOR_BGR2GRAY)
+
+
+def estimate_shift_flow(prev_gray: np.ndarray, gray: np.ndarray) -> Optional[Tuple[float, float]]:
+    """Median content shift (dx, dy) in small-image pixels from sparse Lucas-Kanade flow"""
+    points = cv2.goodFeaturesToTrack(prev_gray, maxCorners=200, qualityLevel=0.01, minDistance=8)
+    if points is None or len(points) < 10:
+        return None
+    moved, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None)
+    tracked = status.reshape(-1) == 1
+    if tracked.sum() < 10:
+        return None
+    delta = (moved[tracked] - points[tracked]).reshape(-1, 2)
+    dx, dy = np.median(delta, axis=0)
+    return float(dx), float(dy)
+
+
+def sharpness_score(frame: np.ndarray) -> float:
+    """Variance of the Laplacian on a downscaled grayscale copy: low means motion blur"""
+    gray = cv2.cvtColor(downscale(frame, _SHARPNESS_MAX_SIDE), cv2.COLOR_BGR2GRAY)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+class SharpestFramePicker:
+    """Scores every decoded frame and emits the sharpest one per window of `window` frames.
+
+    offer() returns the previous window's pick when a new window starts; call
+    finish() after the last frame to get the pick of the final window.
+    """
+
+    def __init__(self, window: int):
+        self.window = max(window, 1)
+        self.current_window = None
+        self.best = None  # (score, frame, frame_index)
+
+    def offer(self, frame: np.ndarray, frame_index: int) -> Optional[Tuple[np.ndarray, int]]:
+        window_id = frame_index // self.window
+        emitted = None
+        if window_id != self.current_window:
+            emitted = self.finish()
+            self.current_window = window_id
+
+        score = sharpness_score(frame)
+        if self.best is None or score > self.best[0]:
+            self.best = (score, frame, frame_index)
+        return emitted
+
+    def finish(self) -> Optional[Tuple[np.ndarray, int]]:
+        if self.best is None:
+            return None
+        _, frame, frame_index = self.best
+        self.best = None
+        return frame, frame_index
+
+
+class CoverageSelector:
+    """Greedy online selection: once the camera has moved far enough past the last kept
+    frame that less than `overlap_margin` of the view would still be shared, keep the
+    candidate just before that point, the last one that still overlaps enough.
+
+    Call consider() for each candidate in order and finish() after the last one.
+    """
+
+    def __init__(self, overlap_margin: float = COVERAGE_OVERLAP_MARGIN):
+        self.overlap_margin = overlap_margin
+        self.prev_gray = None
+        self.moved_x = 0.0  # Shift since the last kept frame, as a share of frame width/height
+        self.moved_y = 0.0
+        self.pending = None  # Last candidate seen but not kept ((frame, frame_index), moved_x, moved_y)
+        self.kept = 0
+        self.seen = 0
+
+    def _shift(self, gray: np.ndarray) -> Optional[Tuple[float, float]]:
+        height, width = self.prev_gray.shape[:2]
+        shift = estimate_shift_flow(self.prev_gray, gray)
+        if shift is not None:
+            return shift[0] / width, shift[1] / height
+        # Flow lost (blur, fast motion): fall back to ORB on the stored small frames
+        motion = estimate_translation(cv2.cvtColor(self.prev_gray, cv2.COLOR_GRAY2BGR),
+                                      cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR))
+        if motion is None:
+            return None
+        return motion[0] / width, motion[1] / height
+
+    def _moved(self) -> float:
+        return max(abs(self.moved_x), abs(self.moved_y))
+
+    def _keep(self, candidate: Tuple[np.ndarray, int]) -> List[Tuple[np.ndarray, int]]:
+        self.moved_x = self.moved_y = 0.0
+        self.pending = None
+        self.kept += 1
+        return [candidate]
+
+    def _uncovered_pending(self) -> List[Tuple[np.ndarray, int]]:
+        """The pending candidate if it still shows shelf area no kept frame covered"""
+        if self.pending is None or self._moved() <= self.overlap_margin / 2:
+            return []
+        return self._keep(self.pending[0])
+
+    def consider(self, frame: np.ndarray, frame_index: int) -> List[Tuple[np.ndarray, int]]:
+        """Candidates to analyze now, in order: none, this one, the one before it,
+        or both when a single step already moved past a whole view"""
+        self.seen += 1
+        gray = _gray_small(frame)
+        candidate = (frame, frame_index)
+        shift = self._shift(gray) if self.prev_gray is not None else None
+        first = self.prev_gray is None
+        self.prev_gray = gray
+
+        if first:
+            return self._keep(candidate)
+        if shift is None:
+            # No overlap with the previous candidate (cut or heavy blur): new area for sure
+            return self._uncovered_pending() + self._keep(candidate)
+
+        self.moved_x += shift[0]
+        self.moved_y += shift[1]
+        threshold = 1 - self.overlap_margin
+        if self._moved() < threshold:
+            self.pending = (candidate, self.moved_x, self.moved_y)
+            return []
+        if self.pending is None:
+            # The last candidate was kept, there is nothing in between to fall back to
+            return self._keep(candidate)
+
+        # Keep the candidate from just before the crossing, then measure from it: on a
+        # fast pan this one may already be more than a view further along
+        previous, moved_x, moved_y = self.pending
+        since_previous = (self.moved_x - moved_x, self.moved_y - moved_y)
+        selected = self._keep(previous)
+        self.moved_x, self.moved_y = since_previous
+        if self._moved() >= threshold:
+            return selected + self._keep(candidate)
+        self.pending = (candidate, self.moved_x, self.moved_y)
+        return selected
+
+    def finish(self) -> List[Tuple[np.ndarray, int]]:
+        """Last candidate if it still shows shelf area no kept frame covered"""
+        selected = self._uncovered_pending()
+        self.pending = None
+        print(f"[🎯 Coverage] Selected {self.kept} of {self.seen} candidate frames")
+        return selected
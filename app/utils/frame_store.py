@@ -0,0 +1,127 @@
+"""
+Frame Store
+Persists the sampled frames of a video as one memory-mapped array plus a small
+JSON index, so later questions on the same video skip decoding
+"""
+
+import os
+import json
+import tempfile
+from typing import Iterator, List, Optional, Tuple
+import cv2
+import numpy as np
+from app.utils.artifacts import artifact_path, ARTIFACT_DIR
+
+# Frames are stored at full resolution by default: price crops, packshot matching and
+# tiling work on decoded pixels, not on the model payload. Setting both (e.g. 2048/768,
+# the payload size from app/utils/frame_prep.py) trades that detail for disk space.
+FRAME_STORE_MAX_SIDE = int(os.getenv("FRAME_STORE_MAX_SIDE", "0"))
+FRAME_STORE_SHORT_SIDE = int(os.getenv("FRAME_STORE_SHORT_SIDE", "0"))
+
+
+def frame_store_key(window: int, sharpest: bool) -> str:
+    """Stores depend on how frames were sampled and how far they were downscaled"""
+    mode = "sharpest" if sharpest else "fixed"
+    size = f"{FRAME_STORE_MAX_SIDE}x{FRAME_STORE_SHORT_SIDE}" if FRAME_STORE_MAX_SIDE and FRAME_STORE_SHORT_SIDE else "full"
+    return f"frames_w{window}_{mode}_{size}"
+
+
+def dhash(frame: np.ndarray) -> str:
+    """64-bit difference hash of the frame as hex"""
+    gray = cv2.cvtColor(cv2.resize(frame, (9, 8), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+    bits = (gray[:, 1:] > gray[:, :-1]).flatten()
+    return f"{int(''.join('1' if b else '0' for b in bits), 2):016x}"
+
+
+def _store_size(frame: np.ndarray) -> np.ndarray:
+    if not (FRAME_STORE_MAX_SIDE and FRAME_STORE_SHORT_SIDE):
+        return frame
+    height, width = frame.shape[:2]
+    scale = min(FRAME_STORE_MAX_SIDE / max(height, width), FRAME_STORE_SHORT_SIDE / min(height, width), 1.0)
+    if scale == 1.0:
+        return frame
+    return cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+
+class FrameStore:
+    """Read side: frames are a read-only np.memmap, nothing is decoded"""
+
+    def __init__(self, data_path: str, index: dict):
+        self.index = index
+        self.entries: List[dict] = index["frames"]
+        self.frames = np.memmap(data_path, dtype=np.uint8, mode="r",
+                                shape=(len(self.entries),) + tuple(index["shape"]))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self) -> Iterator[Tuple[np.ndarray, int]]:
+        for position, entry in enumerate(self.entries):
+            yield self.frames[position], entry["frame_index"]
+
+
+class FrameStoreWriter:
+    """Appends raw uint8 frames to a temp file; finish() publishes data and index together.
+
+    Several analyses of one video (batch questions, two sessions) may write the same
+    store at once, so each writer has its own temp file and the first to finish wins.
+    """
+
+    def __init__(self, content_hash: str, key: str):
+        self.data_path = artifact_path(content_hash, key + ".frames")
+        self.index_path = artifact_path(content_hash, key + ".json")
+        fd, self.temp_path = tempfile.mkstemp(dir=os.path.dirname(self.data_path), prefix=key + ".",
+                                              suffix=".frames.tmp")
+        self.file = os.fdopen(fd, "wb")
+        self.shape = None
+        self.entries = []
+
+    def add(self, frame: np.ndarray, frame_index: int, timestamp_ms: int) -> np.ndarray:
+        """Store the frame and return the stored copy (the frame itself unless the store
+        downscales), so the first run analyzes exactly what later runs will read back"""
+        stored = np.ascontiguousarray(_store_size(frame))
+        if self.shape is None:
+            self.shape = stored.shape
+        if stored.shape != self.shape:
+            stored = cv2.resize(stored, (self.shape[1], self.shape[0]), interpolation=cv2.INTER_AREA)
+        self.file.write(stored.tobytes())
+        self.entries.append({"frame_index": frame_index, "timestamp_ms": timestamp_ms, "dhash": dhash(stored)})
+        return stored
+
+    def finish(self, fps: float, total_frames: int):
+        self.file.close()
+        if not self.entries:
+            os.remove(self.temp_path)
+            return
+        if os.path.exists(self.index_path):
+            # Another analysis of the same video published first; it sampled the same frames
+            os.remove(self.temp_path)
+            print(f"[💾 Frame store] {self.data_path} already saved by another run")
+            return
+        os.replace(self.temp_path, self.data_path)
+        index = {"shape": list(self.shape), "fps": fps, "total_frames": total_frames, "frames": self.entries}
+        fd, index_temp = tempfile.mkstemp(dir=os.path.dirname(self.index_path), suffix=".json.tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        # The index is written last: a store without one is never read
+        os.replace(index_temp, self.index_path)
+        print(f"[💾 Frame store] Saved {len(self.entries)} frames to {self.data_path}")
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+def load_frame_store(content_hash: str, key: str) -> Optional[FrameStore]:
+    data_path = os.path.join(ARTIFACT_DIR, content_hash, key + ".frames")
+    index_path = os.path.join(ARTIFACT_DIR, content_hash, key + ".json")
+    if not (os.path.exists(data_path) and os.path.exists(index_path)):
+        return None
+    with open(index_path, "r", encoding="utf-8") as f:
+        index = json.load(f)
+    expected = len(index["frames"]) * int(np.prod(index["shape"]))
+    if os.path.getsize(data_path) != expected:
+        print(f"[⚠️ Frame store] {data_path} is incomplete, decoding again")
+        return None
+    return FrameStore(data_path, index)
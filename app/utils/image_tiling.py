@@ -0,0 +1,121 @@
+"""
+Image Tiling
+Splits large shelf images into an overview plus overlapping full-resolution
+tiles so small labels and price tags survive the model's internal downscaling
+"""
+
+import os
+from dataclasses import dataclass
+from typing import List
+import cv2
+import numpy as np
+
+# Images whose longer side exceeds this are tiled
+TILE_MIN_SIDE = int(os.getenv("TILE_MIN_SIDE", "2048"))
+TILE_SIZE = int(os.getenv("TILE_SIZE", "1024"))
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", "0.2"))
+MAX_TILES = int(os.getenv("MAX_TILES", "16"))
+
+
+@dataclass
+class Tile:
+    """A tile cut from the image pyramid, with its box in full-image pixels"""
+    level: int  # 0 = whole-image overview, 1 = detail level
+    row: int
+    col: int
+    x0: int
+    y0: int
+    x1: int
+    y1: int
+    image: np.ndarray
+
+    @property
+    def label(self) -> str:
+        if self.level == 0:
+            return "Overview"
+        return f"Tile r{self.row}c{self.col}"
+
+
+def needs_tiling(image: np.ndarray, min_side: int = TILE_MIN_SIDE) -> bool:
+    return max(image.shape[:2]) > min_side
+
+
+def _grid_starts(length: int, tile: int, overlap: float) -> List[int]:
+    """Start offsets covering [0, length) with tiles of size `tile` overlapping by `overlap`"""
+    if length <= tile:
+        return [0]
+    stride = max(int(tile * (1 - overlap)), 1)
+    starts = list(range(0, length - tile, stride))
+    starts.append(length - tile)  # Last tile flush with the edge
+    return starts
+
+
+def _resize_max_side(image: np.ndarray, max_side: int) -> np.ndarray:
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+
+def build_pyramid_tiles(image: np.ndarray, tile_size: int = TILE_SIZE, overlap: float = TILE_OVERLAP,
+                        max_tiles: int = MAX_TILES) -> List[Tile]:
+    """Two-level pyramid: a downscaled overview of the whole shelf for context, and
+    the finest level whose overlapping tile grid stays within `max_tiles`."""
+    height, width = image.shape[:2]
+    tiles = [Tile(0, 0, 0, 0, 0, width, height, _resize_max_side(image, tile_size))]
+
+    # Walk down from native resolution until the grid fits the tile budget
+    scale = 1.0
+    while True:
+        level_w, level_h = int(width * scale), int(height * scale)
+        xs = _grid_starts(level_w, tile_size, overlap)
+        ys = _grid_starts(level_h, tile_size, overlap)
+        if len(xs) * len(ys) <= max_tiles or max(level_w, level_h) <= tile_size:
+            break
+        scale /= 2 ** 0.5
+
+    level_image = image if scale == 1.0 else cv2.resize(image, (level_w, level_h), interpolation=cv2.INTER_AREA)
+    for row, y in enumerate(ys):
+        for col, x in enumerate(xs):
+            crop = level_image[y:y + tile_size, x:x + tile_size]
+            tiles.append(Tile(
+                level=1, row=row, col=col,
+                x0=int(x / scale), y0=int(y / scale),
+                x1=min(int((x + crop.shape[1]) / scale), width),
+                y1=min(int((y + crop.shape[0]) / scale), height),
+                image=crop,
+            ))
+    return tiles
+
+
+def _horizontal_zone(start: float, end: float) -> str:
+    center = (start + end) / 2
+    return "left" if center < 1 / 3 else "center" if center < 2 / 3 else "right"
+
+
+def _vertical_zone(start: float, end: float) -> str:
+    center = (start + end) / 2
+    return "top" if center < 1 / 3 else "middle" if center < 2 / 3 else "bottom"
+
+
+def describe_tile_region(tile: Tile, width: int, height: int) -> str:
+    """Prompt context placing the tile inside the whole image"""
+    if tile.level == 0:
+        return f"\n🧩 This is a downscaled overview of the whole {width}x{height} px shelf image."
+    zone = f"{_vertical_zone(tile.y0 / height, tile.y1 / height)}-{_horizontal_zone(tile.x0 / width, tile.x1 / width)}"
+    return (
+        f"\n🧩 This image is one tile of a larger {width}x{height} px shelf image."
+        f"\n📐 It covers x {tile.x0}-{tile.x1} px and y {tile.y0}-{tile.y1} px "
+        f"({tile.x0 * 100 // width}-{tile.x1 * 100 // width}% across, {tile.y0 * 100 // height}-{tile.y1 * 100 // height}% down), "
+        f"the {zone} part of the shelf."
+        f"\n- Describe locations relative to the whole shelf using this position, not relative to the tile."
+        f"\n- Products cut off at the tile edge also appear in the neighbouring tile."
+    )
+
+
+def tile_heading(tile: Tile, width: int, height: int) -> str:
+    """Label put in front of a tile's answer when merging, in whole-image coordinates"""
+    if tile.level == 0:
+        return f"{tile.label} (whole image, {width}x{height} px)"
+    return f"{tile.label} (x {tile.x0}-{tile.x1} px, y {tile.y0}-{tile.y1} px of {width}x{height} px)"
@@ -0,0 +1,431 @@
+"""
+LLM Router
+Maps each call site (classify, frame_vision, summary, critic, explain, ...) to an
+Azure OpenAI deployment, or a pool of deployments, with their own clients,
+rate-limit buckets and circuit breakers
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional, Tuple
+import openai
+from openai import AzureOpenAI
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Call sites that can be routed to their own deployment. Each one reads
+# AZURE_OPENAI_DEPLOYMENT_NAME_<SITE> (and optionally _ENDPOINT_/_API_KEY_/
+# _TOKENS_PER_MIN_/_REQUESTS_PER_MIN_ with the same suffix) and falls back to
+# the shared AZURE_OPENAI_* settings when not set.
+CALL_SITES = ["default", "classify", "prescreen", "frame_vision", "summary", "critic", "explain"]
+
+# Default per-deployment limits
+TOKENS_PER_MIN = 120_000
+REQUESTS_PER_MIN = 1_200
+WINDOW_SECONDS = 60
+
+# Circuit breaker: eject an endpoint after consecutive failures, re-admit it
+# for a trial request once the cooldown has passed
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("AZURE_OPENAI_BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("AZURE_OPENAI_BREAKER_COOLDOWN", "30"))
+
+
+def is_endpoint_failure(exc: Exception) -> bool:
+    """Errors that say something about the endpoint's health (not about our request)"""
+    if isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code == 429 or exc.status_code >= 500
+    return False
+
+
+class RateLimitBucket:
+    """Sliding-window token and request budget for a single deployment"""
+
+    def __init__(self, name: str, tokens_per_min: int = TOKENS_PER_MIN,
+                 requests_per_min: int = REQUESTS_PER_MIN, window_seconds: int = WINDOW_SECONDS):
+        self.name = name
+        self.tokens_per_min = tokens_per_min
+        self.requests_per_min = requests_per_min
+        self.window_seconds = window_seconds
+        self.token_usage_log = deque()
+        self.request_log = deque()
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float):
+        while self.token_usage_log and now - self.token_usage_log[0][0] > self.window_seconds:
+            self.token_usage_log.popleft()
+        while self.request_log and now - self.request_log[0] > self.window_seconds:
+            self.request_log.popleft()
+
+    def load(self) -> Tuple[int, int]:
+        """Current (requests, tokens) inside the window"""
+        with self._lock:
+            self._prune(time.time())
+            return len(self.request_log), sum(tokens for _, tokens in self.token_usage_log)
+
+    def _reserve(self, estimated_tokens: int) -> float:
+        """Record the request if it fits, otherwise return how long to wait"""
+        with self._lock:
+            now = time.time()
+            self._prune(now)
+            current_tokens = sum(tokens for _, tokens in self.token_usage_log)
+            current_requests = len(self.request_log)
+
+            if (current_tokens + estimated_tokens > self.tokens_per_min) or (current_requests >= self.requests_per_min):
+                oldest = self.request_log[0] if self.request_log else now
+                return max(self.window_seconds - (now - oldest), 0.1)
+
+            self.token_usage_log.append((now, estimated_tokens))
+            self.request_log.append(now)
+            return 0.0
+
+    async def acquire(self, estimated_tokens: int):
+        while True:
+            wait_time = self._reserve(estimated_tokens)
+            if not wait_time:
+                return
+            print(f"[⏳ Throttling {self.name}] Waiting {wait_time:.2f}s to avoid exceeding limits...")
+            await asyncio.sleep(wait_time)
+
+    def acquire_blocking(self, estimated_tokens: int):
+        while True:
+            wait_time = self._reserve(estimated_tokens)
+            if not wait_time:
+                return
+            print(f"[⏳ Throttling {self.name}] Waiting {wait_time:.2f}s to avoid exceeding limits...")
+            time.sleep(wait_time)
+
+    def remaining_fraction(self) -> float:
+        """Share of the tighter of the two limits still available in the window"""
+        requests, tokens = self.load()
+        return max(min(1 - tokens / self.tokens_per_min, 1 - requests / self.requests_per_min), 0.0)
+
+
+@dataclass(frozen=True)
+class BreakerTicket:
+    """Admission granted by CircuitBreaker.allow(): how many times the breaker had opened
+    when the request was let through, and whether it is the half-open trial"""
+    openings: int
+    trial: bool = False
+
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open trial after cooldown.
+
+    Outcomes are reported with the request's ticket. While the breaker is open only
+    the trial's outcome counts, and requests admitted before the last opening no
+    longer count at all, so a slow straggler cannot re-admit or re-eject the endpoint.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 cooldown_seconds: float = BREAKER_COOLDOWN_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.openings = 0
+        self._trial: Optional[BreakerTicket] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.time() - self.opened_at >= self.cooldown_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> Optional[BreakerTicket]:
+        """Ticket for a request that may go to the endpoint, None while it is ejected"""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return BreakerTicket(self.openings)
+            if state == "half_open" and self._trial is None:
+                self._trial = BreakerTicket(self.openings, trial=True)
+                print(f"[🩺 Breaker {self.name}] Cooldown over, sending a trial request")
+                return self._trial
+            return None
+
+    def reopens_in(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(self.cooldown_seconds - (time.time() - self.opened_at), 0.0)
+
+    def _counts(self, ticket: Optional[BreakerTicket]) -> bool:
+        # No ticket: reported outside the pool, counted like a request admitted just now
+        if self.opened_at is not None:
+            return ticket is not None and ticket is self._trial
+        return ticket is None or ticket.openings == self.openings
+
+    def record_success(self, ticket: Optional[BreakerTicket] = None):
+        with self._lock:
+            if not self._counts(ticket):
+                return
+            if self.opened_at is not None:
+                print(f"[✅ Breaker {self.name}] Endpoint re-admitted")
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self._trial = None
+
+    def release_trial(self, ticket: Optional[BreakerTicket]):
+        """Give back the trial slot if `ticket` holds it and never reported an outcome"""
+        with self._lock:
+            if ticket is not None and ticket is self._trial:
+                self._trial = None
+
+    def record_failure(self, ticket: Optional[BreakerTicket] = None):
+        with self._lock:
+            if not self._counts(ticket):
+                return
+            self.consecutive_failures += 1
+            self._trial = None
+            if self.opened_at is not None or self.consecutive_failures >= self.failure_threshold:
+                self.opened_at = time.time()
+                self.openings += 1
+                print(f"[🚫 Breaker {self.name}] Ejected for {self.cooldown_seconds:.0f}s "
+                      f"after {self.consecutive_failures} failures")
+
+
+@dataclass
+class Route:
+    """Deployment, credentials and rate-limit bucket serving one call site. The pool hands
+    out a copy per request carrying its breaker ticket."""
+    site: str
+    deployment: Optional[str]
+    endpoint: Optional[str]
+    api_key: Optional[str]
+    api_version: Optional[str]
+    bucket: RateLimitBucket
+    breaker: CircuitBreaker
+    _client: Optional[AzureOpenAI] = field(default=None, repr=False)
+    ticket: Optional[BreakerTicket] = field(default=None, repr=False)
+
+    def is_configured(self) -> bool:
+        return all([self.deployment, self.endpoint, self.api_key, self.api_version])
+
+    @property
+    def client(self) -> AzureOpenAI:
+        if self._client is None:
+            self._client = _get_client(self.endpoint, self.api_key, self.api_version)
+        return self._client
+
+    def admitted(self, ticket: BreakerTicket) -> "Route":
+        return replace(self, ticket=ticket)
+
+    def record_success(self):
+        self.breaker.record_success(self.ticket)
+
+    def record_failure(self):
+        self.breaker.record_failure(self.ticket)
+
+    def record_error(self, exc: Exception):
+        # A rejected request (bad input, content filter) still means the endpoint answered;
+        # anything that is not an API error happened on our side and says nothing either way
+        if is_endpoint_failure(exc):
+            self.record_failure()
+        elif isinstance(exc, openai.APIError):
+            self.record_success()
+
+    def release(self):
+        """Call on every exit path once the request is done or abandoned, so a half-open
+        trial that never reached the endpoint does not keep it ejected"""
+        self.breaker.release_trial(self.ticket)
+
+
+class EndpointPool:
+    """Spreads a call site's requests over its routes by remaining quota,
+    skipping endpoints whose circuit breaker is open"""
+
+    def __init__(self, site: str, routes: List[Route]):
+        self.site = site
+        self.routes = routes
+
+    @property
+    def primary(self) -> Route:
+        return self.routes[0]
+
+    def pick(self) -> Optional[Route]:
+        """Weighted choice among healthy routes, admitted by its breaker, or None if every
+        breaker is open"""
+        candidates = [route for route in self.routes if route.breaker.state != "open"]
+        while candidates:
+            # +1 floor so exhausted endpoints are still picked when every endpoint is exhausted
+            weights = [route.bucket.remaining_fraction() * route.bucket.tokens_per_min + 1 for route in candidates]
+            route = random.choices(candidates, weights=weights, k=1)[0]
+            ticket = route.breaker.allow()
+            if ticket is not None:
+                return route.admitted(ticket)
+            # Half-open endpoint whose trial request is still in flight
+            candidates.remove(route)
+        return None
+
+    def _retry_delay(self) -> float:
+        return max(min(route.breaker.reopens_in() for route in self.routes), 1.0)
+
+    async def acquire(self, estimated_tokens: int) -> Route:
+        """Pick a healthy route and reserve capacity on its bucket"""
+        while True:
+            route = self.pick()
+            if route is not None:
+                try:
+                    await route.bucket.acquire(estimated_tokens)
+                except BaseException:
+                    route.release()
+                    raise
+                return route
+            delay = self._retry_delay()
+            print(f"[⏸️ {self.site}] All endpoints ejected, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    def acquire_blocking(self, estimated_tokens: int) -> Route:
+        while True:
+            route = self.pick()
+            if route is not None:
+                try:
+                    route.bucket.acquire_blocking(estimated_tokens)
+                except BaseException:
+                    route.release()
+                    raise
+                return route
+            delay = self._retry_delay()
+            print(f"[⏸️ {self.site}] All endpoints ejected, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    def chat_completion(self, estimated_tokens: int = 500, **kwargs):
+        """Blocking chat completion on a healthy route, feeding its circuit breaker"""
+        route = self.acquire_blocking(estimated_tokens)
+        try:
+            response = route.client.chat.completions.create(model=route.deployment, **kwargs)
+            route.record_success()
+            return response
+        except Exception as e:
+            route.record_error(e)
+            raise
+        finally:
+            route.release()
+
+
+_clients: Dict[Tuple, AzureOpenAI] = {}
+_buckets: Dict[Tuple, RateLimitBucket] = {}
+_breakers: Dict[Tuple, CircuitBreaker] = {}
+_pools: Dict[str, EndpointPool] = {}
+_registry_lock = threading.Lock()
+
+
+def _get_client(endpoint, api_key, api_version) -> AzureOpenAI:
+    key = (endpoint, api_key, api_version)
+    if key not in _clients:
+        _clients[key] = AzureOpenAI(
+            api_version=api_version,
+            azure_endpoint=endpoint,
+            api_key=api_key,
+        )
+    return _clients[key]
+
+
+def _site_env(name: str, site: str, default=None):
+    if site != "default":
+        value = os.getenv(f"{name}_{site.upper()}")
+        if value:
+            return value
+    return os.getenv(name, default)
+
+
+def _make_route(site: str, deployment, endpoint, api_key, api_version,
+                tokens_per_min, requests_per_min) -> Route:
+    # Quota and health are per deployment, so sites sharing one share its bucket and breaker
+    key = (endpoint, deployment)
+    name = f"{deployment or 'default'}@{endpoint or '?'}"
+    tokens_per_min, requests_per_min = int(tokens_per_min), int(requests_per_min)
+    if key not in _buckets:
+        _buckets[key] = RateLimitBucket(name, tokens_per_min, requests_per_min)
+        _breakers[key] = CircuitBreaker(name)
+    else:
+        bucket = _buckets[key]
+        if (tokens_per_min, requests_per_min) != (bucket.tokens_per_min, bucket.requests_per_min):
+            # One deployment has one quota: when sites configure it differently the tighter limit wins
+            bucket.tokens_per_min = min(bucket.tokens_per_min, tokens_per_min)
+            bucket.requests_per_min = min(bucket.requests_per_min, requests_per_min)
+            print(f"[⚠️ Route] {site} sets other limits for {name}; using {bucket.tokens_per_min} tokens/min, "
+                  f"{bucket.requests_per_min} req/min")
+
+    return Route(
+        site=site,
+        deployment=deployment,
+        endpoint=endpoint,
+        api_key=api_key,
+        api_version=api_version,
+        bucket=_buckets[key],
+        breaker=_breakers[key],
+    )
+
+
+def _load_endpoint_list(site: str) -> List[dict]:
+    """AZURE_OPENAI_ENDPOINTS_<SITE>: JSON list of {"endpoint", "deployment", "api_key", ...}"""
+    raw = os.getenv(f"AZURE_OPENAI_ENDPOINTS_{site.upper()}")
+    if not raw:
+        return []
+    try:
+        entries = json.loads(raw)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"AZURE_OPENAI_ENDPOINTS_{site.upper()} is not valid JSON: {e}")
+    if not isinstance(entries, list):
+        raise ValueError(f"AZURE_OPENAI_ENDPOINTS_{site.upper()} must be a JSON list")
+    return entries
+
+
+def get_pool(site: str = "default") -> EndpointPool:
+    """Resolve (and cache) the endpoint pool for a call site"""
+    if site not in CALL_SITES:
+        raise ValueError(f"Unknown call site '{site}'. Expected one of: {', '.join(CALL_SITES)}")
+
+    with _registry_lock:
+        if site in _pools:
+            return _pools[site]
+
+        default_version = _site_env("AZURE_OPENAI_API_VERSION", site, "2024-02-01")
+        default_tpm = _site_env("AZURE_OPENAI_TOKENS_PER_MIN", site, TOKENS_PER_MIN)
+        default_rpm = _site_env("AZURE_OPENAI_REQUESTS_PER_MIN", site, REQUESTS_PER_MIN)
+
+        routes = [
+            _make_route(
+                site,
+                deployment=entry.get("deployment"),
+                endpoint=entry.get("endpoint"),
+                api_key=entry.get("api_key"),
+                api_version=entry.get("api_version", default_version),
+                tokens_per_min=entry.get("tokens_per_min", default_tpm),
+                requests_per_min=entry.get("requests_per_min", default_rpm),
+            )
+            for entry in _load_endpoint_list(site)
+        ]
+        if not routes:
+            routes = [_make_route(
+                site,
+                deployment=_site_env("AZURE_OPENAI_DEPLOYMENT_NAME", site),
+                endpoint=_site_env("AZURE_OPENAI_ENDPOINT", site),
+                api_key=_site_env("AZURE_OPENAI_API_KEY", site),
+                api_version=default_version,
+                tokens_per_min=default_tpm,
+                requests_per_min=default_rpm,
+            )]
+
+        pool = EndpointPool(site, routes)
+        _pools[site] = pool
+        print(f"[🧭 Route] {site} -> {', '.join(route.bucket.name for route in routes)}")
+        return pool
+
+
+def get_route(site: str = "default") -> Route:
+    """Primary route for a call site (the only one unless a pool is configured)"""
+    return get_pool(site).primary
@@ -0,0 +1,46 @@
+"""
+Media Probe
+Reads fps, frame count, duration and resolution once per file and keeps them as
+an artifact of the file's content hash
+"""
+
+import os
+import cv2
+from PIL import Image
+from app.utils.artifacts import file_content_hash, load_json_artifact, save_json_artifact
+
+METADATA_ARTIFACT = "metadata.json"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def _probe(path: str) -> dict:
+    if path.lower().endswith(IMAGE_EXTENSIONS):
+        # PIL only reads the header here, not the pixels
+        with Image.open(path) as image:
+            width, height = image.size
+        return {"type": "image", "width": width, "height": height, "size_bytes": os.path.getsize(path)}
+
+    cap = cv2.VideoCapture(path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    info = {
+        "type": "video",
+        "fps": fps,
+        "frame_count": frame_count,
+        "duration_ms": (frame_count / fps) * 1000.0 if fps > 0 else 0.0,
+        "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        "size_bytes": os.path.getsize(path),
+    }
+    cap.release()
+    return info
+
+
+def probe_media(path: str) -> dict:
+    """Cached metadata for the file at `path`"""
+    content_hash = file_content_hash(path)
+    info = load_json_artifact(content_hash, METADATA_ARTIFACT)
+    if info is None:
+        info = _probe(path)
+        save_json_artifact(content_hash, METADATA_ARTIFACT, info)
+    return info
@@ -0,0 +1,172 @@
+"""
+Media Store
+Content-addressed storage for uploads: files are kept once as blobs named by their
+SHA-256, user-facing names are aliases, and derived artifacts belong to the blob
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from typing import BinaryIO, Dict, List, Optional, Tuple
+from app.utils.artifacts import ARTIFACT_DIR
+
+MEDIA_DIR = os.getenv("MEDIA_DIR", "uploaded_files")
+BLOB_DIR = os.path.join(MEDIA_DIR, "blobs")
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+
+MEDIA_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".jpg", ".jpeg", ".png")
+
+_HASH_NAME = re.compile(r"^[0-9a-f]{64}$")
+
+
+def blob_hash_from_path(path: str) -> Optional[str]:
+    """Content hash encoded in a blob's file name, without reading the file"""
+    if os.path.abspath(os.path.dirname(path)) != os.path.abspath(BLOB_DIR):
+        return None
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return stem if _HASH_NAME.match(stem) else None
+
+
+class MediaStore:
+    """Blobs live in uploaded_files/blobs/<sha256><ext>; media_index.json maps alias
+    names to hashes and records per-blob metadata"""
+
+    def __init__(self, media_dir: str = MEDIA_DIR):
+        self.media_dir = media_dir
+        self.blob_dir = os.path.join(media_dir, "blobs")
+        self.index_path = os.path.join(media_dir, "media_index.json")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.index = self._load_index()
+
+    def _load_index(self) -> dict:
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return {"aliases": {}, "blobs": {}}
+
+    def _save_index(self):
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(temp_path, self.index_path)
+
+    def blob_path(self, content_hash: str) -> str:
+        ext = self.index["blobs"][content_hash]["ext"]
+        return os.path.join(self.blob_dir, content_hash + ext)
+
+    def _free_alias(self, name: str, content_hash: str) -> str:
+        """`name` unless it already points at other content, then `name (2)`, `name (3)`, ..."""
+        stem, ext = os.path.splitext(name)
+        candidate, counter = name, 2
+        while self.index["aliases"].get(candidate) not in (None, content_hash):
+            candidate = f"{stem} ({counter}){ext}"
+            counter += 1
+        return candidate
+
+    def put_stream(self, stream: BinaryIO, name: str, chunk_size: int = UPLOAD_CHUNK_SIZE) -> Tuple[str, str, bool]:
+        """Copy an upload to disk in chunks while hashing it.
+
+        Returns (alias, blob_path, duplicate). A duplicate's bytes are discarded and
+        the alias points at the existing blob, so all of its artifacts are reused.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.blob_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for chunk in iter(lambda: stream.read(chunk_size), b""):
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        content_hash = digest.hexdigest()
+        ext = os.path.splitext(name)[1].lower()
+        with self._lock:
+            duplicate = content_hash in self.index["blobs"]
+            if duplicate:
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, os.path.join(self.blob_dir, content_hash + ext))
+                self.index["blobs"][content_hash] = {"ext": ext, "size": size, "created": time.time()}
+            alias = self._free_alias(name, content_hash)
+            self.index["aliases"][alias] = content_hash
+            self._save_index()
+
+        if duplicate:
+            print(f"[♻️ Media store] {name} is identical to an earlier upload ({content_hash[:12]}), reusing it")
+        return alias, self.blob_path(content_hash), duplicate
+
+    def resolve(self, alias: str) -> Optional[str]:
+        content_hash = self.index["aliases"].get(alias)
+        return self.blob_path(content_hash) if content_hash else None
+
+    def aliases(self) -> List[str]:
+        return sorted(self.index["aliases"])
+
+    def aliases_for(self, content_hash: str) -> List[str]:
+        return sorted(a for a, h in self.index["aliases"].items() if h == content_hash)
+
+    def artifacts(self, content_hash: str) -> List[str]:
+        """Derived files (frame stores, inventories, caches) that belong to this blob"""
+        directory = os.path.join(ARTIFACT_DIR, content_hash)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(os.path.join(directory, name) for name in os.listdir(directory))
+
+    def remove_alias(self, alias: str):
+        with self._lock:
+            self.index["aliases"].pop(alias, None)
+            self._save_index()
+
+    def gc(self) -> Dict[str, int]:
+        """Delete blobs no alias points to together with their artifacts, and .part
+        files left by interrupted uploads.
+
+        Only artifacts of blobs removed here are touched: ARTIFACT_DIR also holds the
+        analysis data of media the store never owned (files placed in uploaded_files/
+        directly, batch runs over other directories).
+        """
+        removed = {"blobs": 0, "artifact_dirs": 0, "partial_uploads": 0}
+        with self._lock:
+            referenced = set(self.index["aliases"].values())
+            for content_hash in list(self.index["blobs"]):
+                if content_hash not in referenced:
+                    path = self.blob_path(content_hash)
+                    if os.path.exists(path):
+                        os.remove(path)
+                    del self.index["blobs"][content_hash]
+                    removed["blobs"] += 1
+                    artifact_dir = os.path.join(ARTIFACT_DIR, content_hash)
+                    if os.path.isdir(artifact_dir):
+                        shutil.rmtree(artifact_dir, ignore_errors=True)
+                        removed["artifact_dirs"] += 1
+            self._save_index()
+
+            for name in os.listdir(self.blob_dir):
+                path = os.path.join(self.blob_dir, name)
+                # Only uploads that stalled for an hour; a live upload keeps its .part file fresh
+                if name.endswith(".part") and time.time() - os.path.getmtime(path) > 3600:
+                    os.remove(path)
+                    removed["partial_uploads"] += 1
+
+        print(f"[🧹 Media store] Garbage collected {removed}")
+        return removed
+
+
+_store = None
+
+
+def get_media_store() -> MediaStore:
+    global _store
+    if _store is None:
+        _store = MediaStore()
+    return _store
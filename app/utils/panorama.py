@@ -0,0 +1,204 @@
+"""
+Panorama Stitching
+Builds one (or a few) shelf panoramas from the sampled frames of a pan video,
+keeping a map from panorama position back to frame timestamps
+"""
+
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+import cv2
+import numpy as np
+
+# Frames are downscaled before stitching to keep CPU time and panorama size bounded
+PANORAMA_FRAME_MAX_SIDE = int(os.getenv("PANORAMA_FRAME_MAX_SIDE", "1280"))
+# Only frames that moved at least this share of the frame since the last kept one are stitched
+PANORAMA_MIN_SHIFT = float(os.getenv("PANORAMA_MIN_SHIFT", "0.25"))
+PANORAMA_MAX_FRAMES = int(os.getenv("PANORAMA_MAX_FRAMES", "40"))
+
+_MOTION_MAX_SIDE = 640
+
+
+@dataclass
+class Panorama:
+    """A stitched panorama and where each source frame lands along the pan axis"""
+    image: np.ndarray
+    axis: str  # "x" for lateral pans, "y" for vertical ones
+    frame_indices: List[int]
+    timestamps: List[int]
+    spans: List[Tuple[int, int]] = field(default_factory=list)  # Per frame, in panorama px along `axis`
+
+    def timestamps_for_range(self, start: int, end: int) -> List[int]:
+        """Timestamps of frames whose centre falls inside [start, end) along the pan axis"""
+        matches = []
+        for (s, e), ts in zip(self.spans, self.timestamps):
+            if start <= (s + e) / 2 < end:
+                matches.append(ts)
+        if not matches and self.spans:
+            # Range narrower than a frame: take the frame covering its middle
+            middle = (start + end) / 2
+            best = min(range(len(self.spans)), key=lambda i: abs((self.spans[i][0] + self.spans[i][1]) / 2 - middle))
+            matches.append(self.timestamps[best])
+        return matches
+
+
+def downscale(frame: np.ndarray, max_side: int) -> np.ndarray:
+    height, width = frame.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return frame
+    return cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+
+_local = threading.local()
+
+
+def _get_orb():
+    # Motion is estimated from several executor threads and an ORB detector is not safe
+    # to share, so each thread gets its own
+    orb = getattr(_local, "orb", None)
+    if orb is None:
+        orb = _local.orb = cv2.ORB_create(nfeatures=1000)
+    return orb
+
+
+def estimate_translation(prev_frame: np.ndarray, frame: np.ndarray) -> Optional[Tuple[float, float]]:
+    """Content shift (dx, dy) in `frame` pixels from prev_frame to frame, via ORB
+    matches and a RANSAC similarity fit. None when the frames don't overlap enough."""
+    scale = min(_MOTION_MAX_SIDE / max(frame.shape[:2]), 1.0)
+    prev_gray = cv2.cvtColor(downscale(prev_frame, _MOTION_MAX_SIDE), cv2.COLOR_BGR2GRAY)
+    gray = cv2.cvtColor(downscale(frame, _MOTION_MAX_SIDE), cv2.COLOR_BGR2GRAY)
+
+    orb = _get_orb()
+    kp1, des1 = orb.detectAndCompute(prev_gray, None)
+    kp2, des2 = orb.detectAndCompute(gray, None)
+    if des1 is None or des2 is None or len(kp1) < 10 or len(kp2) < 10:
+        return None
+
+    matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+    good = []
+    for pair in matcher.knnMatch(des1, des2, k=2):
+        if len(pair) == 2 and pair[0].distance < 0.75 * pair[1].distance:
+            good.append(pair[0])
+    if len(good) < 10:
+        return None
+
+    src = np.float32([kp1[m.queryIdx].pt for m in good])
+    dst = np.float32([kp2[m.trainIdx].pt for m in good])
+    matrix, inliers = cv2.estimateAffinePartial2D(src, dst, method=cv2.RANSAC, ransacReprojThreshold=3.0)
+    if matrix is None or inliers is None or inliers.sum() < 8:
+        return None
+    return float(matrix[0, 2]) / scale, float(matrix[1, 2]) / scale
+
+
+def _select_stitch_frames(frames, frame_indices, timestamps):
+    """Split the sampled frames into overlapping runs, keeping frames that moved enough.
+
+    Returns (groups, leftovers). Each group is a list of (frame, frame_index, timestamp,
+    dx, dy) where dx/dy is the content shift since the previous kept frame of that group;
+    leftovers are (frame, frame_index, timestamp) of kept frames that have no partner to
+    stitch with, such as a run of one frame after a cut.
+    """
+    groups, leftovers, current = [], [], []
+    shift_x = shift_y = 0.0
+    last_kept = None
+
+    for frame, frame_index, ts in zip(frames, frame_indices, timestamps):
+        if last_kept is None:
+            current = [(frame, frame_index, ts, 0.0, 0.0)]
+            last_kept, shift_x, shift_y = frame, 0.0, 0.0
+            continue
+
+        motion = estimate_translation(last_kept, frame)
+        if motion is None:
+            # Lost overlap with the last kept frame: close this run, start a new one
+            if len(current) > 1:
+                groups.append(current)
+            else:
+                leftovers.append(current[0][:3])
+            current = [(frame, frame_index, ts, 0.0, 0.0)]
+            last_kept = frame
+            continue
+
+        shift_x, shift_y = motion
+        height, width = frame.shape[:2]
+        moved = max(abs(shift_x) / width, abs(shift_y) / height)
+        if moved >= PANORAMA_MIN_SHIFT:
+            current.append((frame, frame_index, ts, shift_x, shift_y))
+            last_kept = frame
+
+    if len(current) > 1:
+        groups.append(current)
+    elif current:
+        leftovers.append(current[0][:3])
+
+    # Keep stitcher input bounded on very long pans
+    bounded = []
+    for group in groups:
+        for start in range(0, len(group), PANORAMA_MAX_FRAMES):
+            chunk = group[start:start + PANORAMA_MAX_FRAMES]
+            if len(chunk) > 1:
+                bounded.append(chunk)
+            else:
+                leftovers.append(chunk[0][:3])
+    return bounded, leftovers
+
+
+def _frame_spans(group, panorama_shape) -> Tuple[str, List[Tuple[int, int]]]:
+    """Place each frame along the dominant pan axis, scaled to panorama pixels"""
+    frame_h, frame_w = group[0][0].shape[:2]
+    total_x = sum(abs(item[3]) for item in group)
+    total_y = sum(abs(item[4]) for item in group)
+    axis = "x" if total_x >= total_y else "y"
+    frame_len = frame_w if axis == "x" else frame_h
+    pano_len = panorama_shape[1] if axis == "x" else panorama_shape[0]
+
+    # Content moving left means the camera moved right, so the frame sits further along
+    positions, position = [], 0.0
+    for item in group:
+        position -= item[3] if axis == "x" else item[4]
+        positions.append(position)
+
+    lo = min(positions)
+    extent = max(positions) + frame_len - lo
+    scale = pano_len / extent if extent > 0 else 1.0
+    spans = [(int((p - lo) * scale), int((p - lo + frame_len) * scale)) for p in positions]
+    return axis, spans
+
+
+def stitch_panoramas(frames: List[np.ndarray], frame_indices: List[int],
+                     timestamps: List[int]) -> Tuple[List[Panorama], List[Tuple[np.ndarray, int, int]]]:
+    """Stitch sampled frames into panoramas with OpenCV's SCANS stitcher (planar shelf,
+    affine model, CPU only).
+
+    Returns (panoramas, leftovers): leftovers are (frame, frame_index, timestamp) of frames
+    that are in no panorama, because they had nothing to stitch with or their run failed
+    to stitch, and must be analyzed on their own. No panoramas means the caller should
+    fall back to per-frame analysis.
+    """
+    frames = [downscale(frame, PANORAMA_FRAME_MAX_SIDE) for frame in frames]
+    panoramas = []
+    groups, leftovers = _select_stitch_frames(frames, frame_indices, timestamps)
+
+    for group in groups:
+        stitcher = cv2.Stitcher_create(cv2.Stitcher_SCANS)
+        status, image = stitcher.stitch([item[0] for item in group])
+        if status != cv2.Stitcher_OK:
+            print(f"[⚠️ Panorama] Stitching {len(group)} frames failed with status {status}, "
+                  f"analyzing them per frame")
+            leftovers.extend(item[:3] for item in group)
+            continue
+
+        axis, spans = _frame_spans(group, image.shape)
+        panoramas.append(Panorama(
+            image=image,
+            axis=axis,
+            frame_indices=[item[1] for item in group],
+            timestamps=[item[2] for item in group],
+            spans=spans,
+        ))
+        print(f"[🧵 Panorama] Stitched {len(group)} frames into {image.shape[1]}x{image.shape[0]} px")
+
+    leftovers.sort(key=lambda item: item[1])
+    return panoramas, leftovers
@@ -0,0 +1,137 @@
+"""
+Price Tag Regions
+Proposes shelf-edge label regions with classical OpenCV (colour masks, contours
+and rectangle checks) so price queries can send small high-resolution crops
+instead of the whole frame
+"""
+
+import os
+from dataclasses import dataclass
+from typing import List
+import cv2
+import numpy as np
+
+PRICE_TAG_MAX_CROPS = int(os.getenv("PRICE_TAG_MAX_CROPS", "8"))
+# Crops are sent at high detail; keeping them within one 512 px detail tile bounds the cost
+PRICE_TAG_CROP_MAX_SIDE = int(os.getenv("PRICE_TAG_CROP_MAX_SIDE", "512"))
+
+_DETECT_MAX_SIDE = 1280
+_MIN_AREA_SHARE = 0.0005
+_MAX_AREA_SHARE = 0.05
+_MIN_ASPECT = 1.1  # Labels are wider than tall
+_MAX_ASPECT = 6.0
+_PADDING = 0.15
+
+
+@dataclass
+class LabelRegion:
+    """Candidate price label, in full-frame pixels"""
+    x0: int
+    y0: int
+    x1: int
+    y1: int
+    score: float
+
+
+def _label_mask(small: np.ndarray) -> np.ndarray:
+    """Pixels that look like label stock: white/light grey paper or the saturated
+    yellow, orange and red used for promo tags"""
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    paper = cv2.inRange(hsv, (0, 0, 170), (180, 50, 255))
+    promo_yellow = cv2.inRange(hsv, (15, 90, 140), (40, 255, 255))
+    promo_red_low = cv2.inRange(hsv, (0, 120, 120), (8, 255, 255))
+    promo_red_high = cv2.inRange(hsv, (170, 120, 120), (180, 255, 255))
+    mask = paper | promo_yellow | promo_red_low | promo_red_high
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 3))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+    return cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+
+
+def _edge_mask(gray: np.ndarray) -> np.ndarray:
+    """Closed rectangular outlines, for labels printed in any colour"""
+    edges = cv2.Canny(cv2.GaussianBlur(gray, (5, 5), 0), 50, 150)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+    return cv2.dilate(edges, kernel, iterations=1)
+
+
+def _text_density(gray: np.ndarray, x: int, y: int, w: int, h: int) -> float:
+    """Share of strong horizontal gradients inside the box: printed digits score high,
+    blank shelf edges and packaging panels score low"""
+    patch = gray[y:y + h, x:x + w]
+    if patch.size == 0:
+        return 0.0
+    grad = np.abs(cv2.Sobel(patch, cv2.CV_32F, 1, 0, ksize=3))
+    return float((grad > 80).mean())
+
+
+def _iou(a: LabelRegion, b: LabelRegion) -> float:
+    ix = max(0, min(a.x1, b.x1) - max(a.x0, b.x0))
+    iy = max(0, min(a.y1, b.y1) - max(a.y0, b.y0))
+    inter = ix * iy
+    union = (a.x1 - a.x0) * (a.y1 - a.y0) + (b.x1 - b.x0) * (b.y1 - b.y0) - inter
+    return inter / union if union else 0.0
+
+
+def propose_label_regions(frame: np.ndarray, max_regions: int = PRICE_TAG_MAX_CROPS) -> List[LabelRegion]:
+    """Best-scoring label-shaped regions, strongest first, with overlapping boxes merged"""
+    height, width = frame.shape[:2]
+    scale = min(_DETECT_MAX_SIDE / max(height, width), 1.0)
+    small = frame if scale == 1.0 else cv2.resize(frame, (int(width * scale), int(height * scale)),
+                                                  interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    small_area = small.shape[0] * small.shape[1]
+
+    candidates = []
+    for mask in (_label_mask(small), _edge_mask(gray)):
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            area_share = w * h / small_area
+            if not (_MIN_AREA_SHARE <= area_share <= _MAX_AREA_SHARE):
+                continue
+            if not (_MIN_ASPECT <= w / max(h, 1) <= _MAX_ASPECT):
+                continue
+            rectangularity = cv2.contourArea(contour) / (w * h)
+            if rectangularity < 0.5:
+                continue
+            density = _text_density(gray, x, y, w, h)
+            if density < 0.02:
+                continue
+            candidates.append(LabelRegion(
+                x0=int(x / scale), y0=int(y / scale),
+                x1=int((x + w) / scale), y1=int((y + h) / scale),
+                score=rectangularity * density,
+            ))
+
+    # Greedy non-maximum suppression across both cues
+    candidates.sort(key=lambda region: region.score, reverse=True)
+    kept: List[LabelRegion] = []
+    for region in candidates:
+        if all(_iou(region, other) < 0.3 for other in kept):
+            kept.append(region)
+        if len(kept) >= max_regions:
+            break
+    return kept
+
+
+def crop_region(frame: np.ndarray, region: LabelRegion, max_side: int = PRICE_TAG_CROP_MAX_SIDE) -> np.ndarray:
+    """Padded full-resolution crop of the region, downscaled only if above max_side"""
+    height, width = frame.shape[:2]
+    pad_x = int((region.x1 - region.x0) * _PADDING)
+    pad_y = int((region.y1 - region.y0) * _PADDING)
+    crop = frame[max(region.y0 - pad_y, 0):min(region.y1 + pad_y, height),
+                 max(region.x0 - pad_x, 0):min(region.x1 + pad_x, width)]
+    crop_h, crop_w = crop.shape[:2]
+    scale = max_side / max(crop_h, crop_w)
+    if scale >= 1:
+        return crop
+    return cv2.resize(crop, (int(crop_w * scale), int(crop_h * scale)), interpolation=cv2.INTER_AREA)
+
+
+def describe_region(region: LabelRegion, width: int, height: int) -> str:
+    """Where a crop sits in the frame, for the prompt"""
+    x_center = (region.x0 + region.x1) / 2 / width
+    y_center = (region.y0 + region.y1) / 2 / height
+    horizontal = "left" if x_center < 1 / 3 else "center" if x_center < 2 / 3 else "right"
+    vertical = "top" if y_center < 1 / 3 else "middle" if y_center < 2 / 3 else "bottom"
+    return f"x {region.x0}-{region.x1} px, y {region.y0}-{region.y1} px ({vertical}-{horizontal} of the frame)"
@@ -0,0 +1,198 @@
+"""
+Retry Policy
+Jittered exponential backoff with 429 awareness, and latency-based request
+hedging for frame analysis calls
+"""
+
+import os
+import random
+import asyncio
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+import openai
+
+FRAME_MAX_ATTEMPTS = int(os.getenv("FRAME_MAX_ATTEMPTS", "3"))
+FRAME_HEDGING = os.getenv("FRAME_HEDGING", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+
+
+def is_retryable(exc: Exception) -> bool:
+    """Timeouts, connection problems, throttling and server errors are worth another try"""
+    if isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError, asyncio.TimeoutError)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code in (408, 409, 429) or exc.status_code >= 500
+    message = str(exc).lower()
+    return any(err in message for err in ["timeout", "timed out", "connection", "network"])
+
+
+def retry_after_seconds(exc: Exception) -> Optional[float]:
+    """Server-suggested wait from a 429/503 response, if any"""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        # retry-after can also be an HTTP date, fall back to our own backoff
+        return None
+    return None
+
+
+@dataclass
+class RetryPolicy:
+    """Exponential backoff with full jitter, honouring Retry-After on throttling"""
+    max_attempts: int = FRAME_MAX_ATTEMPTS
+    base_delay: float = 1.0
+    max_delay: float = 20.0
+
+    def delay(self, attempt: int, exc: Exception) -> float:
+        suggested = retry_after_seconds(exc)
+        if suggested is not None:
+            # Small jitter so throttled frames don't all come back in the same instant
+            return min(suggested, self.max_delay * 3) + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class LatencyTracker:
+    """Rolling window of successful request latencies"""
+
+    def __init__(self, maxlen: int = 200, min_samples: int = 20):
+        self.samples = deque(maxlen=maxlen)
+        self.min_samples = min_samples
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """None until enough samples have been seen to trust the estimate"""
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+# One tracker per kind of call: a prescreen, a label crop and a full frame have
+# very different latencies, so they must not share a percentile
+_latency_trackers: Dict[str, LatencyTracker] = {}
+
+
+def latency_tracker(kind: str) -> LatencyTracker:
+    if kind not in _latency_trackers:
+        _latency_trackers[kind] = LatencyTracker()
+    return _latency_trackers[kind]
+
+
+class _Dispatch:
+    """When a started call actually left the rate-limit bucket"""
+
+    def __init__(self):
+        self.event = asyncio.Event()
+        self.at: Optional[float] = None
+
+
+_dispatch: ContextVar[Optional[_Dispatch]] = ContextVar("_dispatch", default=None)
+
+
+def mark_dispatched():
+    """Called by the request layer once quota is reserved and the request is sent"""
+    dispatch = _dispatch.get()
+    if dispatch is not None and not dispatch.event.is_set():
+        dispatch.at = asyncio.get_event_loop().time()
+        dispatch.event.set()
+
+
+def _start(make_call: Callable[[], Awaitable]) -> Tuple[asyncio.Task, _Dispatch]:
+    # The task copies the context at creation, so mark_dispatched inside it finds this call's record
+    dispatch = _Dispatch()
+    token = _dispatch.set(dispatch)
+    try:
+        task = asyncio.ensure_future(make_call())
+    finally:
+        _dispatch.reset(token)
+    return task, dispatch
+
+
+async def _hedged(make_call: Callable[[], Awaitable], tracker: LatencyTracker, label: str):
+    """Send a duplicate request once the first one is slower than the tracked percentile;
+    whichever succeeds first wins. Returns (result, dispatch of the winning call)."""
+    hedge_delay = tracker.percentile(HEDGE_PERCENTILE)
+    primary, dispatch = _start(make_call)
+    if hedge_delay is None:
+        return await primary, dispatch
+
+    tasks = {primary: dispatch}
+    try:
+        # The timer only starts once the request is sent: time queued on the rate-limit
+        # bucket is not slowness a duplicate could beat, the duplicate would queue too
+        sent = asyncio.ensure_future(dispatch.event.wait())
+        await asyncio.wait({primary, sent}, return_when=asyncio.FIRST_COMPLETED)
+        sent.cancel()
+        if not primary.done():
+            await asyncio.wait({primary}, timeout=hedge_delay)
+        if primary.done():
+            return primary.result(), dispatch
+
+        print(f"[🪞 Hedging {label}] No answer after {hedge_delay:.2f}s, sending a duplicate request")
+        hedge, hedge_dispatch = _start(make_call)
+        tasks[hedge] = hedge_dispatch
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result(), tasks[task]
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def call_with_retry(make_call: Callable[[], Awaitable], policy: Optional[RetryPolicy] = None,
+                          hedge: Optional[bool] = None, kind: str = "frame",
+                          label: str = "request") -> Tuple[str, object, int]:
+    """Run make_call with retries (and optional hedging).
+
+    kind selects the latency tracker the hedge delay comes from. Requests that
+    never call mark_dispatched are timed from the start and not hedged.
+
+    Returns (status, result_or_exception, attempts) where status is "ok" on a
+    first-try success, "retried" when a later attempt succeeded and "failed"
+    when every attempt failed or the error was not retryable.
+    """
+    policy = policy or RetryPolicy()
+    if hedge is None:
+        hedge = FRAME_HEDGING
+    tracker = latency_tracker(kind)
+    loop = asyncio.get_event_loop()
+
+    for attempt in range(policy.max_attempts):
+        started = loop.time()
+        try:
+            if hedge:
+                result, dispatch = await _hedged(make_call, tracker, label)
+            else:
+                task, dispatch = _start(make_call)
+                result = await task
+        except Exception as e:
+            if attempt + 1 >= policy.max_attempts or not is_retryable(e):
+                print(f"[❌ {label} failed after {attempt + 1} attempt(s)]: {type(e).__name__}: {e}")
+                return "failed", e, attempt + 1
+            delay = policy.delay(attempt, e)
+            print(f"[🔁 {label}] {type(e).__name__}, retrying in {delay:.2f}s "
+                  f"(attempt {attempt + 2}/{policy.max_attempts})")
+            await asyncio.sleep(delay)
+            continue
+
+        # Latency of the request itself, without the wait for quota
+        tracker.record(loop.time() - (dispatch.at if dispatch.at is not None else started))
+        return ("ok" if attempt == 0 else "retried"), result, attempt + 1
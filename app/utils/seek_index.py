@@ -0,0 +1,141 @@
+"""
+Seek Index
+Keyframe positions of a video, built once per file from a demux-only pass and kept
+as an artifact of its content hash, plus a seeker that jumps to the keyframe before
+a target frame and grabs forward to it
+"""
+
+import bisect
+import shutil
+import subprocess
+from typing import List, Optional
+import cv2
+import numpy as np
+from app.utils.artifacts import file_content_hash, load_json_artifact, save_json_artifact
+
+SEEK_INDEX_ARTIFACT = "seek_index.json"
+
+
+def _keyframes_ffprobe(video_path: str) -> Optional[List[int]]:
+    """Keyframe indices in display order from packet flags; no frame is decoded"""
+    if not shutil.which("ffprobe"):
+        return None
+    command = ["ffprobe", "-v", "error", "-select_streams", "v:0",
+               "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", video_path]
+    try:
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"[⚠️ Seek index] ffprobe failed: {e}")
+        return None
+
+    packets = []
+    for decode_order, line in enumerate(output.splitlines()):
+        pts, _, flags = line.partition(",")
+        try:
+            pts = float(pts)
+        except ValueError:
+            continue  # Packets without a timestamp are not displayed
+        packets.append((pts, decode_order, "K" in flags))
+    # Packets arrive in decode order; sorting by pts gives each frame its display index
+    packets.sort()
+    return [index for index, (_, _, key) in enumerate(packets) if key]
+
+
+def _keyframes_opencv(video_path: str) -> Optional[List[int]]:
+    """Fallback for OpenCV builds that can return raw packets (FFmpeg backend, 4.7+)"""
+    if not hasattr(cv2, "CAP_PROP_LRF_HAS_KEY_FRAME"):
+        return None
+    cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    if not cap.isOpened():
+        return None
+    keyframes, index = [], 0
+    # With CAP_PROP_FORMAT=-1 grab() only demuxes, so this pass is cheap
+    while cap.grab():
+        if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+            keyframes.append(index)
+        index += 1
+    cap.release()
+    return keyframes
+
+
+def build_seek_index(video_path: str) -> dict:
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    source = "ffprobe"
+    keyframes = _keyframes_ffprobe(video_path)
+    if not keyframes:
+        source, keyframes = "opencv", _keyframes_opencv(video_path)
+    if not keyframes:
+        source, keyframes = "none", []
+    print(f"[🧭 Seek index] {len(keyframes)} keyframes in {frame_count} frames ({source})")
+    return {
+        "fps": fps,
+        "frame_count": frame_count,
+        "source": source,
+        "keyframes": keyframes,
+        "keyframe_ms": [round(k / fps * 1000) if fps > 0 else 0 for k in keyframes],
+    }
+
+
+def load_seek_index(video_path: str) -> dict:
+    """The video's seek index, built on first use"""
+    content_hash = file_content_hash(video_path)
+    index = load_json_artifact(content_hash, SEEK_INDEX_ARTIFACT)
+    if index is None:
+        index = build_seek_index(video_path)
+        save_json_artifact(content_hash, SEEK_INDEX_ARTIFACT, index)
+    return index
+
+
+def keyframe_before(index: dict, frame_index: int) -> int:
+    """Last keyframe at or before `frame_index`; the frame itself when no keyframes are known"""
+    keyframes = index["keyframes"]
+    if not keyframes:
+        return frame_index  # Unknown GOP layout: seek straight to the frame
+    position = bisect.bisect_right(keyframes, frame_index)
+    return keyframes[position - 1] if position else 0
+
+
+class FrameSeeker:
+    """Frame-accurate random access on one capture.
+
+    Every seek lands on a keyframe, which decoders handle exactly, and the
+    remaining distance is covered with grab(). Reads that move forward within
+    the current GOP just keep grabbing.
+    """
+
+    def __init__(self, video_path: str, index: Optional[dict] = None):
+        self.index = index if index is not None else load_seek_index(video_path)
+        self.cap = cv2.VideoCapture(video_path)
+        self.position = 0  # Index of the frame the next grab() returns
+
+    def _move_to(self, frame_index: int) -> bool:
+        keyframe = keyframe_before(self.index, frame_index)
+        # Seeking only pays off when it skips frames we would otherwise grab
+        if not (keyframe <= self.position <= frame_index):
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+            self.position = keyframe
+        while self.position < frame_index:
+            if not self.cap.grab():
+                return False
+            self.position += 1
+        return True
+
+    def read(self, frame_index: int) -> Optional[np.ndarray]:
+        if not self._move_to(frame_index):
+            return None
+        ret, frame = self.cap.read()
+        if not ret:
+            return None
+        self.position += 1
+        return frame
+
+    def read_at_ms(self, timestamp_ms: float) -> Optional[np.ndarray]:
+        fps = self.index["fps"]
+        return self.read(round(timestamp_ms * fps / 1000) if fps > 0 else 0)
+
+    def close(self):
+        self.cap.release()
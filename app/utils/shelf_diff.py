@@ -0,0 +1,146 @@
+"""
+Shelf Diff
+Aligns a new capture of a bay to the previous one by homography and finds the
+regions that changed, so a re-audit only re-analyzes those
+"""
+
+import os
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+import cv2
+import numpy as np
+from app.utils.shelf_share import ShelfRegion
+
+# Pixel difference (0-255, after blur) above which a pixel counts as changed
+DIFF_THRESHOLD = int(os.getenv("DIFF_THRESHOLD", "40"))
+# Changed boxes smaller than this share of the image are ignored as noise
+DIFF_MIN_AREA = float(os.getenv("DIFF_MIN_AREA", "0.002"))
+# Above this changed share a full re-analysis is cheaper than many crops
+DIFF_MAX_CHANGED_SHARE = float(os.getenv("DIFF_MAX_CHANGED_SHARE", "0.6"))
+
+_ALIGN_MAX_SIDE = 1600
+_MIN_INLIERS = 30
+_BOX_PADDING = 0.1
+
+
+@dataclass
+class ChangedRegion:
+    """Changed box in new-capture pixels"""
+    x0: int
+    y0: int
+    x1: int
+    y1: int
+
+
+def _resize_max_side(image: np.ndarray, max_side: int) -> Tuple[np.ndarray, float]:
+    height, width = image.shape[:2]
+    scale = min(max_side / max(height, width), 1.0)
+    if scale == 1.0:
+        return image, 1.0
+    return cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA), scale
+
+
+def align_previous(previous: np.ndarray, current: np.ndarray) -> Optional[np.ndarray]:
+    """Homography mapping previous-capture pixels onto current-capture pixels, or None
+    when the two photos don't show the same bay closely enough"""
+    prev_small, prev_scale = _resize_max_side(cv2.cvtColor(previous, cv2.COLOR_BGR2GRAY), _ALIGN_MAX_SIDE)
+    cur_small, cur_scale = _resize_max_side(cv2.cvtColor(current, cv2.COLOR_BGR2GRAY), _ALIGN_MAX_SIDE)
+
+    orb = cv2.ORB_create(nfeatures=4000)
+    kp1, des1 = orb.detectAndCompute(prev_small, None)
+    kp2, des2 = orb.detectAndCompute(cur_small, None)
+    if des1 is None or des2 is None:
+        return None
+
+    good = []
+    for pair in cv2.BFMatcher(cv2.NORM_HAMMING).knnMatch(des1, des2, k=2):
+        if len(pair) == 2 and pair[0].distance < 0.75 * pair[1].distance:
+            good.append(pair[0])
+    if len(good) < _MIN_INLIERS:
+        return None
+
+    src = np.float32([kp1[m.queryIdx].pt for m in good]).reshape(-1, 1, 2) / prev_scale
+    dst = np.float32([kp2[m.trainIdx].pt for m in good]).reshape(-1, 1, 2) / cur_scale
+    homography, mask = cv2.findHomography(src, dst, cv2.RANSAC, 5.0)
+    if homography is None or int(mask.sum()) < _MIN_INLIERS:
+        return None
+    return homography
+
+
+def changed_regions(previous: np.ndarray, current: np.ndarray, homography: np.ndarray) -> Tuple[List[ChangedRegion], float]:
+    """Boxes where the aligned captures differ, and the share of the whole current capture
+    that changed. Areas the previous capture never saw count as changed, so the share is
+    over the full image, not just the overlap."""
+    height, width = current.shape[:2]
+    warped = cv2.warpPerspective(previous, homography, (width, height))
+    valid = cv2.warpPerspective(np.full(previous.shape[:2], 255, np.uint8), homography, (width, height))
+    valid = cv2.erode(valid, np.ones((15, 15), np.uint8))
+
+    # Blur first so residual misalignment and sensor noise don't read as change
+    prev_gray = cv2.GaussianBlur(cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY), (9, 9), 0)
+    cur_gray = cv2.GaussianBlur(cv2.cvtColor(current, cv2.COLOR_BGR2GRAY), (9, 9), 0)
+    diff = cv2.absdiff(prev_gray, cur_gray)
+    _, mask = cv2.threshold(diff, DIFF_THRESHOLD, 255, cv2.THRESH_BINARY)
+    mask = cv2.bitwise_and(mask, valid)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((5, 5), np.uint8))
+    mask = cv2.dilate(mask, np.ones((25, 25), np.uint8))
+
+    # Areas the previous capture never saw are new by definition
+    unseen = cv2.bitwise_not(cv2.dilate(valid, np.ones((15, 15), np.uint8)))
+    mask = cv2.bitwise_or(mask, unseen)
+
+    regions = []
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if w * h < DIFF_MIN_AREA * width * height:
+            continue
+        pad_x, pad_y = int(w * _BOX_PADDING), int(h * _BOX_PADDING)
+        regions.append(ChangedRegion(max(x - pad_x, 0), max(y - pad_y, 0),
+                                     min(x + w + pad_x, width), min(y + h + pad_y, height)))
+
+    changed_share = float((mask > 0).mean())
+    return regions, changed_share
+
+
+def transform_regions(regions: List[ShelfRegion], homography: np.ndarray, previous_size: Tuple[int, int],
+                      current_size: Tuple[int, int]) -> List[ShelfRegion]:
+    """Map normalized regions of the previous capture into the current capture"""
+    prev_w, prev_h = previous_size
+    cur_w, cur_h = current_size
+    moved = []
+    for r in regions:
+        corners = np.float32([[r.x0 * prev_w, r.y0 * prev_h], [r.x1 * prev_w, r.y0 * prev_h],
+                              [r.x1 * prev_w, r.y1 * prev_h], [r.x0 * prev_w, r.y1 * prev_h]]).reshape(-1, 1, 2)
+        projected = cv2.perspectiveTransform(corners, homography).reshape(-1, 2)
+        x0, y0 = np.clip(projected.min(axis=0) / (cur_w, cur_h), 0, 1)
+        x1, y1 = np.clip(projected.max(axis=0) / (cur_w, cur_h), 0, 1)
+        if x1 > x0 and y1 > y0:
+            moved.append(ShelfRegion(r.product, float(x0), float(y0), float(x1), float(y1)))
+    return moved
+
+
+def crop_regions_to_image(regions: List[ShelfRegion], box: ChangedRegion, width: int,
+                          height: int) -> List[ShelfRegion]:
+    """Map regions found in a crop (normalized to the crop) back to the whole image"""
+    crop_w, crop_h = box.x1 - box.x0, box.y1 - box.y0
+    return [ShelfRegion(
+        r.product,
+        (box.x0 + r.x0 * crop_w) / width, (box.y0 + r.y0 * crop_h) / height,
+        (box.x0 + r.x1 * crop_w) / width, (box.y0 + r.y1 * crop_h) / height,
+    ) for r in regions]
+
+
+def merge_inventory(prior: List[ShelfRegion], changed: List[ChangedRegion], fresh: List[ShelfRegion],
+                    width: int, height: int) -> List[ShelfRegion]:
+    """Prior regions whose centre is outside every changed box, plus the fresh ones"""
+    kept = []
+    for r in prior:
+        cx, cy = (r.x0 + r.x1) / 2 * width, (r.y0 + r.y1) / 2 * height
+        if not any(box.x0 <= cx < box.x1 and box.y0 <= cy < box.y1 for box in changed):
+            kept.append(r)
+    return kept + fresh
+
+
+def regions_to_json(regions: List[ShelfRegion]) -> List[dict]:
+    return [{"product": r.product, "box": [round(v * 1000) for v in (r.x0, r.y0, r.x1, r.y1)]} for r in regions]
@@ -0,0 +1,244 @@
+"""
+Shelf Share
+Computes share-of-shelf from per-product bounding regions with vectorized NumPy
+area and overlap math, de-duplicating regions seen in several frames by position
+"""
+
+import os
+import re
+import json
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from app.utils.panorama import estimate_translation
+
+# Same product boxes overlapping at least this much (in shelf coordinates) are one facing block
+SHELF_SHARE_DEDUP_IOU = float(os.getenv("SHELF_SHARE_DEDUP_IOU", "0.4"))
+# Raster resolution per frame width for the union-area computation
+SHELF_SHARE_GRID = int(os.getenv("SHELF_SHARE_GRID", "200"))
+
+# Frames with no measurable overlap are placed this many frame widths apart, so
+# their regions never merge
+_SEGMENT_GAP = 10.0
+
+# Words that say nothing about which product is meant
+_GENERIC_WORDS = {
+    "a", "an", "the", "of", "and", "or", "for", "with", "in", "on", "by", "is", "are", "what", "how", "much",
+    "share", "shelf", "space", "product", "products", "brand", "pack", "bottle", "bottles", "can", "cans",
+    "box", "bag", "ml", "l", "cl", "g", "kg", "oz", "lb", "x", "pcs",
+}
+
+
+@dataclass
+class ShelfRegion:
+    """A block of one product's facings, in frame-width units (x) and frame-height units (y)"""
+    product: str
+    x0: float
+    y0: float
+    x1: float
+    y1: float
+    frame_index: int = 0
+
+
+def parse_regions(text: str, frame_index: int = 0) -> List[ShelfRegion]:
+    """Regions from the model's JSON answer; boxes are [x0, y0, x1, y1] on a 0-1000 scale"""
+    match = re.search(r"\{.*\}", text or "", re.DOTALL)
+    if not match:
+        return []
+    try:
+        data = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return []
+    return regions_from_data(data, frame_index)
+
+
+def regions_from_data(data: dict, frame_index: int = 0) -> List[ShelfRegion]:
+    """Regions from an already parsed {"regions": [...]} object"""
+    regions = []
+    for item in data.get("regions", []):
+        box = item.get("box") or []
+        product = str(item.get("product", "")).strip()
+        if not product or len(box) != 4:
+            continue
+        try:
+            x0, y0, x1, y1 = (min(max(float(v) / 1000, 0.0), 1.0) for v in box)
+        except (TypeError, ValueError):
+            continue
+        if x1 > x0 and y1 > y0:
+            regions.append(ShelfRegion(product, x0, y0, x1, y1, frame_index))
+    return regions
+
+
+def frame_offsets(frames: Dict[int, np.ndarray]) -> Dict[int, Tuple[float, float]]:
+    """Camera position of each frame relative to the first one, in frame widths/heights,
+    chained from ORB translation estimates between consecutive analyzed frames"""
+    offsets = {}
+    position_x = position_y = 0.0
+    previous = None
+    for frame_index in sorted(frames):
+        frame = frames[frame_index]
+        if previous is not None:
+            motion = estimate_translation(previous, frame)
+            if motion is None:
+                position_x += _SEGMENT_GAP
+            else:
+                height, width = frame.shape[:2]
+                # Content moving left means the camera moved right
+                position_x -= motion[0] / width
+                position_y -= motion[1] / height
+        offsets[frame_index] = (position_x, position_y)
+        previous = frame
+    return offsets
+
+
+def _boxes(regions: List[ShelfRegion]) -> np.ndarray:
+    return np.array([[r.x0, r.y0, r.x1, r.y1] for r in regions], dtype=np.float64).reshape(-1, 4)
+
+
+def pairwise_iou(boxes: np.ndarray) -> np.ndarray:
+    """N x N IoU matrix"""
+    x0 = np.maximum(boxes[:, None, 0], boxes[None, :, 0])
+    y0 = np.maximum(boxes[:, None, 1], boxes[None, :, 1])
+    x1 = np.minimum(boxes[:, None, 2], boxes[None, :, 2])
+    y1 = np.minimum(boxes[:, None, 3], boxes[None, :, 3])
+    inter = np.clip(x1 - x0, 0, None) * np.clip(y1 - y0, 0, None)
+    area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    union = area[:, None] + area[None, :] - inter
+    return np.where(union > 0, inter / np.where(union > 0, union, 1), 0.0)
+
+
+def to_shelf_coordinates(regions: List[ShelfRegion], offsets: Dict[int, Tuple[float, float]]) -> List[ShelfRegion]:
+    shifted = []
+    for r in regions:
+        dx, dy = offsets.get(r.frame_index, (0.0, 0.0))
+        shifted.append(ShelfRegion(r.product, r.x0 + dx, r.y0 + dy, r.x1 + dx, r.y1 + dy, r.frame_index))
+    return shifted
+
+
+def _product_key(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", " ", name.lower()).strip()
+
+
+def dedupe_regions(regions: List[ShelfRegion], iou_threshold: float = SHELF_SHARE_DEDUP_IOU) -> List[ShelfRegion]:
+    """Keep one region per product and position; the same block seen from overlapping
+    frames collapses to the largest observation"""
+    if not regions:
+        return []
+    boxes = _boxes(regions)
+    keys = np.array([_product_key(r.product) for r in regions])
+    overlap = (pairwise_iou(boxes) >= iou_threshold) & (keys[:, None] == keys[None, :])
+
+    area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    kept, suppressed = [], np.zeros(len(regions), dtype=bool)
+    for i in np.argsort(-area):
+        if suppressed[i]:
+            continue
+        kept.append(regions[i])
+        suppressed |= overlap[i]
+    return kept
+
+
+def _x_clusters(boxes: np.ndarray) -> List[np.ndarray]:
+    """Indices of boxes grouped into runs whose x-ranges overlap, so each run can be
+    rasterized on its own instead of one grid spanning every gap"""
+    order = np.argsort(boxes[:, 0])
+    clusters, current, reach = [], [], -np.inf
+    for i in order:
+        if current and boxes[i, 0] >= reach:
+            clusters.append(np.array(current))
+            current, reach = [], -np.inf
+        current.append(i)
+        reach = max(reach, boxes[i, 2])
+    clusters.append(np.array(current))
+    return clusters
+
+
+def _cluster_areas(boxes: np.ndarray, index: np.ndarray, product_count: int,
+                   grid: int) -> Tuple[np.ndarray, int]:
+    """Per-product covered cells and total occupied cells for one cluster of boxes"""
+    lo_x, lo_y = boxes[:, 0].min(), boxes[:, 1].min()
+    cols = max(int((boxes[:, 2].max() - lo_x) * grid), 1)
+    rows = max(int((boxes[:, 3].max() - lo_y) * grid), 1)
+    xs = lo_x + (np.arange(cols) + 0.5) / grid
+    ys = lo_y + (np.arange(rows) + 0.5) / grid
+
+    # Cell ranges whose centres fall inside each box; memory grows with the products
+    # in the cluster, not with the number of boxes
+    col0, col1 = np.searchsorted(xs, boxes[:, 0]), np.searchsorted(xs, boxes[:, 2])
+    row0, row1 = np.searchsorted(ys, boxes[:, 1]), np.searchsorted(ys, boxes[:, 3])
+    present, local = np.unique(index, return_inverse=True)
+    per_product = np.zeros((len(present), rows, cols), dtype=bool)
+    for k, c0, c1, r0, r1 in zip(local, col0, col1, row0, row1):
+        per_product[k, r0:r1, c0:c1] = True
+
+    claims = per_product.sum(axis=0, dtype=np.int32)
+    weights = np.where(claims > 0, 1.0 / np.maximum(claims, 1), 0.0)
+    areas = np.zeros(product_count)
+    areas[present] = (per_product * weights[None]).sum(axis=(1, 2))
+    return areas, int((claims > 0).sum())
+
+
+def compute_shelf_share(regions: List[ShelfRegion], grid: int = SHELF_SHARE_GRID) -> Dict[str, float]:
+    """Percentage of the occupied shelf area covered by each product.
+
+    Boxes are rasterized onto a shared grid so overlaps between blocks of the same
+    product count once, and cells claimed by several products are split evenly.
+    """
+    if not regions:
+        return {}
+    boxes = _boxes(regions)
+    names = sorted({_product_key(r.product) for r in regions})
+    display = {_product_key(r.product): r.product for r in regions}
+    index = np.array([names.index(_product_key(r.product)) for r in regions])
+
+    areas = np.zeros(len(names))
+    occupied = 0
+    for cluster in _x_clusters(boxes):
+        cluster_areas, cluster_occupied = _cluster_areas(boxes[cluster], index[cluster], len(names), grid)
+        areas += cluster_areas
+        occupied += cluster_occupied
+    if not occupied:
+        return {}
+
+    shares = 100 * areas / occupied
+    return {display[name]: round(float(share), 1) for name, share in sorted(zip(names, shares), key=lambda p: -p[1])}
+
+
+def _significant_words(text: str) -> List[str]:
+    return [w for w in re.findall(r"[a-z0-9]+", text.lower()) if w not in _GENERIC_WORDS and not w.isdigit()]
+
+
+def match_product(shares: Dict[str, float], user_question: str) -> Optional[str]:
+    """Product from the share table that the question names, by word overlap. The product's
+    leading word (normally the brand) must be in the question; a shared variant or size
+    word alone ("original", "500 ml") is not enough."""
+    question_words = set(_significant_words(user_question))
+    best, best_overlap = None, 0
+    for product in shares:
+        words = _significant_words(product)
+        if not words or words[0] not in question_words:
+            continue
+        overlap = len(set(words) & question_words)
+        if overlap > best_overlap:
+            best, best_overlap = product, overlap
+    return best
+
+
+def describe_shelf_share(shares: Dict[str, float], user_question: str, region_count: int,
+                         frame_count: int) -> Tuple[str, str, str]:
+    """(direct_answer, reasoning, product_name) for a share-of-shelf result"""
+    if not shares:
+        return ("No products could be located on the shelf, so share of shelf could not be computed.",
+                f"No product regions were detected in {frame_count} analyzed frame(s).", "Unknown")
+
+    table = ", ".join(f"{product} {share:.1f}%" for product, share in shares.items())
+    product = match_product(shares, user_question)
+    if product:
+        direct_answer = f"{product} occupies about {shares[product]:.1f}% of the visible shelf space."
+    else:
+        direct_answer = f"Share of visible shelf space: {table}."
+    reasoning = (
+        f"Computed from {region_count} de-duplicated product regions detected across {frame_count} "
+        f"frame(s), as each product's share of the occupied shelf area. Full breakdown: {table}."
+    )
+    return direct_answer, reasoning, product or "Unknown"
@@ -0,0 +1,208 @@
+"""
+Stream Monitor
+Building blocks for watching a live camera: a reader that keeps only the newest
+frame of a stream, a trigger that fires when the settled shelf differs from the
+last analyzed view, and rolling windows of answers for standing queries
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, List, Optional, Tuple
+import cv2
+import numpy as np
+from app.utils.shelf_diff import ChangedRegion, changed_regions
+
+# Frames per second the monitor inspects; the stream itself is read at full rate
+STREAM_SAMPLE_FPS = float(os.getenv("STREAM_SAMPLE_FPS", "1"))
+# Share of the view that must differ from the last analyzed frame to trigger analysis
+STREAM_CHANGE_SHARE = float(os.getenv("STREAM_CHANGE_SHARE", "0.02"))
+# Share that may differ between consecutive samples for the view to count as still
+STREAM_MOTION_SHARE = float(os.getenv("STREAM_MOTION_SHARE", "0.01"))
+# How long the view must stay still (e.g. after a shopper leaves) before comparing
+STREAM_SETTLE_SECONDS = float(os.getenv("STREAM_SETTLE_SECONDS", "3"))
+# Standing queries run at least this often, even without a change
+STREAM_MAX_INTERVAL_SECONDS = float(os.getenv("STREAM_MAX_INTERVAL_SECONDS", "900"))
+# Answers older than this drop out of a query's rolling window
+STREAM_WINDOW_SECONDS = float(os.getenv("STREAM_WINDOW_SECONDS", "3600"))
+STREAM_WINDOW_MAX_ITEMS = int(os.getenv("STREAM_WINDOW_MAX_ITEMS", "50"))
+
+_COMPARE_MAX_SIDE = 640
+_IDENTITY = np.eye(3, dtype=np.float64)
+_RECONNECT_MAX_DELAY = 30.0
+
+
+def _small(frame: np.ndarray) -> np.ndarray:
+    height, width = frame.shape[:2]
+    scale = min(_COMPARE_MAX_SIDE / max(height, width), 1.0)
+    if scale == 1.0:
+        return frame
+    return cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+
+def is_file_source(url: str) -> bool:
+    return "://" not in url and os.path.exists(url)
+
+
+class StreamReader:
+    """Reads a stream in a background thread and keeps only the newest frame, so a
+    slow consumer never builds a backlog. Network streams are reopened with
+    backoff when they drop; with realtime=True a local file is paced to its fps
+    as a stand-in for a camera. A file read without realtime waits for each
+    frame to be taken instead, so none are skipped."""
+
+    def __init__(self, url: str, realtime: bool = False):
+        self.url = url
+        self.realtime = realtime
+        self.is_file = is_file_source(url)
+        self.ended = False
+        self.fps = 0.0
+        self._latest: Optional[Tuple[np.ndarray, int, int]] = None
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        delay = 1.0
+        frame_index = 0
+        while not self._stop.is_set():
+            cap = cv2.VideoCapture(self.url)
+            if not cap.isOpened():
+                if self.is_file:
+                    break
+                print(f"[⚠️ Stream] Could not open {self.url}, retrying in {delay:.0f}s")
+                self._stop.wait(delay)
+                delay = min(delay * 2, _RECONNECT_MAX_DELAY)
+                continue
+
+            delay = 1.0
+            fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+            self.fps = fps
+            started = time.monotonic()
+            first_index = frame_index
+            while not self._stop.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                timestamp_ms = int(cap.get(cv2.CAP_PROP_POS_MSEC)) if self.is_file \
+                    else int(time.time() * 1000)
+                with self._cond:
+                    if self.is_file and not self.realtime:
+                        self._cond.wait_for(lambda: self._latest is None or self._stop.is_set())
+                    self._latest = (frame, frame_index, timestamp_ms)
+                    self._cond.notify_all()
+                frame_index += 1
+                if self.realtime and self.is_file:
+                    # Hold each frame until its presentation time, like a live camera
+                    due = started + (frame_index - first_index) / fps
+                    self._stop.wait(max(0.0, due - time.monotonic()))
+            cap.release()
+            if self.is_file:
+                break
+            print(f"[⚠️ Stream] {self.url} dropped, reconnecting")
+
+        with self._cond:
+            self.ended = True
+            self._cond.notify_all()
+
+    def latest(self, timeout: Optional[float] = None) -> Optional[Tuple[np.ndarray, int, int]]:
+        """(frame, frame_index, timestamp_ms) of the newest frame not returned yet;
+        None once the stream has ended or on timeout"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._latest is not None or self.ended, timeout)
+            item, self._latest = self._latest, None
+            self._cond.notify_all()
+            return item
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        self._thread.join(timeout=5)
+
+
+class ChangeTrigger:
+    """Decides which sampled frames are worth analyzing.
+
+    A frame triggers when the view has been still for STREAM_SETTLE_SECONDS and
+    differs from the last analyzed frame by STREAM_CHANGE_SHARE, or when
+    STREAM_MAX_INTERVAL_SECONDS have passed since the last analysis. Motion in
+    front of the shelf therefore never triggers on its own.
+    """
+
+    def __init__(self, change_share: float = STREAM_CHANGE_SHARE, motion_share: float = STREAM_MOTION_SHARE,
+                 settle_seconds: float = STREAM_SETTLE_SECONDS, max_interval: float = STREAM_MAX_INTERVAL_SECONDS):
+        self.change_share = change_share
+        self.motion_share = motion_share
+        self.settle_seconds = settle_seconds
+        self.max_interval = max_interval
+        self.reference: Optional[np.ndarray] = None
+        self.reference_time = 0.0
+        self.previous: Optional[np.ndarray] = None
+        self.still_since: Optional[float] = None
+
+    def check(self, frame: np.ndarray, now: float) -> Optional[List[ChangedRegion]]:
+        """Changed regions (in frame pixels) when the frame should be analyzed, else None"""
+        small = _small(frame)
+        if self.previous is not None and self.previous.shape == small.shape:
+            _, motion = changed_regions(self.previous, small, _IDENTITY)
+            if motion > self.motion_share:
+                self.still_since = None
+            elif self.still_since is None:
+                self.still_since = now
+        self.previous = small
+
+        if self.reference is None:
+            return self._accept(small, now, [])
+        if now - self.reference_time >= self.max_interval:
+            return self._accept(small, now, [])
+        if self.still_since is None or now - self.still_since < self.settle_seconds:
+            return None
+
+        boxes, share = changed_regions(self.reference, small, _IDENTITY)
+        if share < self.change_share:
+            return None
+        scale = frame.shape[1] / small.shape[1]
+        boxes = [ChangedRegion(int(b.x0 * scale), int(b.y0 * scale), int(b.x1 * scale), int(b.y1 * scale))
+                 for b in boxes]
+        return self._accept(small, now, boxes)
+
+    def _accept(self, small: np.ndarray, now: float, boxes: List[ChangedRegion]) -> List[ChangedRegion]:
+        self.reference = small
+        self.reference_time = now
+        return boxes
+
+
+@dataclass
+class Observation:
+    timestamp_ms: int
+    present: bool
+    direct_answer: str
+
+
+@dataclass
+class RollingWindow:
+    """Recent answers of one standing query, bounded by age and count"""
+    query: str
+    window_seconds: float = STREAM_WINDOW_SECONDS
+    items: Deque[Observation] = field(default_factory=lambda: deque(maxlen=STREAM_WINDOW_MAX_ITEMS))
+    state: Optional[bool] = None  # Majority presence over the window, None before any answer
+
+    def add(self, observation: Observation) -> bool:
+        """Record an answer; True when the window's majority verdict flipped"""
+        self.items.append(observation)
+        cutoff = observation.timestamp_ms - self.window_seconds * 1000
+        while self.items and self.items[0].timestamp_ms < cutoff:
+            self.items.popleft()
+        present = self.presence_share() >= 0.5
+        flipped = self.state is not None and present != self.state
+        self.state = present
+        return flipped
+
+    def presence_share(self) -> float:
+        if not self.items:
+            return 0.0
+        return sum(1 for item in self.items if item.present) / len(self.items)
@@ -0,0 +1,114 @@
+"""
+Viewer Cache
+Thumbnail sprite sheet of the analyzed frames and full-resolution JPEGs of the
+detection frames, stored with the video's artifacts so the timeline viewer never
+has to open the video
+"""
+
+import os
+from typing import List, Optional, Tuple
+import cv2
+import numpy as np
+from app.utils.artifacts import ARTIFACT_DIR, artifact_path, load_json_artifact, save_json_artifact
+from app.utils.seek_index import FrameSeeker
+
+SPRITE_TILE_WIDTH = int(os.getenv("SPRITE_TILE_WIDTH", "160"))
+SPRITE_COLUMNS = int(os.getenv("SPRITE_COLUMNS", "10"))
+DETECTION_JPEG_QUALITY = int(os.getenv("DETECTION_JPEG_QUALITY", "92"))
+
+SPRITE_IMAGE = "viewer_sprite.jpg"
+SPRITE_INDEX = "viewer_sprite.json"
+
+
+def _write_jpeg(path: str, image: np.ndarray, quality: int):
+    ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("JPEG encoding failed")
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(buffer.tobytes())
+    os.replace(temp_path, path)
+
+
+class SpriteSheetBuilder:
+    """Collects one small tile per analyzed frame; save() lays them out in a grid"""
+
+    def __init__(self, tile_width: int = SPRITE_TILE_WIDTH, columns: int = SPRITE_COLUMNS):
+        self.tile_width = tile_width
+        self.tile_height = None
+        self.columns = columns
+        self.tiles: List[Tuple[int, int, np.ndarray]] = []
+
+    def add(self, frame: np.ndarray, frame_index: int, timestamp_ms: int):
+        if self.tile_height is None:
+            height, width = frame.shape[:2]
+            self.tile_height = max(1, round(height * self.tile_width / width))
+        tile = cv2.resize(frame, (self.tile_width, self.tile_height), interpolation=cv2.INTER_AREA)
+        self.tiles.append((timestamp_ms, frame_index, tile))
+
+    def save(self, content_hash: str) -> Optional[str]:
+        if not self.tiles:
+            return None
+        # Frames finish analysis out of order; the sheet is in playback order
+        self.tiles.sort(key=lambda t: t[0])
+        rows = (len(self.tiles) + self.columns - 1) // self.columns
+        sheet = np.zeros((rows * self.tile_height, self.columns * self.tile_width, 3), dtype=np.uint8)
+        entries = []
+        for position, (timestamp_ms, frame_index, tile) in enumerate(self.tiles):
+            x = (position % self.columns) * self.tile_width
+            y = (position // self.columns) * self.tile_height
+            sheet[y:y + self.tile_height, x:x + self.tile_width] = tile
+            entries.append({"timestamp_ms": timestamp_ms, "frame_index": frame_index, "x": x, "y": y})
+
+        path = artifact_path(content_hash, SPRITE_IMAGE)
+        _write_jpeg(path, sheet, 80)
+        save_json_artifact(content_hash, SPRITE_INDEX, {
+            "tile_width": self.tile_width, "tile_height": self.tile_height, "frames": entries
+        })
+        print(f"[🎞️ Viewer cache] Sprite sheet of {len(entries)} frames saved to {path}")
+        return path
+
+
+def load_sprite(content_hash: str) -> Optional[Tuple[str, dict]]:
+    """(sprite image path, index) or None when no run has saved one"""
+    index = load_json_artifact(content_hash, SPRITE_INDEX)
+    path = os.path.join(ARTIFACT_DIR, content_hash, SPRITE_IMAGE)
+    if index is None or not os.path.exists(path):
+        return None
+    return path, index
+
+
+def sprite_tile(index: dict, timestamp_ms: int) -> Optional[dict]:
+    """Sprite entry closest to the timestamp"""
+    if not index["frames"]:
+        return None
+    return min(index["frames"], key=lambda entry: abs(entry["timestamp_ms"] - timestamp_ms))
+
+
+def _detection_name(timestamp_ms: int) -> str:
+    return f"detection_{int(timestamp_ms)}.jpg"
+
+
+def detection_frame_path(content_hash: str, timestamp_ms: int) -> str:
+    return os.path.join(ARTIFACT_DIR, content_hash, _detection_name(timestamp_ms))
+
+
+def cache_detection_frames(video_path: str, content_hash: str, detections: List[Tuple[int, int]]) -> int:
+    """Decode each (frame_index, timestamp_ms) once, in frame order through the seek
+    index, and save it as a full-resolution JPEG. Frames cached by an earlier run are skipped."""
+    pending = sorted((index, ts) for index, ts in detections
+                     if not os.path.exists(detection_frame_path(content_hash, ts)))
+    if not pending:
+        return 0
+
+    seeker = FrameSeeker(video_path)
+    saved = 0
+    for frame_index, timestamp_ms in pending:
+        frame = seeker.read(frame_index)
+        if frame is None:
+            break
+        _write_jpeg(artifact_path(content_hash, _detection_name(timestamp_ms)), frame, DETECTION_JPEG_QUALITY)
+        saved += 1
+    seeker.close()
+    print(f"[🎞️ Viewer cache] Saved {saved} detection frames")
+    return saved
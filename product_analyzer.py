@@ -8,8 +8,8 @@ import json
 import re
 from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass, asdict
-from openai import AzureOpenAI
 from dotenv import load_dotenv
+from app.utils.llm_router import get_pool, get_route
 
 load_dotenv()
 
@@ -38,13 +38,12 @@ class ProductAnalyzer:
     """Advanced product analyzer using Azure OpenAI"""
     
     def __init__(self):
-        """Initialize Azure OpenAI client"""
-        self.client = AzureOpenAI(
-            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-            api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-01"),
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-        )
-        self.model = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4")
+        """Resolve Azure OpenAI routes (see app/utils/llm_router.py)"""
+        route = get_route("default")
+        self.client = route.client
+        self.model = route.deployment or "gpt-4"
+        # Short explanations go to the "explain" route, typically a small fast deployment
+        self.explain_pool = get_pool("explain")
     
     def analyze_product_reviews(self, product_title: str, price: float, 
                               mock_reviews: List[str] = None) -> ProductAnalysis:
@@ -236,8 +235,8 @@ class ProductAnalyzer:
         """
         
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
+            response = self.explain_pool.chat_completion(
+                estimated_tokens=250,
                 messages=[
                     {"role": "system", "content": "You are a concise product recommendation expert. Create brief, impactful explanations."},
                     {"role": "user", "content": prompt}
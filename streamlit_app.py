@@ -10,6 +10,12 @@ from app.mcp_server import invoke_tool
 from app.tools.price_compare import compare_prices, advanced_product_search, get_quantity_suggestions
 import asyncio
 from app.analyze import analyze_video_for_query_async  # Update path if needed
+from app.utils.media_store import MEDIA_EXTENSIONS, blob_hash_from_path, get_media_store
+from app.utils.artifacts import file_content_hash
+from app.utils.media_probe import probe_media
+from app.media_server import media_url, start_media_server
+from app.utils.viewer_cache import detection_frame_path, load_sprite, sprite_tile
+from app.utils.seek_index import FrameSeeker
 
 st.markdown("""
 <style>
@@ -37,15 +43,51 @@ def format_timestamp(ms):
     subseconds = int((total_seconds - int(total_seconds)) * 100)
     return f"{minutes:02}:{seconds:02}.{subseconds:02}"
 
+@st.cache_resource
+def media_server():
+    # One range-capable media endpoint per Streamlit process, shared by all sessions
+    try:
+        return start_media_server()
+    except OSError as e:
+        print(f"[⚠️ Media server] Could not start: {e}")
+        return None
+
+def sprite_thumbnails_html(sprite, timestamps):
+    # One tile of the sprite sheet per timestamp, cropped with CSS from a single image
+    sprite_path, index = sprite
+    url = media_url(sprite_path)
+    thumbs = ""
+    for ts in timestamps:
+        tile = sprite_tile(index, ts)
+        if tile is None:
+            continue
+        thumbs += (
+            f'<div title="{format_timestamp(ts)}" style="display:inline-block; margin:2px; '
+            f'width:{index["tile_width"]}px; height:{index["tile_height"]}px; '
+            f'background:url({url}) -{tile["x"]}px -{tile["y"]}px;"></div>'
+        )
+    return f'<div style="max-height:220px; overflow-y:auto;">{thumbs}</div>'
+
+def sprite_thumbnails(sprite, timestamps):
+    # Same tiles cut out here, for when there is no media server to serve the sprite sheet
+    sprite_path, index = sprite
+    sheet = cv2.imread(sprite_path)
+    thumbs, captions = [], []
+    for ts in timestamps:
+        tile = sprite_tile(index, ts)
+        if tile is None or sheet is None:
+            continue
+        thumbs.append(sheet[tile["y"]:tile["y"] + index["tile_height"], tile["x"]:tile["x"] + index["tile_width"]])
+        captions.append(format_timestamp(ts))
+    return thumbs, captions
+
 def extract_frame_at_timestamp(video_path, timestamp_ms):
     try:
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            return None
-        cap.set(cv2.CAP_PROP_POS_MSEC, int(timestamp_ms))
-        ret, frame = cap.read()
-        cap.release()
-        if not ret:
+        # Keyframe seek plus grab: lands on the exact analyzed frame, fast anywhere in the video
+        seeker = FrameSeeker(video_path)
+        frame = seeker.read_at_ms(timestamp_ms)
+        seeker.close()
+        if frame is None:
             return None
         return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
     except Exception as e:
@@ -69,9 +111,9 @@ st.markdown("""
 
 st.markdown("---")
 # === Session State ===
-for key in ["file_path", "file_type", "timestamps", "summary", "file_base64"]:
+for key in ["file_path", "file_type", "timestamps", "summary", "media_info", "stored_upload", "file_hash"]:
     if key not in st.session_state:
-        st.session_state[key] = None if key in ["file_path", "file_type"] else ""
+        st.session_state[key] = None if key in ["file_path", "file_type", "media_info", "stored_upload", "file_hash"] else ""
 
 import streamlit as st
 import os
@@ -80,6 +122,9 @@ import base64
 # === Setup ===
 UPLOAD_DIR = "uploaded_files"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+media_store = get_media_store()
+# Without it (e.g. the port is taken by another Streamlit process) players fall back to st.video
+media_server_running = media_server() is not None
 
 st.markdown("## 📤 Upload or Select Media")
 #st.caption("Supported formats: MP4, MOV, AVI, MKV, JPG, JPEG, PNG")
@@ -91,46 +136,61 @@ mode = st.radio("Choose Input Mode:", ["📤 Upload File", "📁 Select Existing
 uploaded_file = None
 selected_prev_file = "-- None --"
 file_to_use = None
+file_alias = None  # Media store name of file_to_use, None for files kept outside the store
 file_ext = None
 
-existing_files = sorted([
-    f for f in os.listdir(UPLOAD_DIR)
-    if f.lower().endswith((".mp4", "mov", "avi", "mkv", "jpg", "jpeg", "png"))
-])
+# Files placed in uploaded_files/ directly, plus every upload name kept by the media store
+loose_files = [f for f in os.listdir(UPLOAD_DIR) if f.lower().endswith(MEDIA_EXTENSIONS)]
+existing_files = sorted(set(loose_files) | set(media_store.aliases()))
 
 if mode == "📤 Upload File":
     uploaded_file = st.file_uploader("Upload an image or video")
 
     if uploaded_file:
-        file_path = os.path.join(UPLOAD_DIR, uploaded_file.name)
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.read())
-        file_to_use = file_path
-        file_ext = uploaded_file.name.split(".")[-1].lower()
-        if uploaded_file.name not in existing_files:
-            existing_files.append(uploaded_file.name)
+        # Streamlit reruns the script on every interaction: store each upload only once
+        upload_key = getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}:{uploaded_file.size}"
+        stored = st.session_state.stored_upload
+        if stored and stored["key"] == upload_key:
+            alias, file_to_use = stored["alias"], stored["path"]
+        else:
+            # Stored once by content hash in fixed-size chunks; the upload name becomes an alias
+            alias, file_to_use, duplicate = media_store.put_stream(uploaded_file, uploaded_file.name)
+            st.session_state.stored_upload = {"key": upload_key, "alias": alias, "path": file_to_use}
+            if duplicate:
+                earlier = [a for a in media_store.aliases_for(file_content_hash(file_to_use)) if a != alias]
+                st.info(f"♻️ Same content as {', '.join(earlier) or 'an earlier upload'}, reusing its stored copy and analysis data.")
+        file_alias = alias
+        file_ext = alias.split(".")[-1].lower()
+        if alias not in existing_files:
+            existing_files.append(alias)
 
 elif mode == "📁 Select Existing":
     selected_prev_file = st.selectbox("Select from uploaded files", ["-- None --"] + existing_files)
     if selected_prev_file != "-- None --":
-        file_to_use = os.path.join(UPLOAD_DIR, selected_prev_file)
+        file_to_use = media_store.resolve(selected_prev_file) or os.path.join(UPLOAD_DIR, selected_prev_file)
+        if media_store.resolve(selected_prev_file):
+            file_alias = selected_prev_file
         file_ext = selected_prev_file.split(".")[-1].lower()
 
+    if st.button("🧹 Clean up unused media"):
+        # Only blobs no name points to any more, and their analysis data, are removed
+        removed = media_store.gc()
+        st.success(f"Removed {removed['blobs']} unused files and {removed['artifact_dirs']} stale analysis caches.")
+
 # === Preview Selected File ===
 if file_to_use:
     with st.expander("📂 Preview Selected File", expanded=False):
         try:
-            with open(file_to_use, "rb") as f:
-                encoded = base64.b64encode(f.read()).decode("utf-8")
-
             if file_ext in ["jpg", "jpeg", "png"]:
-                st.image(f"data:image/{file_ext};base64,{encoded}", width=250)
+                st.image(file_to_use, width=250)
+
+            elif file_ext in ["mp4", "mov", "avi", "mkv"] and not media_server_running:
+                st.video(file_to_use)
 
             elif file_ext in ["mp4", "mov", "avi", "mkv"]:
-                mime_type = f"video/{'mp4' if file_ext == 'mp4' else 'quicktime'}"
+                # Streamed from the media server with range requests, nothing is embedded in the page
                 video_html = f"""
-                <video width="250" controls muted>
-                    <source src="data:{mime_type};base64,{encoded}" type="{mime_type}">
+                <video width="250" controls muted preload="metadata" src="{media_url(file_to_use)}">
                     Your browser does not support the video tag.
                 </video>
                 """
@@ -146,10 +206,10 @@ if file_to_use:
         is_image = file_ext in ["jpg", "jpeg", "png"]
         st.session_state.file_type = "video" if is_video else "image" if is_image else None
 
-        with open(file_to_use, "rb") as f:
-            file_bytes = f.read()
-            st.session_state.file_base64 = base64.b64encode(file_bytes).decode("utf-8")
-
+        # fps, frame count, duration and resolution are probed once per file content
+        if st.session_state.file_path != file_to_use or st.session_state.media_info is None:
+            st.session_state.media_info = probe_media(file_to_use)
+            st.session_state.file_hash = file_content_hash(file_to_use)
         st.session_state.file_path = file_to_use
     except Exception as e:
         st.error(f"⚠️ Error reading file: {e}")
@@ -213,16 +273,12 @@ if "selected_frame_caption" not in st.session_state:
 if (
     st.session_state.file_type == "video"
     and st.session_state.file_path
-    and st.session_state.file_base64
+    and st.session_state.media_info
     and st.session_state.summary
 ):
     #st.markdown("### 📊 Product Detection Timeline & Frame Viewer")
 
-    cap = cv2.VideoCapture(st.session_state.file_path)
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
-    duration_ms = (frame_count / fps) * 1000.0 if fps > 0 else 1
-    cap.release()
+    duration_ms = st.session_state.media_info.get("duration_ms") or 1
 
     markers = ""
     for ts in st.session_state.timestamps:
@@ -238,65 +294,70 @@ if (
 
         with col1:
             st.markdown("#### 🎬 Video Timeline")
-            st.markdown(
-                f"""
-                <div style="position:relative; width:640px; margin-bottom:8px;">
-                    <video id="videoPlayer" width="640" height="360" controls muted>
-                        <source src="data:video/mp4;base64,{st.session_state.file_base64}" type="video/mp4">
-                        Your browser does not support the video tag.
-                    </video>
-                    <div class="timeline-overlay">
-                        <div class="timeline-inner">
-                            {markers}{debug_marker}
+            if not media_server_running:
+                st.video(st.session_state.file_path)
+                if st.session_state.timestamps:
+                    st.caption("Detections at " + ", ".join(format_timestamp(ts) for ts in st.session_state.timestamps))
+            else:
+                st.markdown(
+                    f"""
+                    <div style="position:relative; width:640px; margin-bottom:8px;">
+                        <video id="videoPlayer" width="640" height="360" controls muted preload="metadata">
+                            <source src="{media_url(st.session_state.file_path)}">
+                            Your browser does not support the video tag.
+                        </video>
+                        <div class="timeline-overlay">
+                            <div class="timeline-inner">
+                                {markers}{debug_marker}
+                            </div>
                         </div>
                     </div>
-                </div>
-
-                <style>
-                .timeline-overlay {{
-                    position: absolute;
-                    bottom: 42px;
-                    width: 640px;
-                    height: 0;
-                    display: flex;
-                    justify-content: center;
-                    pointer-events: none;
-                }}
-                .timeline-inner {{
-                    width: 576px;
-                    height: 12px;
-                    position: relative;
-                }}
-                .marker {{
-                    position: absolute;
-                    width: 4px;
-                    height: 6px;
-                    background-color: yellow;
-                    box-shadow: 0 0 4px rgba(255, 255, 0, 0.9);
-                }}
-                .marker:hover::after {{
-                    content: attr(title);
-                    position: absolute;
-                    top: -28px;
-                    left: -10px;
-                    background: black;
-                    color: white;
-                    padding: 2px 5px;
-                    font-size: 10px;
-                    border-radius: 4px;
-                    white-space: nowrap;
-                }}
-                .debug-line {{
-                    position: absolute;
-                    width: 1px;
-                    height: 12px;
-                    background-color: red;
-                    opacity: 0.9;
-                }}
-                </style>
-                """,
-                unsafe_allow_html=True
-            )
+
+                    <style>
+                    .timeline-overlay {{
+                        position: absolute;
+                        bottom: 42px;
+                        width: 640px;
+                        height: 0;
+                        display: flex;
+                        justify-content: center;
+                        pointer-events: none;
+                    }}
+                    .timeline-inner {{
+                        width: 576px;
+                        height: 12px;
+                        position: relative;
+                    }}
+                    .marker {{
+                        position: absolute;
+                        width: 4px;
+                        height: 6px;
+                        background-color: yellow;
+                        box-shadow: 0 0 4px rgba(255, 255, 0, 0.9);
+                    }}
+                    .marker:hover::after {{
+                        content: attr(title);
+                        position: absolute;
+                        top: -28px;
+                        left: -10px;
+                        background: black;
+                        color: white;
+                        padding: 2px 5px;
+                        font-size: 10px;
+                        border-radius: 4px;
+                        white-space: nowrap;
+                    }}
+                    .debug-line {{
+                        position: absolute;
+                        width: 1px;
+                        height: 12px;
+                        background-color: red;
+                        opacity: 0.9;
+                    }}
+                    </style>
+                    """,
+                    unsafe_allow_html=True
+                )
 
         with col2:
             if st.session_state.timestamps:
@@ -304,11 +365,25 @@ if (
                 formatted_map = {format_timestamp(ts): ts for ts in st.session_state.timestamps}
                 formatted_list = list(formatted_map.keys())
 
+                # Saved by the analysis run when VIEWER_CACHE is on
+                sprite = load_sprite(st.session_state.file_hash) if st.session_state.file_hash else None
+                if sprite is not None and media_server_running:
+                    st.markdown(sprite_thumbnails_html(sprite, st.session_state.timestamps), unsafe_allow_html=True)
+                elif sprite is not None:
+                    thumbs, captions = sprite_thumbnails(sprite, st.session_state.timestamps)
+                    if thumbs:
+                        st.image(thumbs, caption=captions, channels="BGR")
+
                 selected_display = st.selectbox("Select timestamp", formatted_list, key="frame_ts_select")
 
                 if st.button("🔍 Show Frame at Timestamp"):
                     timestamp_ms = formatted_map[selected_display]
-                    frame = extract_frame_at_timestamp(st.session_state.file_path, timestamp_ms)
+                    cached_frame = detection_frame_path(st.session_state.file_hash, timestamp_ms) \
+                        if st.session_state.file_hash else None
+                    if cached_frame and os.path.exists(cached_frame):
+                        frame = cached_frame
+                    else:
+                        frame = extract_frame_at_timestamp(st.session_state.file_path, timestamp_ms)
                     if frame is not None:
                         st.session_state["selected_frame_img"] = frame
                         st.session_state["selected_frame_caption"] = f"🖼 Frame at {selected_display}"
@@ -503,10 +578,26 @@ if product_name and product_name.lower() != "unknown":
 # === Clear Session ===
 if st.session_state.file_path:
     if st.button("🧹 Clear Session & Delete File"):
+        file_path = st.session_state.file_path
         try:
-            os.remove(st.session_state.file_path)
-            st.success(f"🗑 File deleted: {st.session_state.file_path}")
+            if blob_hash_from_path(file_path) is None:
+                os.remove(file_path)
+                st.success(f"🗑 File deleted: {file_path}")
+            else:
+                # Stored blobs are shared by every name with the same content: drop this name and
+                # let gc delete the blob and its analysis data once no other name points at it
+                stored = st.session_state.stored_upload
+                alias = file_alias or (stored["alias"] if stored else None)
+                if not alias or media_store.resolve(alias) != file_path:
+                    raise ValueError("the stored upload name for this file is unknown")
+                media_store.remove_alias(alias)
+                media_store.gc()
+                if os.path.exists(file_path):
+                    others = media_store.aliases_for(blob_hash_from_path(file_path))
+                    st.success(f"🗑 Removed {alias}; the file is kept for {', '.join(others)}")
+                else:
+                    st.success(f"🗑 File deleted: {alias}")
         except Exception as e:
             st.warning(f"Could not delete file: {e}")
-        for key in ["file_path", "file_type", "timestamps", "summary", "file_base64"]:
-            st.session_state[key] = None if key in ["file_path", "file_type"] else ""
+        for key in ["file_path", "file_type", "timestamps", "summary", "media_info", "stored_upload", "file_hash"]:
+            st.session_state[key] = None if key in ["file_path", "file_type", "media_info", "stored_upload", "file_hash"] else ""
@@ -0,0 +1,21 @@
+from app.utils.answer_parsing import is_negative_verdict, stream_fields_complete
+
+
+def test_negative_verdict_needs_every_sentence_negative():
+    assert is_negative_verdict(" The requested product is not visible in this frame.")
+    assert not is_negative_verdict("No visible price tag, but Tide is on shelf 2.")
+    assert not is_negative_verdict("No visible price tag. Tide is on shelf 2.")
+    assert not is_negative_verdict("Tide is on the second shelf.")
+
+
+def test_fields_complete_only_after_direct_answer_line_ends():
+    # The direct answer line is still streaming: a positive clause may follow
+    assert not stream_fields_complete("Direct Answer: No visible price tag")
+    assert not stream_fields_complete("Direct Answer: No visible price tag, but Tide is on shelf 2\n")
+    assert stream_fields_complete("Direct Answer: The product is not visible in this frame.\n")
+
+
+def test_fields_complete_waits_for_product_name_on_positive_answers():
+    text = "Direct Answer: Tide is on shelf 2.\nReasoning: Orange bottles on the left.\n"
+    assert not stream_fields_complete(text)
+    assert stream_fields_complete(text + "product_name = Tide\n")
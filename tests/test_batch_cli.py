@@ -0,0 +1,97 @@
+import sys
+import json
+import time
+import types
+import asyncio
+import threading
+import pytest
+
+try:
+    import app.analyze  # noqa: F401
+except ImportError:
+    # The journal and scheduler don't need the pipeline's API and media dependencies;
+    # every test that runs jobs patches the analysis function anyway
+    stub = types.ModuleType("app.analyze")
+
+    async def analyze_video_for_query_async(video_path, user_question):
+        raise RuntimeError("analysis pipeline is not available")
+
+    stub.analyze_video_for_query_async = analyze_video_for_query_async
+    sys.modules["app.analyze"] = stub
+
+from app import batch_cli
+from app.batch_cli import Journal, run_batch
+
+
+def test_resume_skips_only_successful_jobs(tmp_path):
+    journal = Journal(str(tmp_path / "results.jsonl"))
+    assert journal.completed() == set()
+    journal.append({"file": "a.mp4", "question": "Where is Tide?", "status": "ok"})
+    journal.append({"file": "b.mp4", "question": "Where is Tide?", "status": "failed"})
+    assert journal.completed() == {("a.mp4", "Where is Tide?")}
+
+
+def test_torn_last_line_is_ignored(tmp_path):
+    path = tmp_path / "results.jsonl"
+    journal = Journal(str(path))
+    journal.append({"file": "a.mp4", "question": "q", "status": "ok"})
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"file": "b.mp4", "question": "q", "sta')
+    assert journal.completed() == {("a.mp4", "q")}
+    assert [r["file"] for r in journal.records()] == ["a.mp4"]
+
+
+def test_records_keep_the_latest_attempt(tmp_path):
+    journal = Journal(str(tmp_path / "results.jsonl"))
+    journal.append({"file": "a.mp4", "question": "q", "status": "failed"})
+    journal.append({"file": "a.mp4", "question": "q", "status": "ok"})
+    records = journal.records()
+    assert len(records) == 1 and records[0]["status"] == "ok"
+    assert json.loads((tmp_path / "results.jsonl").read_text().splitlines()[0])["status"] == "failed"
+
+
+def test_questions_on_one_file_run_one_at_a_time(tmp_path, monkeypatch):
+    active, overlaps, lock = {}, [], threading.Lock()
+
+    async def analyze(path, question):
+        with lock:
+            active[path] = active.get(path, 0) + 1
+            overlaps.append(active[path])
+        await asyncio.sleep(0.02)
+        with lock:
+            active[path] -= 1
+        return {"direct_answer": question}
+
+    monkeypatch.setattr(batch_cli, "analyze_video_for_query_async", analyze)
+    jobs = [(path, q) for path in ("a.mp4", "b.mp4") for q in ("q1", "q2", "q3")]
+    counts = run_batch(jobs, Journal(str(tmp_path / "results.jsonl")), concurrency=4)
+    assert counts == {"skipped": 0, "ok": 6, "failed": 0}
+    assert max(overlaps) == 1
+
+
+def _run_and_catch(path, question):
+    try:
+        batch_cli.run_job(path, question)
+    except asyncio.CancelledError:
+        return "cancelled"
+    return "finished"
+
+
+def test_stop_cancels_running_jobs(monkeypatch):
+    started = threading.Event()
+
+    async def analyze(path, question):
+        started.set()
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(batch_cli, "analyze_video_for_query_async", analyze)
+    monkeypatch.setattr(batch_cli, "_stop", threading.Event())
+    outcome = []
+    worker = threading.Thread(target=lambda: outcome.append(_run_and_catch("a.mp4", "q")))
+    worker.start()
+    assert started.wait(5)
+    begun = time.time()
+    batch_cli.stop_running_jobs()
+    worker.join(5)
+    assert not worker.is_alive() and time.time() - begun < 5
+    assert outcome == ["cancelled"]
@@ -0,0 +1,41 @@
+import asyncio
+import base64
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+
+import numpy as np
+from app.utils.frame_prep import FramePrepStage, payload_size, prepare_payload
+
+
+def test_payload_is_sized_to_what_the_model_uses():
+    assert payload_size(1080, 1920) == (768, 1365)
+    assert payload_size(3000, 1000) == (2048, 682)
+    assert payload_size(480, 640) == (480, 640)
+
+    frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+    decoded = cv2.imdecode(np.frombuffer(base64.b64decode(prepare_payload(frame)), np.uint8), cv2.IMREAD_COLOR)
+    assert decoded.shape == (768, 1365, 3)
+
+
+def test_cancelled_wait_for_a_slot_takes_no_slot():
+    async def run():
+        stage = FramePrepStage((64, 64, 3), workers=1, slots=1)
+        try:
+            held = stage.ring.free.get(timeout=5)
+            waiting = asyncio.ensure_future(stage.prepare(np.zeros((64, 64, 3), dtype=np.uint8)))
+            await asyncio.sleep(0.05)
+            assert stage.metrics.current["waiting_slot"] == 1
+            waiting.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiting
+            assert stage.metrics.current["waiting_slot"] == 0
+
+            stage.ring.release(held)
+            payload = await stage.prepare(np.zeros((64, 64, 3), dtype=np.uint8))
+            assert base64.b64decode(payload)[:2] == b"\xff\xd8"
+            assert stage.ring.free.get(timeout=5) == held
+        finally:
+            stage.close()
+
+    asyncio.run(run())
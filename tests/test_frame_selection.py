@@ -0,0 +1,30 @@
+import pytest
+
+pytest.importorskip("cv2")
+
+import numpy as np
+from app.utils import frame_selection
+from app.utils.frame_selection import CoverageSelector
+
+
+def select(shifts, monkeypatch, overlap_margin=0.3):
+    """Indices chosen per consider() call for a scripted sequence of (dx, dy) shifts"""
+    monkeypatch.setattr(frame_selection, "_gray_small", lambda frame: frame)
+    selector = CoverageSelector(overlap_margin)
+    steps = iter(shifts)
+    monkeypatch.setattr(selector, "_shift", lambda gray: next(steps))
+    frame = np.zeros((4, 4, 3), dtype=np.uint8)
+    chosen = [[index for _, index in selector.consider(frame, i)] for i in range(len(shifts) + 1)]
+    return chosen, [index for _, index in selector.finish()]
+
+
+def test_keeps_last_candidate_before_the_margin_is_crossed(monkeypatch):
+    chosen, last = select([(0.3, 0), (0.3, 0), (0.3, 0)], monkeypatch)
+    assert chosen == [[0], [], [], [2]]
+    assert last == [3]
+
+
+def test_fast_pan_keeps_both_sides_of_a_long_step(monkeypatch):
+    chosen, last = select([(0.2, 0), (1.5, 0), (0.05, 0)], monkeypatch)
+    assert chosen == [[0], [], [1, 2], []]
+    assert last == []
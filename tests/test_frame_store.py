@@ -0,0 +1,57 @@
+import os
+import pytest
+
+pytest.importorskip("cv2")
+
+import numpy as np
+from app.utils import artifacts, frame_store
+from app.utils.frame_store import FrameStoreWriter, load_frame_store
+
+
+@pytest.fixture(autouse=True)
+def artifact_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(artifacts, "ARTIFACT_DIR", str(tmp_path))
+    monkeypatch.setattr(frame_store, "ARTIFACT_DIR", str(tmp_path))
+    return tmp_path
+
+
+def _frames():
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 255, (48, 64, 3), dtype=np.uint8) for _ in range(4)]
+
+
+def test_round_trip():
+    frames = _frames()
+    writer = FrameStoreWriter("abc", "frames_w23_fixed_full")
+    for i, frame in enumerate(frames):
+        writer.add(frame, i * 23, i * 1000)
+    writer.finish(23.0, 92)
+
+    store = load_frame_store("abc", "frames_w23_fixed_full")
+    assert [index for _, index in store] == [0, 23, 46, 69]
+    assert all(np.array_equal(stored, frame) for (stored, _), frame in zip(store, frames))
+
+
+def test_interleaved_writers_publish_one_complete_store(artifact_dir):
+    frames = _frames()
+    first = FrameStoreWriter("abc", "frames_w23_fixed_full")
+    second = FrameStoreWriter("abc", "frames_w23_fixed_full")
+    assert first.temp_path != second.temp_path
+    for i, frame in enumerate(frames):
+        first.add(frame, i * 23, i * 1000)
+        second.add(frame, i * 23, i * 1000)
+    first.finish(23.0, 92)
+    second.finish(23.0, 92)
+
+    store = load_frame_store("abc", "frames_w23_fixed_full")
+    assert store is not None and len(store) == len(frames)
+    assert all(np.array_equal(stored, frame) for (stored, _), frame in zip(store, frames))
+    assert not [name for name in os.listdir(artifact_dir / "abc") if name.endswith(".tmp")]
+
+
+def test_abort_leaves_nothing_behind(artifact_dir):
+    writer = FrameStoreWriter("abc", "frames_w23_fixed_full")
+    writer.add(_frames()[0], 0, 0)
+    writer.abort()
+    assert os.listdir(artifact_dir / "abc") == []
+    assert load_frame_store("abc", "frames_w23_fixed_full") is None
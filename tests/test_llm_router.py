@@ -0,0 +1,79 @@
+import pytest
+
+pytest.importorskip("openai")
+
+from app.utils.llm_router import CircuitBreaker, EndpointPool, RateLimitBucket, Route
+
+
+def make_route(name="d@e", failure_threshold=2, cooldown_seconds=0.0):
+    return Route(
+        site="frame_vision", deployment="d", endpoint="e", api_key="k", api_version="v",
+        bucket=RateLimitBucket(name, 10_000, 100),
+        breaker=CircuitBreaker(name, failure_threshold=failure_threshold, cooldown_seconds=cooldown_seconds),
+    )
+
+
+def test_breaker_opens_after_threshold_and_closes_on_success():
+    breaker = CircuitBreaker("b", failure_threshold=2, cooldown_seconds=60)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.allow() is None
+    breaker.opened_at -= 60
+    breaker.record_success(breaker.allow())
+    assert breaker.state == "closed"
+
+
+def test_half_open_allows_a_single_trial():
+    breaker = CircuitBreaker("b", failure_threshold=1, cooldown_seconds=0)
+    breaker.record_failure()
+    assert breaker.state == "half_open"
+    trial = breaker.allow()
+    assert trial is not None and trial.trial
+    assert breaker.allow() is None
+    breaker.record_failure(trial)
+    assert breaker.allow() is not None
+
+
+def test_only_the_trial_settles_a_half_open_breaker():
+    breaker = CircuitBreaker("b", failure_threshold=1, cooldown_seconds=0)
+    earlier = breaker.allow()  # Admitted while closed, finishes after the ejection
+    breaker.record_failure()
+    trial = breaker.allow()
+
+    breaker.release_trial(earlier)
+    assert breaker.allow() is None
+    breaker.record_success(earlier)
+    assert breaker.opened_at is not None
+    breaker.record_failure(earlier)
+    assert breaker.openings == 1
+
+    breaker.record_success(trial)
+    assert breaker.state == "closed"
+
+
+def test_released_trial_can_be_claimed_again():
+    # A trial that was picked but never sent must not keep the endpoint ejected
+    route = make_route(failure_threshold=1)
+    route.record_failure()
+    pool = EndpointPool("frame_vision", [route])
+    trial = pool.pick()
+    assert trial.breaker is route.breaker and trial.ticket.trial
+    assert pool.pick() is None
+    trial.release()
+    assert pool.pick() is not None
+
+
+def test_local_errors_say_nothing_about_the_endpoint():
+    route = make_route(failure_threshold=1)
+    route.record_failure()
+    route.record_error(FileNotFoundError("frame.jpg"))
+    assert route.breaker.opened_at is not None
+
+
+def test_acquire_blocking_reserves_bucket_capacity():
+    route = make_route()
+    pool = EndpointPool("frame_vision", [route])
+    assert pool.acquire_blocking(500).bucket is route.bucket
+    assert route.bucket.load() == (1, 500)
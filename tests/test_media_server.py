@@ -0,0 +1,27 @@
+from app.media_server import _parse_range
+
+
+def test_no_or_malformed_header_serves_whole_file():
+    assert _parse_range(None, 100) is None
+    assert _parse_range("", 100) is None
+    assert _parse_range("bytes=-", 100) is None
+    assert _parse_range("bytes=0-9,20-29", 100) is None
+    assert _parse_range("items=0-9", 100) is None
+
+
+def test_explicit_and_open_ended_ranges():
+    assert _parse_range("bytes=0-9", 100) == (0, 9)
+    assert _parse_range("bytes=50-", 100) == (50, 99)
+    assert _parse_range(" bytes=90-150 ", 100) == (90, 99)
+
+
+def test_suffix_ranges():
+    assert _parse_range("bytes=-10", 100) == (90, 99)
+    assert _parse_range("bytes=-500", 100) == (0, 99)
+
+
+def test_unsatisfiable_ranges():
+    assert _parse_range("bytes=100-", 100) == (-1, -1)
+    assert _parse_range("bytes=20-10", 100) == (-1, -1)
+    assert _parse_range("bytes=-0", 100) == (-1, -1)
+    assert _parse_range("bytes=-10", 0) == (-1, -1)
@@ -0,0 +1,43 @@
+import io
+import os
+import pytest
+from app.utils import media_store
+from app.utils.media_store import MediaStore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(media_store, "ARTIFACT_DIR", str(tmp_path / "artifacts"))
+    return MediaStore(str(tmp_path / "media"))
+
+
+def _artifact_dir(tmp_path, content_hash):
+    directory = tmp_path / "artifacts" / content_hash
+    directory.mkdir(parents=True)
+    (directory / "inventory.json").write_text("{}")
+    return directory
+
+
+def test_duplicate_upload_reuses_the_blob(store):
+    alias, path, duplicate = store.put_stream(io.BytesIO(b"video"), "shelf.mp4")
+    again, again_path, again_duplicate = store.put_stream(io.BytesIO(b"video"), "copy.mp4")
+    assert (duplicate, again_duplicate) == (False, True)
+    assert path == again_path and store.aliases_for(os.path.basename(path)[:64]) == ["copy.mp4", "shelf.mp4"]
+
+
+def test_gc_removes_only_unreferenced_blobs_and_their_artifacts(store, tmp_path):
+    _, path, _ = store.put_stream(io.BytesIO(b"video"), "shelf.mp4")
+    store.put_stream(io.BytesIO(b"video"), "copy.mp4")
+    content_hash = os.path.basename(path)[:64]
+    owned = _artifact_dir(tmp_path, content_hash)
+    # Analysis data of a file the store never held, e.g. from a batch run
+    foreign = _artifact_dir(tmp_path, "f" * 64)
+
+    store.remove_alias("shelf.mp4")
+    assert store.gc()["blobs"] == 0
+    assert os.path.exists(path) and owned.exists()
+
+    store.remove_alias("copy.mp4")
+    assert store.gc() == {"blobs": 1, "artifact_dirs": 1, "partial_uploads": 0}
+    assert not os.path.exists(path) and not owned.exists()
+    assert foreign.exists()
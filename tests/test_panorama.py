@@ -0,0 +1,46 @@
+import pytest
+
+pytest.importorskip("cv2")
+
+import numpy as np
+from app.utils import panorama
+from app.utils.panorama import _select_stitch_frames, stitch_panoramas
+
+
+def _sampled(count):
+    frames = [np.full((100, 200, 3), i, dtype=np.uint8) for i in range(count)]
+    return frames, [i * 23 for i in range(count)], [i * 1000 for i in range(count)]
+
+
+def _motion(lost_before):
+    # Every frame moves a third of the frame width, except the ones after a cut
+    def estimate(prev_frame, frame):
+        return None if int(frame[0, 0, 0]) in lost_before else (-70.0, 0.0)
+    return estimate
+
+
+def test_single_frame_run_after_a_cut_is_a_leftover(monkeypatch):
+    monkeypatch.setattr(panorama, "estimate_translation", _motion({2, 3}))
+    groups, leftovers = _select_stitch_frames(*_sampled(5))
+    assert [[item[1] for item in group] for group in groups] == [[0, 23], [69, 92]]
+    assert [item[1] for item in leftovers] == [46]
+
+
+def test_one_frame_chunk_remainder_is_a_leftover(monkeypatch):
+    monkeypatch.setattr(panorama, "estimate_translation", _motion(set()))
+    monkeypatch.setattr(panorama, "PANORAMA_MAX_FRAMES", 2)
+    groups, leftovers = _select_stitch_frames(*_sampled(5))
+    assert [len(group) for group in groups] == [2, 2]
+    assert [item[1] for item in leftovers] == [92]
+
+
+def test_frames_of_a_failed_stitch_are_returned(monkeypatch):
+    class FailingStitcher:
+        def stitch(self, images):
+            return panorama.cv2.Stitcher_ERR_NEED_MORE_IMGS, None
+
+    monkeypatch.setattr(panorama, "estimate_translation", _motion({2}))
+    monkeypatch.setattr(panorama.cv2, "Stitcher_create", lambda mode: FailingStitcher())
+    panoramas, leftovers = stitch_panoramas(*_sampled(4))
+    assert panoramas == []
+    assert [(item[1], item[2]) for item in leftovers] == [(0, 0), (23, 1000), (46, 2000), (69, 3000)]
@@ -0,0 +1,48 @@
+import pytest
+
+pytest.importorskip("cv2")
+
+from app.utils.shelf_share import ShelfRegion, compute_shelf_share, dedupe_regions, match_product, parse_regions
+
+
+def test_overlapping_blocks_of_one_product_count_once():
+    regions = [
+        ShelfRegion("Tide", 0.0, 0.0, 0.5, 1.0),
+        ShelfRegion("Tide", 0.25, 0.0, 0.5, 1.0),
+        ShelfRegion("Ariel", 0.5, 0.0, 1.0, 1.0),
+    ]
+    assert compute_shelf_share(regions, grid=100) == {"Tide": 50.0, "Ariel": 50.0}
+
+
+def test_cells_claimed_by_two_products_are_split():
+    regions = [ShelfRegion("Tide", 0.0, 0.0, 0.6, 1.0), ShelfRegion("Ariel", 0.4, 0.0, 1.0, 1.0)]
+    assert compute_shelf_share(regions, grid=100) == {"Ariel": 50.0, "Tide": 50.0}
+
+
+def test_separate_clusters_add_up():
+    regions = [ShelfRegion("Tide", 0.0, 0.0, 1.0, 1.0), ShelfRegion("Ariel", 12.0, 0.0, 13.0, 0.5)]
+    shares = compute_shelf_share(regions, grid=50)
+    assert shares["Tide"] == pytest.approx(66.7, abs=0.1)
+    assert shares["Ariel"] == pytest.approx(33.3, abs=0.1)
+
+
+def test_dedupe_keeps_largest_block_per_product_and_position():
+    regions = [
+        ShelfRegion("Tide", 0.0, 0.0, 0.5, 0.5),
+        ShelfRegion("tide", 0.05, 0.0, 0.5, 0.5),
+        ShelfRegion("Ariel", 0.05, 0.0, 0.5, 0.5),
+    ]
+    kept = dedupe_regions(regions)
+    assert sorted(r.product for r in kept) == ["Ariel", "Tide"]
+
+
+def test_parse_regions_scales_and_skips_bad_boxes():
+    text = '{"regions": [{"product": "Tide", "box": [0, 100, 500, 900]}, {"product": "X", "box": [5, 5, 5]}]}'
+    assert parse_regions(text, 3) == [ShelfRegion("Tide", 0.0, 0.1, 0.5, 0.9, 3)]
+
+
+def test_match_product_needs_the_brand_not_a_shared_generic_word():
+    shares = {"Tide Original 1.5 L": 40.0, "Ariel Original": 35.0, "Persil": 25.0}
+    assert match_product(shares, "What share of the shelf does Tide have?") == "Tide Original 1.5 L"
+    assert match_product(shares, "How much space does the original pack take?") is None
+    assert match_product(shares, "Share of Ariel Original?") == "Ariel Original"
@@ -0,0 +1,32 @@
+import pytest
+
+pytest.importorskip("cv2")
+
+from app.utils.stream_monitor import Observation, RollingWindow
+
+
+def test_first_answer_sets_state_without_flipping():
+    window = RollingWindow("Is Tide on the shelf?")
+    assert window.add(Observation(0, True, "yes")) is False
+    assert window.state is True
+
+
+def test_flip_reported_once_majority_changes():
+    window = RollingWindow("Is Tide on the shelf?", window_seconds=3600)
+    window.add(Observation(0, True, "yes"))
+    window.add(Observation(1000, True, "yes"))
+    assert window.add(Observation(2000, False, "no")) is False
+    # Two of four absent: a tie counts as present
+    assert window.add(Observation(3000, False, "no")) is False
+    assert window.add(Observation(4000, False, "no")) is True
+    assert window.state is False
+    assert window.add(Observation(5000, False, "no")) is False
+
+
+def test_old_answers_age_out_of_the_window():
+    window = RollingWindow("Is Tide on the shelf?", window_seconds=10)
+    window.add(Observation(0, True, "yes"))
+    window.add(Observation(5000, True, "yes"))
+    assert window.add(Observation(20000, False, "no")) is True
+    assert [item.timestamp_ms for item in window.items] == [20000]
+    assert window.presence_share() == 0.0
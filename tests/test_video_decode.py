@@ -0,0 +1,22 @@
+import pytest
+
+pytest.importorskip("cv2")
+
+from app.utils.video_decode import plan_segments
+
+
+def test_segments_cover_every_frame_once_in_order():
+    segments = plan_segments(1000, 23, 12)
+    assert segments[0][0] == 0 and segments[-1][1] == 1000
+    assert all(end == next_start for (_, end), (next_start, _) in zip(segments, segments[1:]))
+
+
+def test_segment_starts_are_window_aligned():
+    for total, window, count in [(1000, 23, 12), (1801, 5, 48), (50, 7, 16)]:
+        assert all(start % window == 0 for start, _ in plan_segments(total, window, count))
+
+
+def test_never_more_segments_than_windows():
+    assert plan_segments(50, 23, 16) == [(0, 23), (23, 46), (46, 50)]
+    assert plan_segments(10, 23, 4) == [(0, 10)]
+    assert plan_segments(0, 23, 4) == []